@@ -61,8 +61,12 @@ selected_language = st.sidebar.selectbox(
 
 
 import backend_utils as bu
+import streamlit_adapter
 import plotly.express as px
 import os
+from datetime import datetime, timedelta
+
+RAW_DATA_MAX_ROWS = 5000
 
 # if not os.getenv("GEMINI_API_KEY"):
 #     st.error("Please set the GEMINI_API_KEY environment variable with your Google Gemini API key.")
@@ -71,7 +75,7 @@ import os
 
 
 
-bu.init_db()
+streamlit_adapter.setup()
 
 
 if "app_ready" not in st.session_state:
@@ -131,22 +135,22 @@ with st.sidebar:
                 competitor_name,
                 subreddits_list
             )
-            competitor_df = bu.get_all_mentions_as_df(competitor_name)
-            pending_comp = competitor_df[competitor_df["sentiment"].isnull()]
+            pending_comp = bu.get_pending_mentions(competitor_name)
 
             if not pending_comp.empty:
                     texts = pending_comp["text"].tolist()
-                    analyses = bu.analyze_in_batches(texts, batch_size=5)
-
-                    for i, row in enumerate(pending_comp.itertuples()):
-                        analysis = analyses[i]
+                    analyses = bu.analyze_in_batches(texts, fallback=False)
 
-                        bu.update_mention_analysis(
+                    bu.update_mentions_analysis_bulk(
+                        (
                             row.id,
                             analysis.get("sentiment", "Neutral"),
                             analysis.get("topic", "Unknown"),
                             analysis.get("urgency", "Low")
                         )
+                        for row, analysis in zip(pending_comp.itertuples(), analyses)
+                        if analysis is not None
+                    )
 
             st.success(f"Fetched data for {competitor_name}")
             st.rerun()
@@ -155,25 +159,47 @@ with st.sidebar:
 
 
    
-    all_data_df = bu.get_all_mentions_as_df(st.session_state.brand_name)
-    pending_df = all_data_df[all_data_df["sentiment"].isnull()]
+    pending_count = bu.count_pending(st.session_state.brand_name)
+
+    st.info(f"**{pending_count}** mentions pending analysis")
+
+    duplicate_count = bu.count_duplicates(st.session_state.brand_name)
 
-    st.info(f"**{len(pending_df)}** mentions pending analysis")
+    if duplicate_count:
+        st.caption(f"{duplicate_count} near-duplicate mentions linked to an earlier post and skipped")
 
-    if not pending_df.empty:
-        if st.button(f"Analyze {len(pending_df)} Pending Mentions"):
+    last_worker_fetch = bu.get_last_job_time(st.session_state.brand_name, "fetch")
+
+    if last_worker_fetch:
+        st.caption(f"Background worker last fetched at {datetime.fromtimestamp(last_worker_fetch):%Y-%m-%d %H:%M}")
+
+    if pending_count:
+        if st.button(f"Analyze {pending_count} Pending Mentions"):
             progress = st.progress(0, text="Analyzing mentions...")
-            total = len(pending_df)
+            pending_df = bu.get_pending_mentions(st.session_state.brand_name)
 
             texts = pending_df["text"].tolist()
             
             # analyses = bu.batch_analyze_texts(texts)
-            analyses = bu.analyze_in_batches(texts, batch_size=10)
+            analyses = bu.analyze_in_batches(
+                texts,
+                fallback=False,
+                progress_callback=lambda done, total: progress.progress(
+                    done / total,
+                    text=f"Analyzed {done}/{total}"
+                )
+            )
+
+            updates = []
 
-            
             for i, row in enumerate(pending_df.itertuples()):
                 if i < len(analyses):
                     analysis = analyses[i]
+
+                    # No usable answer: leave it pending for a later run.
+                    if analysis is None:
+                        continue
+
                     sentiment = analysis.get("sentiment", "Neutral")
                     topic = analysis.get("topic", "Unknown")
                     urgency = analysis.get("urgency", "Low")
@@ -181,24 +207,38 @@ with st.sidebar:
                     sentiment = "Neutral"
                     topic = "Unknown"
                     urgency = "Low"
-                
-                bu.update_mention_analysis(
-                    row.id, sentiment, topic, urgency
-                )
 
-                progress.progress(
-                    (i + 1) / total,
-                    text=f"Updating {i + 1}/{total}"
+                updates.append((row.id, sentiment, topic, urgency))
+
+            bu.update_mentions_analysis_bulk(
+                updates,
+                chunk_size=200,
+                progress_callback=lambda done, total: progress.progress(
+                    done / total,
+                    text=f"Updating {done}/{total}"
                 )
+            )
 
             progress.empty()
-            st.success("Analysis complete!")
+
+            if len(updates) < len(pending_df):
+                st.warning(f"{len(pending_df) - len(updates)} mentions got no AI answer and stay pending.")
+            else:
+                st.success("Analysis complete!")
+
             st.rerun()
 
 
 st.title(f"Reputation Dashboard: {st.session_state.brand_name}")
 
-analyzed_df = all_data_df.dropna(subset=["sentiment"]).copy()
+recent_alerts = bu.get_recent_alerts(
+    st.session_state.brand_name,
+    since=(datetime.now() - timedelta(days=1)).timestamp(),
+    limit=5
+)
+
+for alert in recent_alerts.to_dict("records"):
+    st.warning(f"{datetime.fromtimestamp(alert['created_at']):%Y-%m-%d %H:%M} - {bu.describe_alert(alert)}")
 
 tab1, tab2 = st.tabs(["Main Dashboard", "Raw Data"])
 
@@ -206,7 +246,7 @@ tab1, tab2 = st.tabs(["Main Dashboard", "Raw Data"])
 with tab1:
     st.header("Overall Brand Sentiment")
 
-    sentiment_counts = analyzed_df["sentiment"].value_counts()
+    sentiment_counts = bu.get_sentiment_counts(st.session_state.brand_name)
 
     if not sentiment_counts.empty:
         fig_pie = px.pie(
@@ -225,8 +265,7 @@ with tab1:
     else:
         st.write("No sentiment data available yet.")
 
-    topics_exploded = analyzed_df["topic"].str.split(",").explode().str.strip()
-    topic_counts = topics_exploded.value_counts()
+    topic_counts = bu.get_topic_counts(st.session_state.brand_name)
 
     if not topic_counts.empty:
         fig_bar = px.bar(
@@ -237,18 +276,64 @@ with tab1:
             labels={"x": "Topic", "y": "Count"}
         )
         st.plotly_chart(fig_bar, use_container_width=True)
-        
+
+    st.header("Sentiment Trend")
+
+    trend_cols = st.columns(3)
+
+    with trend_cols[0]:
+        trend_granularity = st.selectbox("Bucket", ["day", "hour"], format_func=str.title)
+
+    trend_windows = [7, 30, 90, 365]
+
+    # Trends are cut to bu.TREND_MAX_BUCKETS buckets, so hourly buckets only
+    # offer windows that fit.
+    if trend_granularity == "hour":
+        trend_windows = [days for days in trend_windows if days * 24 <= bu.TREND_MAX_BUCKETS]
+
+    with trend_cols[1]:
+        trend_days = st.selectbox("Window", trend_windows, index=1, format_func=lambda days: f"Last {days} days")
+
+    with trend_cols[2]:
+        trend_rolling = st.slider("Rolling average (buckets)", 1, 30, 7)
+
+    trend_end = datetime.now()
+    trend_df = bu.get_sentiment_trend(
+        st.session_state.brand_name,
+        trend_granularity,
+        start=trend_end - timedelta(days=trend_days),
+        end=trend_end,
+        rolling_window=trend_rolling,
+    )
+
+    if trend_df["total"].any():
+        fig_trend = px.line(
+            trend_df.reset_index(),
+            x="bucket",
+            y=["Positive_rolling", "Negative_rolling", "Neutral_rolling", "high_urgency_rolling"],
+            title="Mentions per bucket (rolling average)",
+            labels={"bucket": "", "value": "Mentions", "variable": ""},
+            color_discrete_map={
+                "Positive_rolling": "green",
+                "Negative_rolling": "red",
+                "Neutral_rolling": "blue",
+                "high_urgency_rolling": "orange"
+            }
+        )
+        st.plotly_chart(fig_trend, use_container_width=True)
+    else:
+        st.write("No analyzed mentions in this window.")
+
     if "competitor" in st.session_state:
 
         competitor_name = st.session_state.competitor
 
-        competitor_df = bu.get_all_mentions_as_df(competitor_name)
-        competitor_analyzed = competitor_df.dropna(subset=["sentiment"])
+        competitor_analyzed = bu.get_analyzed_mentions_as_df(competitor_name)
       
         if not competitor_analyzed.empty:
 
-            brand_score = bu.calculate_competitive_score(analyzed_df)
-            competitor_score = bu.calculate_competitive_score(competitor_analyzed)
+            brand_score = bu.get_competitive_score(st.session_state.brand_name)
+            competitor_score = bu.get_competitive_score(competitor_name)
 
             st.divider()
             st.header("Competitive Performance")
@@ -287,15 +372,16 @@ with tab1:
             # AI Summary
             st.header("Competition Analysis")
 
-            summary = bu.generate_competition_summary(
-                analyzed_df,
-                competitor_analyzed,
-                st.session_state.brand_name,
-                competitor_name
+            st.write_stream(
+                bu.generate_competition_summary(
+                    bu.get_analyzed_mentions_as_df(st.session_state.brand_name),
+                    competitor_analyzed,
+                    st.session_state.brand_name,
+                    competitor_name,
+                    stream=True
+                )
             )
 
-            st.markdown(summary)
-
 
     st.divider()
     st.header("Automated Summaries")
@@ -306,48 +392,105 @@ with tab1:
         if st.button("Positive Summary"):
             with st.spinner("Generating positive summary..."):
                 # st.markdown(bu.generate_positive_report_summary(analyzed_df))
-                summary = bu.generate_positive_report_summary(analyzed_df)
+                if languages[selected_language] == "English":
+                    st.write_stream(
+                        bu.generate_positive_report_summary(
+                            bu.get_analyzed_mentions_as_df(st.session_state.brand_name),
+                            stream=True,
+                            brand_name=st.session_state.brand_name
+                        )
+                    )
+                else:
+                    summary = bu.generate_positive_report_summary(
+                        bu.get_analyzed_mentions_as_df(st.session_state.brand_name),
+                        brand_name=st.session_state.brand_name
+                    )
 
-                translated_summary = translate_ui(
-                summary,
-                languages[selected_language]
-                )
+                    translated_summary = translate_ui(
+                        summary,
+                        languages[selected_language]
+                    )
 
-                st.markdown(translated_summary)
+                    st.markdown(translated_summary)
 
 
     with col2:
         if st.button("Negative Summary"):
             with st.spinner("Generating negative summary..."):
                 # st.markdown(bu.generate_negative_report_summary(analyzed_df))
-                summary = bu.generate_negative_report_summary(analyzed_df)
+                if languages[selected_language] == "English":
+                    st.write_stream(
+                        bu.generate_negative_report_summary(
+                            bu.get_analyzed_mentions_as_df(st.session_state.brand_name),
+                            stream=True,
+                            brand_name=st.session_state.brand_name
+                        )
+                    )
+                else:
+                    summary = bu.generate_negative_report_summary(
+                        bu.get_analyzed_mentions_as_df(st.session_state.brand_name),
+                        brand_name=st.session_state.brand_name
+                    )
 
-                translated_summary = translate_ui(
-                    summary,
-                    languages[selected_language]
-                )
+                    translated_summary = translate_ui(
+                        summary,
+                        languages[selected_language]
+                    )
 
-                st.markdown(translated_summary)
+                    st.markdown(translated_summary)
 
 
     with col3:
         if st.button("Suggestion Summary"):
             with st.spinner("Generating suggestion summary..."):
                 # st.markdown(bu.generate_report_summary(analyzed_df))
-                summary = bu.generate_report_summary(analyzed_df)
+                if languages[selected_language] == "English":
+                    st.write_stream(
+                        bu.generate_report_summary(
+                            bu.get_analyzed_mentions_as_df(st.session_state.brand_name),
+                            stream=True,
+                            brand_name=st.session_state.brand_name
+                        )
+                    )
+                else:
+                    summary = bu.generate_report_summary(
+                        bu.get_analyzed_mentions_as_df(st.session_state.brand_name),
+                        brand_name=st.session_state.brand_name
+                    )
 
-                translated_summary = translate_ui(
-                    summary,
-                    languages[selected_language]
-                )
+                    translated_summary = translate_ui(
+                        summary,
+                        languages[selected_language]
+                    )
 
-                st.markdown(translated_summary)
+                    st.markdown(translated_summary)
 
 
 with tab2:
-    st.header("All Raw Mentions")
+    st.header("Raw Mentions")
+
+    raw_range = st.date_input(
+        "Date range",
+        value=(datetime.now().date() - timedelta(days=30), datetime.now().date())
+    )
+
+    if isinstance(raw_range, (list, tuple)) and len(raw_range) == 2:
+        raw_start, raw_end = raw_range
+    else:
+        raw_start = raw_end = raw_range[0] if isinstance(raw_range, (list, tuple)) else raw_range
+
+    raw_df = bu.get_mentions_in_range(
+        st.session_state.brand_name,
+        start=raw_start,
+        end=raw_end + timedelta(days=1),
+        limit=RAW_DATA_MAX_ROWS
+    )
+
+    if len(raw_df) == RAW_DATA_MAX_ROWS:
+        st.caption(f"Showing the newest {RAW_DATA_MAX_ROWS} mentions in this range.")
+
     st.dataframe(
-        all_data_df,
+        raw_df,
         use_container_width=True,
         hide_index=True
     )
@@ -1,18 +1,22 @@
+import functools
+import logging
 import sqlite3
+import threading
 import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
+import hashlib
+import heapq
+import itertools
 import json
+import re
+import numpy as np
 import pandas as pd
-import requests
-import streamlit as st
-import google.genai as genai
 import os
-from groq import Groq
 import sys
+from urllib.parse import urlparse
 from dotenv import load_dotenv
-if os.path.exists(".env"):
-
-    load_dotenv()  
 
 
 
@@ -44,625 +48,4200 @@ else:
 
 
 
-API_KEY = None
+# This module never imports streamlit, requests or the provider SDKs at
+# import time, so workers and scripts load it quickly and run without a Streamlit
+# runtime. Settings are read on first use from the environment (and .env);
+# a host app can override them with configure(), as streamlit_adapter does
+# with st.secrets.
+CONFIG_DEFAULTS = {
+    "GEMINI_API_KEY": None,
+    "GROQ_API_KEY": None,
+    "LLM_REQUESTS_PER_MINUTE": "30",
+    "LLM_TOKENS_PER_MINUTE": "30000",
+}
+
+_config = None
+_config_overrides = {}
+_config_lock = threading.Lock()
+
+
+def get_config():
+    global _config
+
+    with _config_lock:
+        if _config is None:
+            if os.path.exists(".env"):
+                load_dotenv()
+
+            config = {key: os.getenv(key, default) for key, default in CONFIG_DEFAULTS.items()}
+            config.update(_config_overrides)
+            _config = config
+
+        return _config
+
+
+def get_setting(key):
+    return get_config().get(key)
+
+
+def configure(**settings):
+    """Overrides settings such as GROQ_API_KEY; empty values are ignored."""
+    global _config
+
+    with _config_lock:
+        _config_overrides.update({key: value for key, value in settings.items() if value})
+        _config = None
+
+    get_gemini_client.clear()
+    get_groq_client.clear()
+
+
+def has_llm_credentials():
+    return bool(get_setting("GROQ_API_KEY") or get_setting("GEMINI_API_KEY"))
+
+
+# Backend errors and warnings go to the "brand_monitor" logger and to any
+# notify hooks (the Streamlit adapter shows them in the page); counters go
+# to metric hooks, e.g. a StatsD or Prometheus client.
+log = logging.getLogger("brand_monitor")
+
+_notify_hooks = []
+_metric_hooks = []
+
+
+def add_notify_hook(hook):
+    """hook(level, message) is called for every warning or error."""
+    if hook not in _notify_hooks:
+        _notify_hooks.append(hook)
+
+
+def add_metric_hook(hook):
+    """hook(name, value, tags) is called for every recorded metric."""
+    if hook not in _metric_hooks:
+        _metric_hooks.append(hook)
+
+
+def notify(level, message):
+    log.log(level, message)
+
+    for hook in list(_notify_hooks):
+        try:
+            hook(level, message)
+        except Exception:
+            log.exception("Notify hook failed")
+
+
+def record_metric(name, value=1, **tags):
+    for hook in list(_metric_hooks):
+        try:
+            hook(name, value, tags)
+        except Exception:
+            log.exception("Metric hook failed")
+
+
+def cache_resource(func):
+    """
+    Process-wide memoization for shared resources (clients, pools, caches),
+    standing in for st.cache_resource. func.clear() drops the cached values.
+    """
+    values = {}
+    lock = threading.Lock()
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        with lock:
+            if args not in values:
+                values[args] = func(*args)
+            return values[args]
+
+    wrapper.clear = values.clear
+
+    return wrapper
+
+
+@cache_resource
+def get_gemini_client():
+    import google.genai as genai
+
+    return genai.Client(api_key=get_setting("GEMINI_API_KEY"))
+
+
+@cache_resource
+def get_groq_client():
+    from groq import Groq
+
+    return Groq(api_key=get_setting("GROQ_API_KEY"))
+
+
+DB_BUSY_TIMEOUT = 5.0
+
+# WAL lets readers keep going while a writer commits; NORMAL sync is safe
+# under WAL and drops the fsync on every commit.
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}",
+)
+
+
+class ConnectionPool:
+    """Hands out one tuned SQLite connection per thread for a database file."""
+
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self.local = threading.local()
+
+    def get(self):
+        conn = getattr(self.local, "conn", None)
+
+        if conn is None:
+            conn = sqlite3.connect(self.db_name, timeout=DB_BUSY_TIMEOUT)
+
+            for pragma in DB_PRAGMAS:
+                conn.execute(pragma)
+
+            self.local.conn = conn
+
+        return conn
+
+    def close(self):
+        conn = getattr(self.local, "conn", None)
+
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+
+@cache_resource
+def get_db_pool(db_name):
+    return ConnectionPool(db_name)
+
+
+def get_connection():
+    """
+    Returns the calling thread's pooled connection. Use it as
+    `with get_connection() as conn:` to commit or roll back on exit.
+    """
+    return get_db_pool(DB_NAME).get()
+
+
+
+
+
+
+
+
+
+
+# Each migration moves the schema to the given PRAGMA user_version. Append
+# new entries; never edit one that has already shipped. A statement may also
+# be a callable taking the connection, for data migrations.
+SCHEMA_MIGRATIONS = [
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS mentions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            brand TEXT NOT NULL,
+            source TEXT NOT NULL,
+            text TEXT NOT NULL,
+            url TEXT UNIQUE,
+            timestamp DATETIME,
+            sentiment TEXT,
+            topic TEXT,
+            urgency TEXT
+        )
+        """,
+    ]),
+    (2, [
+        "CREATE INDEX IF NOT EXISTS idx_mentions_brand_timestamp ON mentions (brand, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_mentions_pending ON mentions (brand, id) WHERE sentiment IS NULL",
+    ]),
+    (3, [
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+        "INSERT OR IGNORE INTO meta (key, value) VALUES ('analysis_rev', 0)",
+        "ALTER TABLE mentions ADD COLUMN analysis_rev INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS idx_mentions_brand_rev ON mentions (brand, analysis_rev)",
+    ]),
+    (4, [
+        """
+        CREATE TABLE IF NOT EXISTS classification_cache (
+            key TEXT PRIMARY KEY,
+            sentiment TEXT,
+            topic TEXT,
+            urgency TEXT,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_classification_cache_last_used ON classification_cache (last_used)",
+    ]),
+    (5, [
+        """
+        CREATE TABLE IF NOT EXISTS report_cache (
+            brand TEXT NOT NULL,
+            report_type TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (brand, report_type)
+        )
+        """,
+    ]),
+    (6, [
+        """
+        CREATE TABLE IF NOT EXISTS summary_chunk_cache (
+            key TEXT PRIMARY KEY,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_summary_chunk_cache_last_used ON summary_chunk_cache (last_used)",
+    ]),
+    (7, [
+        "ALTER TABLE mentions ADD COLUMN simhash INTEGER",
+        "ALTER TABLE mentions ADD COLUMN canonical_id INTEGER",
+        """
+        CREATE TABLE IF NOT EXISTS simhash_index (
+            brand TEXT NOT NULL,
+            band_key INTEGER NOT NULL,
+            mention_id INTEGER NOT NULL,
+            simhash INTEGER NOT NULL,
+            PRIMARY KEY (brand, band_key, mention_id)
+        ) WITHOUT ROWID
+        """,
+        "DROP INDEX IF EXISTS idx_mentions_pending",
+        "CREATE INDEX IF NOT EXISTS idx_mentions_pending ON mentions (brand, id) WHERE sentiment IS NULL AND canonical_id IS NULL",
+        lambda conn: backfill_simhash_index_in(conn),
+    ]),
+    (8, [
+        """
+        CREATE TABLE IF NOT EXISTS fetch_cursors (
+            brand TEXT NOT NULL,
+            subreddit TEXT NOT NULL,
+            source TEXT NOT NULL,
+            last_created_utc REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (brand, subreddit, source)
+        )
+        """,
+    ]),
+    (9, [
+        """
+        CREATE TABLE IF NOT EXISTS worker_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            brand TEXT NOT NULL,
+            subreddit TEXT,
+            status TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            started_at REAL,
+            finished_at REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_worker_jobs_brand_kind ON worker_jobs (brand, kind, finished_at)",
+        "CREATE INDEX IF NOT EXISTS idx_worker_jobs_status ON worker_jobs (status)",
+    ]),
+    (10, [
+        """
+        CREATE TABLE IF NOT EXISTS sentiment_rollup (
+            brand TEXT NOT NULL,
+            granularity TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            sentiment TEXT NOT NULL,
+            urgency TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (brand, granularity, bucket, sentiment, urgency)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS topic_rollup (
+            brand TEXT NOT NULL,
+            day TEXT NOT NULL,
+            topic TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (brand, day, topic)
+        ) WITHOUT ROWID
+        """,
+        lambda conn: rebuild_rollups_in(conn),
+    ]),
+    (11, [
+        """
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            brand TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            value REAL NOT NULL,
+            baseline REAL NOT NULL,
+            zscore REAL NOT NULL,
+            window_mentions INTEGER NOT NULL,
+            window_start TEXT NOT NULL,
+            window_end TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_alerts_brand_created ON alerts (brand, created_at)",
+    ]),
+    (12, [
+        "ALTER TABLE worker_jobs ADD COLUMN worker TEXT",
+    ]),
+    (13, [
+        "DROP INDEX IF EXISTS idx_mentions_pending",
+        "CREATE INDEX IF NOT EXISTS idx_mentions_pending_time ON mentions (brand, timestamp, id) "
+        "WHERE sentiment IS NULL AND canonical_id IS NULL",
+    ]),
+    # Databases that went through migration 7 before it backfilled the index.
+    (14, [
+        lambda conn: backfill_simhash_index_in(conn),
+    ]),
+]
+
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def init_db():
+    conn = get_connection()
+
+    if get_schema_version(conn) >= SCHEMA_VERSION:
+        return
+
+    with conn:
+        # Take the write lock before re-reading the version so two sessions
+        # starting at once don't both apply the same migration.
+        conn.execute("BEGIN IMMEDIATE")
+
+        version = get_schema_version(conn)
+
+        for target, statements in SCHEMA_MIGRATIONS:
+            if target <= version:
+                continue
+
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+
+            conn.execute(f"PRAGMA user_version={target}")
+            log.info("Applied schema migration %s", target)
+
+
+# Queries that run on every dashboard rerun. check_query_plans() flags any of
+# them that SQLite would answer with a full table scan or a temporary sort.
+HOT_QUERIES = {
+    "mentions_by_brand": (
+        "SELECT * FROM mentions WHERE brand=? ORDER BY timestamp DESC",
+        ("brand",),
+    ),
+    "pending_by_brand": (
+        "SELECT id, timestamp, text FROM mentions WHERE brand=? AND sentiment IS NULL AND canonical_id IS NULL "
+        "ORDER BY timestamp, id",
+        ("brand",),
+    ),
+    "pending_count": (
+        "SELECT COUNT(*) FROM mentions WHERE brand=? AND sentiment IS NULL AND canonical_id IS NULL",
+        ("brand",),
+    ),
+    "new_mentions_since": (
+        "SELECT id FROM mentions WHERE id > ? AND id <= ? AND +brand = ?",
+        (0, 0, "brand"),
+    ),
+    "reanalyzed_mentions_since": (
+        "SELECT id FROM mentions WHERE brand=? AND analysis_rev > ? AND analysis_rev <= ?",
+        ("brand", 0, 0),
+    ),
+    "mentions_in_range": (
+        "SELECT * FROM mentions WHERE brand=? AND timestamp >= ? AND timestamp < ? "
+        "ORDER BY timestamp DESC LIMIT ?",
+        ("brand", "2024-01-01", "2024-02-01", 1000),
+    ),
+    "sentiment_trend": (
+        "SELECT bucket, sentiment, urgency, count FROM sentiment_rollup "
+        "WHERE brand=? AND granularity=? AND bucket >= ? AND bucket <= ?",
+        ("brand", "day", "2024-01-01", "2024-02-01"),
+    ),
+    "simhash_candidates": (
+        "SELECT mention_id, simhash FROM simhash_index WHERE brand=? AND band_key IN (?, ?, ?, ?)",
+        ("brand", 0, 1, 2, 3),
+    ),
+}
+
+
+def explain_query_plan(sql, params=()):
+    with get_connection() as conn:
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def check_query_plans():
+    """Returns {query_name: plan} for every hot query that is not index-backed."""
+    problems = {}
+
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = explain_query_plan(sql, params)
+
+        if any(step.startswith("SCAN ") or "TEMP B-TREE" in step for step in plan):
+            problems[name] = plan
+
+    return problems
+
+
+
+
+def get_analysis_rev(conn):
+    return conn.execute("SELECT value FROM meta WHERE key='analysis_rev'").fetchone()[0]
+
+
+def next_analysis_rev(conn):
+    """Bumps the analysis revision counter inside the caller's transaction."""
+    conn.execute("UPDATE meta SET value = value + 1 WHERE key='analysis_rev'")
+    return get_analysis_rev(conn)
+
+
+# Near-duplicate detection: 64-bit SimHash over unigrams and bigrams. Two
+# texts within SIMHASH_MAX_DISTANCE bits are treated as the same post. With
+# the hash split into SIMHASH_BANDS bands, any such pair shares at least one
+# band exactly, so candidates are found by band lookups instead of all pairs.
+# Texts with fewer than SIMHASH_MIN_FEATURES distinct features (short posts,
+# or scripts written without spaces) hash too coarsely to be linked.
+SIMHASH_BITS = 64
+SIMHASH_MAX_DISTANCE = 3
+SIMHASH_BANDS = 4
+SIMHASH_MIN_FEATURES = 8
+
+SIMHASH_BIT_POSITIONS = np.arange(SIMHASH_BITS, dtype=np.uint64)
+
+
+def simhash_features(text):
+    words = re.sub(r"https?://\S+", " ", text.casefold())
+    words = re.findall(r"[\w']+", words)
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def simhash(text):
+    return simhash_of_features(simhash_features(text))
+
+
+def linkable_simhash(text):
+    """Returns (simhash, linkable): linkable if text has SIMHASH_MIN_FEATURES distinct features."""
+    features = simhash_features(text)
+    return simhash_of_features(features), len(set(features)) >= SIMHASH_MIN_FEATURES
+
+
+def simhash_of_features(features):
+    if not features:
+        return 0
+
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big") for feature in features],
+        dtype=np.uint64,
+    )
+    bits = (hashes[:, None] >> SIMHASH_BIT_POSITIONS) & np.uint64(1)
+    votes = (bits.astype(np.int64) * 2 - 1).sum(axis=0)
+
+    return int(((votes > 0).astype(np.uint64) << SIMHASH_BIT_POSITIONS).sum())
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def simhash_bands(value):
+    width = SIMHASH_BITS // SIMHASH_BANDS
+    mask = (1 << width) - 1
+    return [(band, (value >> (band * width)) & mask) for band in range(SIMHASH_BANDS)]
+
+
+def collapse_near_duplicates(df):
+    """
+    Keeps one row per group of near-duplicate texts (the oldest, when df has
+    ids) and adds a dup_count column with the size of each group. Texts too
+    short to link always stand alone.
+    """
+    if df.empty:
+        return df.assign(dup_count=pd.Series(dtype=int))
+
+    if "id" in df.columns:
+        df = df.sort_values("id")
+
+    hashes = [linkable_simhash(text) for text in df["text"].tolist()]
+    buckets = {}
+    canonical = list(range(len(hashes)))
+
+    for index, (value, linkable) in enumerate(hashes):
+        if not linkable:
+            continue
+
+        for band in simhash_bands(value):
+            for other in buckets.get(band, ()):
+                if canonical[other] == other and hamming_distance(value, hashes[other][0]) <= SIMHASH_MAX_DISTANCE:
+                    canonical[index] = other
+                    break
+
+            if canonical[index] != index:
+                break
+
+        if canonical[index] == index:
+            for band in simhash_bands(value):
+                buckets.setdefault(band, []).append(index)
+
+    counts = pd.Series(canonical).value_counts()
+    keep = sorted(counts.index)
+
+    collapsed = df.iloc[keep].copy()
+    collapsed["dup_count"] = counts.loc[keep].to_numpy()
+
+    return collapsed
+
+
+# Persistent form of the same index: every canonical mention stores one
+# simhash_index row per band, keyed by (band number, band bits), so a new
+# mention is compared only against mentions sharing one of its bands.
+# SQLite integers are signed, hence the conversions.
+dedup_stats = {"checked": 0, "duplicates": 0}
+_dedup_stats_lock = threading.Lock()
+
+
+def to_signed64(value):
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned64(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def simhash_band_keys(value):
+    width = SIMHASH_BITS // SIMHASH_BANDS
+    return [(band << width) | bits for band, bits in simhash_bands(value)]
+
+
+def find_near_duplicate(conn, brand_name, value):
+    """Returns the id of a stored canonical mention within SIMHASH_MAX_DISTANCE of value, if any."""
+    candidates = conn.execute(
+        "SELECT mention_id, simhash FROM simhash_index WHERE brand=? AND band_key IN (?, ?, ?, ?)",
+        (brand_name, *simhash_band_keys(value)),
+    ).fetchall()
+
+    best = None
+
+    for mention_id, stored in candidates:
+        distance = hamming_distance(value, to_unsigned64(stored))
+
+        if distance <= SIMHASH_MAX_DISTANCE and (best is None or (distance, mention_id) < best):
+            best = (distance, mention_id)
+
+    return best[1] if best else None
+
+
+def index_simhash(conn, brand_name, mention_id, value):
+    conn.executemany(
+        "INSERT OR IGNORE INTO simhash_index (brand, band_key, mention_id, simhash) VALUES (?, ?, ?, ?)",
+        [(brand_name, key, mention_id, to_signed64(value)) for key in simhash_band_keys(value)],
+    )
+
+
+def get_dedup_stats():
+    with _dedup_stats_lock:
+        stats = dict(dedup_stats)
+
+    stats["dedup_rate"] = stats["duplicates"] / stats["checked"] if stats["checked"] else 0.0
+
+    return stats
+
+
+def count_duplicates(brand_name):
+    with get_connection() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM mentions WHERE brand=? AND canonical_id IS NOT NULL",
+            (brand_name,),
+        ).fetchone()[0]
+
+
+def backfill_simhash_index_in(conn, brand_name=None, chunk_size=5000, commit=False):
+    """
+    Hashes and indexes mentions stored before the index existed. They are
+    only indexed, never relinked, since some may already be analyzed. Texts
+    too short to link are hashed but not indexed.
+    """
+    sql = "SELECT id, brand, text FROM mentions WHERE simhash IS NULL AND canonical_id IS NULL"
+    params = ()
+
+    if brand_name is not None:
+        sql += " AND brand=?"
+        params = (brand_name,)
+
+    done = 0
+
+    while True:
+        rows = conn.execute(f"{sql} ORDER BY id LIMIT {int(chunk_size)}", params).fetchall()
+
+        if not rows:
+            break
+
+        for mention_id, brand, text in rows:
+            value, linkable = linkable_simhash(text)
+            conn.execute("UPDATE mentions SET simhash=? WHERE id=?", (to_signed64(value), mention_id))
+
+            if linkable:
+                index_simhash(conn, brand, mention_id, value)
+
+        if commit:
+            conn.commit()
+
+        done += len(rows)
+
+    return done
+
+
+def backfill_simhash_index(brand_name=None, chunk_size=5000):
+    """Runs backfill_simhash_index_in, committing after each chunk."""
+    with get_connection() as conn:
+        return backfill_simhash_index_in(conn, brand_name, chunk_size, commit=True)
+
+
+def add_mention(brand_name, source, text, url, timestamp):
+    return add_mentions([(brand_name, source, text, url, timestamp)]) > 0
+
+
+def add_mentions(rows):
+    """
+    Inserts a batch of (brand, source, text, url, timestamp) rows in one
+    transaction. Rows whose url is already stored are skipped by the UNIQUE
+    constraint. A row whose text is a near-duplicate of a stored mention of
+    the same brand is linked to it through canonical_id and is never queued
+    for analysis; texts too short to hash reliably are never linked or
+    indexed. Returns the number of rows actually inserted.
+    """
+    rows = list(rows)
+
+    if not rows:
+        return 0
+
+    hashes = [linkable_simhash(row[2]) for row in rows]
+    inserted = 0
+    duplicates = 0
+
+    with get_connection() as conn:
+        for (brand_name, source, text, url, timestamp), (value, linkable) in zip(rows, hashes):
+            canonical_id = find_near_duplicate(conn, brand_name, value) if linkable else None
+
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO mentions (brand, source, text, url, timestamp, simhash, canonical_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (brand_name, source, text, url, timestamp, to_signed64(value), canonical_id),
+            )
+
+            if not cursor.rowcount:
+                continue
+
+            inserted += 1
+
+            if canonical_id is not None:
+                duplicates += 1
+            elif linkable:
+                index_simhash(conn, brand_name, cursor.lastrowid, value)
+
+        conn.commit()
+
+    with _dedup_stats_lock:
+        dedup_stats["checked"] += inserted
+        dedup_stats["duplicates"] += duplicates
+
+    record_metric("dedup.checked", inserted)
+    record_metric("dedup.duplicates", duplicates)
+
+    for brand_name in {row[0] for row in rows}:
+        invalidate_mention_cache(brand_name)
+
+    return inserted
+
+
+MENTION_COLUMNS = "id, brand, source, text, url, timestamp, sentiment, topic, urgency, canonical_id"
+
+# How long a brand's cached DataFrame is trusted without asking the DB
+# whether another process has written to it.
+MENTION_CACHE_CHECK_INTERVAL = 2.0
+
+
+def parse_mention_timestamps(df):
+    if "timestamp" in df.columns:
+        df["timestamp"] = pd.to_datetime(df["timestamp"])
+    return df
+
+
+class MentionCache:
+    """
+    Keeps each brand's mention DataFrame in memory and refreshes it from the
+    DB incrementally: rows with an id above the last one seen are appended and
+    rows whose analysis_rev moved past the last seen revision are patched.
+    The analyzed-only frame is derived on first request and kept until the
+    full frame changes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def invalidate(self, brand_name=None):
+        with self.lock:
+            if brand_name is None:
+                entries = self.entries.values()
+            else:
+                entries = [self.entries[brand_name]] if brand_name in self.entries else []
+
+            for entry in entries:
+                entry["stale"] = True
+
+    def get(self, brand_name, analyzed=False):
+        with self.lock:
+            entry = self.entries.get(brand_name)
+
+            if (
+                entry is None
+                or entry["stale"]
+                or time.monotonic() - entry["checked_at"] >= MENTION_CACHE_CHECK_INTERVAL
+            ):
+                entry = self.refresh(brand_name, entry)
+                self.entries[brand_name] = entry
+
+            if not analyzed:
+                return entry["df"]
+
+            if entry["analyzed_df"] is None:
+                entry["analyzed_df"] = entry["df"].dropna(subset=["sentiment"])
+
+            return entry["analyzed_df"]
+
+    def refresh(self, brand_name, entry):
+        with get_connection() as conn:
+            # One read transaction so the id/revision bounds and the rows
+            # they select come from the same snapshot.
+            conn.execute("BEGIN")
+
+            max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM mentions").fetchone()[0]
+            rev = get_analysis_rev(conn)
+
+            if entry is None:
+                df = pd.read_sql_query(
+                    f"SELECT {MENTION_COLUMNS} FROM mentions WHERE brand=? AND id <= ? ORDER BY timestamp DESC",
+                    conn,
+                    params=(brand_name, max_id),
+                )
+                df = parse_mention_timestamps(df)
+
+            elif max_id == entry["max_id"] and rev == entry["rev"]:
+                df = entry["df"]
+
+            else:
+                new_df = pd.read_sql_query(
+                    f"SELECT {MENTION_COLUMNS} FROM mentions WHERE id > ? AND id <= ? AND +brand = ? ORDER BY timestamp DESC",
+                    conn,
+                    params=(entry["max_id"], max_id, brand_name),
+                )
+                changed_df = pd.read_sql_query(
+                    "SELECT id, sentiment, topic, urgency FROM mentions "
+                    "WHERE brand=? AND analysis_rev > ? AND analysis_rev <= ? AND id <= ?",
+                    conn,
+                    params=(brand_name, entry["rev"], rev, entry["max_id"]),
+                )
+                df = merge_mention_changes(entry["df"], parse_mention_timestamps(new_df), changed_df)
+
+        return {
+            "df": df,
+            "analyzed_df": entry["analyzed_df"] if entry is not None and df is entry["df"] else None,
+            "max_id": max_id,
+            "rev": rev,
+            "checked_at": time.monotonic(),
+            "stale": False,
+        }
+
+
+def merge_mention_changes(df, new_df, changed_df):
+    """Returns a new frame; the cached one may still be in use by another session."""
+    if not changed_df.empty:
+        df = df.copy()
+
+        positions = pd.Index(df["id"]).get_indexer(changed_df["id"])
+        found = positions >= 0
+
+        for column in ("sentiment", "topic", "urgency"):
+            df[column] = df[column].astype(object)
+            df.iloc[positions[found], df.columns.get_loc(column)] = changed_df[column].to_numpy()[found]
+
+    if not new_df.empty:
+        df = new_df if df.empty else pd.concat([new_df, df], ignore_index=True)
+
+        if not df["timestamp"].is_monotonic_decreasing:
+            df = df.sort_values("timestamp", ascending=False, kind="stable", ignore_index=True)
+
+    return df
+
+
+@cache_resource
+def get_mention_cache(db_name):
+    return MentionCache()
+
+
+def invalidate_mention_cache(brand_name=None):
+    get_mention_cache(DB_NAME).invalidate(brand_name)
+
+
+def get_all_mentions_as_df(brand_name):
+    """
+    Returns the brand's mentions, newest first, from the shared in-memory
+    cache. The frame is shared between sessions, so callers must copy it
+    before modifying it.
+    """
+    return get_mention_cache(DB_NAME).get(brand_name)
+
+
+def get_analyzed_mentions_as_df(brand_name):
+    """
+    The brand's analyzed mentions, newest first, from the same cache. Shared
+    like get_all_mentions_as_df, and rebuilt only after the brand's mentions
+    change.
+    """
+    return get_mention_cache(DB_NAME).get(brand_name, analyzed=True)
+
+
+def get_pending_mentions(brand_name, limit=None, after=None):
+    """
+    Returns only the id, timestamp and text of the brand's unanalyzed
+    canonical mentions, oldest post first, optionally only those after the
+    (timestamp, id) pair after. Near-duplicates are left out. Oldest first
+    keeps write-backs in post time order for the alert engine.
+    """
+    sql = "SELECT id, timestamp, text FROM mentions WHERE brand=? AND sentiment IS NULL AND canonical_id IS NULL"
+    params = [brand_name]
+
+    if after is not None:
+        sql += " AND (timestamp, id) > (?, ?)"
+        params.extend([after[0], int(after[1])])
+
+    sql += " ORDER BY timestamp, id"
+
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+
+    with get_connection() as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+
+def format_bound(value):
+    """Formats a date or datetime bound the way mention timestamps are stored."""
+    return pd.Timestamp(value).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def get_mentions_in_range(brand_name, start=None, end=None, limit=None):
+    """
+    Returns the brand's mentions with start <= timestamp < end, newest first,
+    filtered in SQL on the (brand, timestamp) index. Bounds are optional.
+    """
+    sql = f"SELECT {MENTION_COLUMNS} FROM mentions WHERE brand=?"
+    params = [brand_name]
+
+    if start is not None:
+        sql += " AND timestamp >= ?"
+        params.append(format_bound(start))
+
+    if end is not None:
+        sql += " AND timestamp < ?"
+        params.append(format_bound(end))
+
+    sql += " ORDER BY timestamp DESC"
+
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+
+    with get_connection() as conn:
+        return parse_mention_timestamps(pd.read_sql_query(sql, conn, params=params))
+
+
+def count_pending(brand_name):
+    with get_connection() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM mentions WHERE brand=? AND sentiment IS NULL AND canonical_id IS NULL",
+            (brand_name,),
+        ).fetchone()[0]
+
+
+
+
+
+
+
+
+PULLPUSH_URL = "https://api.pullpush.io/reddit/search/submission/"
+REDDIT_JSON_URL = "https://www.reddit.com/r/{subreddit}/new.json"
+REDLIB_URL = "https://redlib.perennialte.ch/r/{subreddit}/new.json"
+
+# Subreddits are fetched concurrently, but every source host keeps its own
+# concurrency limit and minimum spacing between requests instead of the old
+# global sleep after each subreddit.
+FETCH_MAX_WORKERS = 8
+
+HOST_LIMITS = {
+    "api.pullpush.io": {"concurrency": 4, "min_interval": 0.5},
+    "www.reddit.com": {"concurrency": 2, "min_interval": 1.0},
+    "redlib.perennialte.ch": {"concurrency": 2, "min_interval": 1.0},
+}
+
+DEFAULT_HOST_LIMIT = {"concurrency": 2, "min_interval": 1.0}
+
+RATE_LIMIT_BACKOFF = 10
+
+# Each (brand, subreddit, source) keeps a cursor at the newest created_utc
+# stored from it; fetches only ask for posts after it. A brand seen for the
+# first time is backfilled FETCH_BACKFILL_DAYS, at most FETCH_MAX_PAGES pages
+# per call.
+FETCH_PAGE_SIZE = 100
+FETCH_MAX_PAGES = 10
+FETCH_BACKFILL_DAYS = 30
+
+
+class HostLimiter:
+    """Caps in-flight requests to one host and spaces them by min_interval."""
+
+    def __init__(self, concurrency, min_interval):
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def __enter__(self):
+        self.semaphore.acquire()
+
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.next_slot - now)
+            self.next_slot = max(now, self.next_slot) + self.min_interval
+
+        if wait:
+            time.sleep(wait)
+
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.semaphore.release()
+
+    def backoff(self, seconds=RATE_LIMIT_BACKOFF):
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+
+_host_limiters = {}
+_host_limiters_lock = threading.Lock()
+_http_local = threading.local()
+
+
+def get_host_limiter(url):
+    host = urlparse(url).netloc
+
+    with _host_limiters_lock:
+        limiter = _host_limiters.get(host)
+
+        if limiter is None:
+            limits = HOST_LIMITS.get(host, DEFAULT_HOST_LIMIT)
+            limiter = HostLimiter(limits["concurrency"], limits["min_interval"])
+            _host_limiters[host] = limiter
+
+    return limiter
+
+
+def reset_host_limiters():
+    with _host_limiters_lock:
+        _host_limiters.clear()
+
+
+def get_http_session():
+    session = getattr(_http_local, "session", None)
+
+    if session is None:
+        import requests
+
+        session = requests.Session()
+        session.headers.update({
+            "User-Agent": "BrandMonitor/1.0"
+        })
+        _http_local.session = session
+
+    return session
+
+
+def limited_get(url, **kwargs):
+    limiter = get_host_limiter(url)
+
+    with limiter:
+        response = get_http_session().get(url, **kwargs)
+
+    if response.status_code == 429:
+        limiter.backoff()
+
+    return response
+
+
+def get_fetch_cursor(brand_name, sub_name, source):
+    """Returns the newest created_utc already stored from this source, or None."""
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT last_created_utc FROM fetch_cursors WHERE brand=? AND subreddit=? AND source=?",
+            (brand_name, sub_name.lower(), source),
+        ).fetchone()
+
+    return row[0] if row else None
+
+
+def advance_fetch_cursor(brand_name, sub_name, source, created_utc):
+    with get_connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO fetch_cursors (brand, subreddit, source, last_created_utc, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (brand, subreddit, source) DO UPDATE SET
+                last_created_utc = MAX(last_created_utc, excluded.last_created_utc),
+                updated_at = excluded.updated_at
+            """,
+            (brand_name, sub_name.lower(), source, created_utc, time.time()),
+        )
+        conn.commit()
+
+
+def post_created_utc(post):
+    try:
+        return float(post.get("created_utc"))
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch_pullpush_posts(brand_name, sub_name, cursor):
+    """
+    Pages through PullPush oldest first, starting just before the cursor
+    (or FETCH_BACKFILL_DAYS back), so consecutive pages never leave a gap.
+    A backfill longer than FETCH_MAX_PAGES pages resumes on the next call.
+    """
+    after = cursor if cursor is not None else time.time() - FETCH_BACKFILL_DAYS * 86400
+    posts = []
+
+    for _ in range(FETCH_MAX_PAGES):
+
+        params = {
+            "subreddit": sub_name,
+            "q": brand_name,
+            "size": FETCH_PAGE_SIZE,
+            "sort": "asc",
+            "sort_type": "created_utc",
+            # One second of overlap so posts sharing the cursor's timestamp
+            # are not lost; the url constraint drops the repeats.
+            "after": int(after) - 1,
+        }
+
+        response = limited_get(PULLPUSH_URL, params=params, timeout=15)
+
+        # Pages already read are contiguous from the cursor, so they are
+        # still safe to store when a later page fails.
+        if response.status_code == 429:
+            log.warning("PullPush rate limited, switching to fallback")
+            return posts or None
+
+        if response.status_code != 200:
+            log.warning("PullPush failed: %s", response.status_code)
+            return posts or None
+
+        page = response.json().get("data", [])
+        posts.extend(page)
+
+        newest = max((post_created_utc(post) or 0 for post in page), default=0)
+
+        if len(page) < FETCH_PAGE_SIZE or newest <= after:
+            break
+
+        after = newest
+
+    return posts
+
+
+def fetch_listing_posts(url, cursor):
+    """
+    Pages through a Reddit-style /new listing, newest first, until it
+    reaches the cursor. Without a cursor, only the first page is read. These
+    listings cannot start at a timestamp, so a gap older than FETCH_MAX_PAGES
+    pages is not recovered.
+    """
+    posts = []
+    params = {"limit": FETCH_PAGE_SIZE}
+
+    for _ in range(FETCH_MAX_PAGES if cursor is not None else 1):
+
+        response = limited_get(url, params=params, timeout=15)
+
+        if response.status_code != 200:
+            log.warning("Listing failed: %s %s", url, response.status_code)
+            return None
+
+        listing = response.json().get("data", {})
+        page = [item.get("data", {}) for item in listing.get("children", [])]
+        posts.extend(page)
+
+        reached_cursor = any((post_created_utc(post) or 0) <= cursor for post in page) if cursor is not None else True
+
+        if reached_cursor or not listing.get("after"):
+            break
+
+        params = {"limit": FETCH_PAGE_SIZE, "after": listing["after"]}
+
+    return posts
+
+
+FETCH_SOURCES = [
+    ("pullpush", "Using PullPush"),
+    ("reddit_json", "Using Reddit JSON fallback"),
+    ("redlib", "Using Redlib fallback"),
+]
+
+
+def fetch_source_posts(source, brand_name, sub_name, cursor):
+    if source == "pullpush":
+        return fetch_pullpush_posts(brand_name, sub_name, cursor)
+
+    url = REDDIT_JSON_URL if source == "reddit_json" else REDLIB_URL
+
+    return fetch_listing_posts(url.format(subreddit=sub_name), cursor)
+
+
+def fetch_subreddit_data(brand_name, sub_name):
+    """
+    Fetches the subreddit's posts newer than the stored cursor, trying each
+    source in turn. Returns {"source", "posts"} or None if every source failed.
+    """
+    for source, message in FETCH_SOURCES:
+
+        try:
+            cursor = get_fetch_cursor(brand_name, sub_name, source)
+            posts = fetch_source_posts(source, brand_name, sub_name, cursor)
+
+        except Exception as e:
+            log.warning("%s failed: %s", source, e)
+            continue
+
+        if posts is not None:
+            log.info(message)
+            return {"source": source, "posts": posts}
+
+    return None
+
+
+def store_subreddit_posts(brand_name, sub_name, data, processed_urls=None):
+    """
+    Stores the brand's mentions among the posts fetch_subreddit_data
+    returned, then advances that source's cursor. Returns the number of rows
+    added. processed_urls, when given, skips posts already seen this run.
+    """
+    if processed_urls is None:
+        processed_urls = set()
+
+    rows = []
+    newest = None
+
+    for post in data["posts"]:
+
+        created = post_created_utc(post)
+
+        if created is not None:
+            newest = created if newest is None else max(newest, created)
+
+        title = post.get("title", "")
+        body = post.get("selftext", "")
+
+        text = f"{title} {body}"
+
+        if brand_name.lower() not in text.lower():
+            continue
+
+        permalink = post.get("permalink")
+
+        if not permalink:
+            continue
+
+        post_url = f"https://reddit.com{permalink}"
+
+        if post_url in processed_urls:
+            continue
+
+        try:
+            timestamp = datetime.fromtimestamp(created)
+        except:
+            timestamp = datetime.now()
+
+        rows.append((brand_name, "Reddit", text, post_url, timestamp))
+
+        processed_urls.add(post_url)
+
+    # Already-stored urls are skipped by the UNIQUE constraint. The cursor
+    # only moves once the rows it covers are committed.
+    added = add_mentions(rows)
+
+    if newest is not None:
+        advance_fetch_cursor(brand_name, sub_name, data["source"], newest)
+
+    return added
+
+
+def unique_subreddits(subreddits_list):
+    sub_names = []
+
+    for sub_name in subreddits_list:
+
+        sub_name = sub_name.strip()
+
+        if sub_name and sub_name not in sub_names:
+            sub_names.append(sub_name)
+
+    return sub_names
+
+
+def fetch_reddit_mentions(brand_name, subreddits_list, max_workers=FETCH_MAX_WORKERS):
+
+    added_count = 0
+    processed_urls = set()
+
+    sub_names = unique_subreddits(subreddits_list)
+
+    if not sub_names:
+        return 0
+
+    # Network calls run on the pool; DB writes and notifications stay on the
+    # calling thread as each subreddit completes.
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(sub_names))) as pool:
+
+        futures = {
+            pool.submit(fetch_subreddit_data, brand_name, sub_name): sub_name
+            for sub_name in sub_names
+        }
+
+        for future in as_completed(futures):
+
+            sub_name = futures[future]
+
+            try:
+                data = future.result()
+            except Exception as e:
+                log.warning("Fetch failed for r/%s: %s", sub_name, e)
+                data = None
+
+            if not data:
+
+                notify(logging.WARNING, f"All sources failed for r/{sub_name}")
+
+                continue
+
+            added_count += store_subreddit_posts(brand_name, sub_name, data, processed_urls)
+
+    return added_count
+
+
+# Runs of the background worker (worker.py) are recorded here so the
+# dashboard can show what the worker did without talking to it.
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_PARTIAL = "partial"
+JOB_FAILED = "failed"
+JOB_INTERRUPTED = "interrupted"
+
+
+def start_job(kind, brand_name, subreddit=None, worker=None):
+    with get_connection() as conn:
+        cursor = conn.execute(
+            "INSERT INTO worker_jobs (kind, brand, subreddit, status, started_at, worker) VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, brand_name, subreddit, JOB_RUNNING, time.time(), worker),
+        )
+        conn.commit()
+
+    return cursor.lastrowid
+
+
+def finish_job(job_id, status=JOB_DONE, result=None, error=None):
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE worker_jobs SET status=?, result=?, error=?, finished_at=? WHERE id=?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+        )
+        conn.commit()
+
+
+def recover_interrupted_jobs(worker, started_before=None):
+    """
+    Marks jobs that worker left running before started_before (default: now),
+    i.e. from an earlier run of it that died, as interrupted. Jobs of other
+    workers sharing the database are left alone.
+    """
+    with get_connection() as conn:
+        cursor = conn.execute(
+            "UPDATE worker_jobs SET status=?, finished_at=? WHERE status=? AND worker=? AND started_at < ?",
+            (JOB_INTERRUPTED, time.time(), JOB_RUNNING, worker, started_before or time.time()),
+        )
+        conn.commit()
+
+    return cursor.rowcount
+
+
+def get_recent_jobs(brand_name=None, limit=20):
+    sql = "SELECT id, kind, brand, subreddit, worker, status, result, error, started_at, finished_at FROM worker_jobs"
+    params = []
+
+    if brand_name is not None:
+        sql += " WHERE brand=?"
+        params.append(brand_name)
+
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(int(limit))
+
+    with get_connection() as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+
+def get_last_job_time(brand_name, kind):
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT MAX(finished_at) FROM worker_jobs WHERE brand=? AND kind=? AND status=?",
+            (brand_name, kind, JOB_DONE),
+        ).fetchone()
+
+    return row[0]
+
+
+
+
+
+
+
+
+
+def text_stream(text):
+    yield text
+
+
+# Part of every report fingerprint; bump it when a summary prompt or the
+# rows it is built from change so stored reports are regenerated.
+REPORT_PROMPT_VERSION = 4
+
+report_cache_stats = {"hits": 0, "misses": 0}
+_report_cache_lock = threading.Lock()
+
+
+def get_brand_fingerprint(brand_name):
+    """
+    Changes whenever any of the brand's mentions is (re)analyzed: every
+    analysis write stamps rows with a new, higher analysis_rev.
+    """
+    with get_connection() as conn:
+        return conn.execute(
+            "SELECT COALESCE(MAX(analysis_rev), 0) FROM mentions WHERE brand=?",
+            (brand_name,),
+        ).fetchone()[0]
+
+
+def get_report_cache_stats():
+    with _report_cache_lock:
+        return dict(report_cache_stats)
+
+
+def is_failed_report(content):
+    return (
+        not content
+        or "AI analysis temporarily unavailable." in content
+        or content.startswith("Error generating")
+    )
+
+
+def with_report_cache(report_type, brand_names, stream, build):
+    """
+    Returns the stored report for (brands, report_type) if the brands'
+    fingerprint is unchanged, otherwise calls build(stream) and stores what it
+    produced. Streams are passed through and stored once they finish.
+    """
+    brand_key = "|".join(brand_names)
+    fingerprint = f"v{REPORT_PROMPT_VERSION}:" + ":".join(
+        str(get_brand_fingerprint(brand_name)) for brand_name in brand_names
+    )
+
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT content FROM report_cache WHERE brand=? AND report_type=? AND fingerprint=?",
+            (brand_key, report_type, fingerprint),
+        ).fetchone()
+
+    with _report_cache_lock:
+        report_cache_stats["hits" if row else "misses"] += 1
+
+    record_metric("report_cache.hit" if row else "report_cache.miss", report_type=report_type)
+
+    if row:
+        return text_stream(row[0]) if stream else row[0]
+
+    def store(content):
+        if is_failed_report(content):
+            return
+
+        with get_connection() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO report_cache (brand, report_type, fingerprint, content, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (brand_key, report_type, fingerprint, content, time.time()),
+            )
+
+    # A summary that left feedback uncondensed is served but not stored, so
+    # the next request (after the worker has warmed the chunks) covers it all.
+    def partial_since(before):
+        return get_summary_stats()["partial_summaries"] > before
+
+    if not stream:
+        before = get_summary_stats()["partial_summaries"]
+        content = build(False)
+
+        if not partial_since(before):
+            store(content)
+
+        return content
+
+    def stream_and_store():
+        chunks = []
+        before = get_summary_stats()["partial_summaries"]
+
+        for chunk in build(True):
+            chunks.append(chunk)
+            yield chunk
+
+        if not partial_since(before):
+            store("".join(chunks))
+
+    return stream_and_store()
+
+
+# Summaries condense every distinct post (near-duplicates collapsed, never
+# sampled). Separately, a sample is taken across topics in proportion to how
+# often each topic comes up, until SUMMARY_SAMPLE_CHARS of feedback are
+# selected; it only goes into the final prompt, as representative quotes.
+SUMMARY_SAMPLE_CHARS = 16000
+SUMMARY_SAMPLE_TEXT_CHARS = 600
+
+
+def annotate_duplicates(collapsed, text_chars=None):
+    """Texts of collapsed, prefixed with the count when they stand for near-duplicates."""
+    texts = collapsed["text"].str.slice(0, text_chars)
+
+    return texts.where(
+        collapsed["dup_count"] <= 1,
+        "[" + collapsed["dup_count"].astype(str) + " similar posts] " + texts,
+    )
+
+
+def select_representative_feedback(
+    df, max_chars=SUMMARY_SAMPLE_CHARS, text_chars=SUMMARY_SAMPLE_TEXT_CHARS, collapsed=None
+):
+    """
+    Returns a deduplicated, topic-balanced subset of df that fits max_chars.
+    Texts that stood for several near-duplicates are prefixed with the count.
+    Pass collapsed to reuse collapse_near_duplicates(df).
+    """
+    if collapsed is None:
+        collapsed = collapse_near_duplicates(df)
+
+    if collapsed.empty:
+        return collapsed
+
+    topics = (
+        collapsed["topic"].fillna("unknown").astype(str).str.lower().str.strip()
+        if "topic" in collapsed.columns
+        else pd.Series("unknown", index=collapsed.index)
+    )
+
+    # Within a topic, most-repeated first; across topics, interleave so each
+    # topic's share of the sample follows its share of the mentions.
+    collapsed = collapsed.assign(sample_topic=topics)
+    collapsed = collapsed.sort_values("dup_count", ascending=False, kind="stable")
+    topic_weight = collapsed.groupby("sample_topic")["dup_count"].transform("sum")
+    rank = collapsed.groupby("sample_topic").cumcount()
+    collapsed = collapsed.assign(sample_order=(rank + 1) / topic_weight)
+    collapsed = collapsed.sort_values("sample_order", kind="stable")
+
+    texts = annotate_duplicates(collapsed, text_chars)
+
+    within_budget = (texts.str.len() + 5).cumsum() <= max_chars
+    within_budget.iloc[0] = True
+
+    selected = collapsed.loc[within_budget].assign(text=texts[within_budget])
+    selected = selected.drop(columns=["sample_topic", "sample_order"])
+
+    return selected.sort_values("id") if "id" in selected.columns else selected
+
+
+def representative_feedback_text(df, max_chars=1500):
+    selected = select_representative_feedback(df, max_chars=max_chars, text_chars=300)
+
+    if selected.empty:
+        return "(no analyzed feedback)"
+
+    return "\n---\n".join(selected["text"].tolist())
+
+
+# Large corpora are summarized map-reduce style: feedback is cut into chunks
+# of SUMMARY_CHUNK_CHARS, each chunk is condensed in parallel, and the
+# partial summaries are condensed again until they fit one final prompt.
+# Chunks are cut oldest-first so new mentions only change the last chunk,
+# and every condensed chunk is cached by the hash of its prompt. The worker
+# condenses every chunk at background priority after each classify pass
+# (warm_summary_chunks); a dashboard request condenses at most
+# SUMMARY_INTERACTIVE_MAP_CALLS uncached chunks, newest first, and says how
+# many posts the rest of the summary leaves out.
+SUMMARY_CHUNK_CHARS = 4000
+SUMMARY_MAX_LEVELS = 4
+SUMMARY_CHUNK_CACHE_MAX_ENTRIES = 20000
+SUMMARY_INTERACTIVE_MAP_CALLS = 12
+
+SUMMARY_FOCUS = {
+    "positive": ("POSITIVE", "strengths, value, and what users appreciate most"),
+    "negative": ("NEGATIVE", "complaints, pain points, and risks"),
+    "suggestions": ("problem", "root causes, user frustration patterns, and product weaknesses"),
+}
+
+summary_stats = {
+    "map_calls": 0,
+    "reduce_calls": 0,
+    "chunk_cache_hits": 0,
+    "skipped_chunks": 0,
+    "partial_summaries": 0,
+    "prompt_tokens": 0,
+}
+_summary_stats_lock = threading.Lock()
+
+
+def record_summary_stats(**counts):
+    with _summary_stats_lock:
+        for name, count in counts.items():
+            summary_stats[name] += count
+
+
+def get_summary_stats():
+    with _summary_stats_lock:
+        return dict(summary_stats)
+
+
+def chunk_texts(texts, max_chars=SUMMARY_CHUNK_CHARS, counts=False):
+    """Joins texts into chunks of about max_chars; with counts, also returns how many texts each holds."""
+    chunks = []
+    sizes = []
+    current = []
+    size = 0
+
+    for text in texts:
+        text = text[:max_chars]
+
+        if current and size + len(text) > max_chars:
+            chunks.append("\n---\n".join(current))
+            sizes.append(len(current))
+            current = []
+            size = 0
+
+        current.append(text)
+        size += len(text) + 5
+
+    if current:
+        chunks.append("\n---\n".join(current))
+        sizes.append(len(current))
+
+    return (chunks, sizes) if counts else chunks
+
+
+def summary_chunk_prompt(chunk, report_type, level):
+    label, focus = SUMMARY_FOCUS[report_type]
+
+    if level == 0:
+        return f"""
+    You are a business analyst.
+    Condense the following {label} customer feedback into at most 5 short bullet points.
+    Focus on {focus}.
+    Say how common each point is.
+
+    Feedback:
+    {chunk}
+    """
+
+    return f"""
+    You are a business analyst.
+    Merge these partial summaries of {label} customer feedback into at most 5 short bullet points.
+    Keep the most frequent and most severe themes.
+    Focus on {focus}.
+
+    Partial summaries:
+    {chunk}
+    """
+
+
+def summarize_chunks(chunks, report_type, level, priority=None, max_calls=None):
+    """
+    Condenses each chunk (cached, misses in parallel) and returns the
+    partials in chunk order. With max_calls, only that many of the newest
+    misses are sent to the LLM; the other chunks, like failed ones, come
+    back as None.
+    """
+    prompts = [summary_chunk_prompt(chunk, report_type, level) for chunk in chunks]
+    keys = [hashlib.sha256(prompt.encode("utf-8")).hexdigest() for prompt in prompts]
+
+    cached = {}
+
+    with get_connection() as conn:
+        for start in range(0, len(keys), 500):
+            chunk_keys = keys[start:start + 500]
+            placeholders = ", ".join("?" for _ in chunk_keys)
+            cached.update(conn.execute(
+                f"SELECT key, content FROM summary_chunk_cache WHERE key IN ({placeholders})",
+                chunk_keys,
+            ).fetchall())
+
+        if cached:
+            now = time.time()
+            conn.executemany(
+                "UPDATE summary_chunk_cache SET last_used=? WHERE key=?",
+                [(now, key) for key in cached],
+            )
+
+    misses = {key: prompt for key, prompt in zip(keys, prompts) if key not in cached}
+    skipped = 0
+
+    if max_calls is not None and len(misses) > max_calls:
+        skipped = len(misses) - max_calls
+        misses = dict(list(misses.items())[skipped:])
+
+    record_summary_stats(
+        chunk_cache_hits=len(keys) - len(misses) - skipped,
+        skipped_chunks=skipped,
+        prompt_tokens=sum(estimate_tokens(prompt) for prompt in misses.values()),
+        **{"map_calls" if level == 0 else "reduce_calls": len(misses)},
+    )
+
+    fresh = {}
+
+    if misses:
+        with ThreadPoolExecutor(max_workers=max(1, min(LLM_MAX_CONCURRENCY, len(misses)))) as pool:
+            futures = {
+                pool.submit(generate_ai_response, prompt, priority=priority): key
+                for key, prompt in misses.items()
+            }
+
+            for future in as_completed(futures):
+                content = future.result()
+
+                if not is_failed_report(content):
+                    fresh[futures[future]] = content
+
+    if fresh:
+        now = time.time()
+
+        with get_connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO summary_chunk_cache (key, content, created_at, last_used) VALUES (?, ?, ?, ?)",
+                [(key, content, now, now) for key, content in fresh.items()],
+            )
+            conn.execute(
+                """
+                DELETE FROM summary_chunk_cache WHERE key IN (
+                    SELECT key FROM summary_chunk_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (SUMMARY_CHUNK_CACHE_MAX_ENTRIES,),
+            )
+
+    return [cached.get(key) or fresh.get(key) for key in keys]
+
+
+def condense_feedback(df, report_type, priority=None, max_map_calls=None):
+    """
+    Returns (text, covered) for a summary prompt: the raw texts of df if they
+    fit in one chunk, otherwise their map-reduced partial summaries. covered
+    is a boolean mask over the rows of df in id order, true for those the
+    text stands for; max_map_calls caps the chunks condensed by this call.
+    """
+    if "id" in df.columns:
+        df = df.sort_values("id")
+
+    chunks, sizes = chunk_texts(df["text"].tolist(), counts=True)
+    covered = pd.Series(True, index=df.index)
+    level = 0
+
+    while len(chunks) > 1 and level < SUMMARY_MAX_LEVELS:
+        partials = summarize_chunks(
+            chunks, report_type, level, priority, max_map_calls if level == 0 else None
+        )
+
+        if level == 0:
+            covered = pd.Series(np.repeat([p is not None for p in partials], sizes), index=df.index)
+
+        partials = [partial for partial in partials if partial is not None]
+
+        if not partials:
+            return "\n---\n".join(chunks)[:SUMMARY_CHUNK_CHARS], covered
+
+        chunks = chunk_texts(partials)
+        level += 1
+
+    return "\n---\n".join(chunks)[:SUMMARY_CHUNK_CHARS], covered
+
+
+def summary_feedback(df, report_type, max_map_calls=SUMMARY_INTERACTIVE_MAP_CALLS):
+    """
+    Returns the feedback section of a summary prompt. Every distinct post of
+    df is condensed, oldest first and without duplicate counts, so new
+    mentions (even near-duplicates of old posts) only change the last chunks.
+    When the posts needed map-reduce, a representative sample with counts
+    follows the condensed summaries. If max_map_calls left chunks
+    uncondensed, the section says which share of the posts it covers.
+    """
+    collapsed = collapse_near_duplicates(df)
+
+    if len(chunk_texts(collapsed["text"].tolist())) <= 1:
+        return "\n---\n".join(annotate_duplicates(collapsed).tolist())[:SUMMARY_CHUNK_CHARS]
+
+    condensed, covered = condense_feedback(collapsed, report_type, max_map_calls=max_map_calls)
+    sample = select_representative_feedback(df, collapsed=collapsed)
+
+    total = int(collapsed["dup_count"].sum())
+    condensed_posts = int(collapsed["dup_count"].to_numpy()[covered.to_numpy()].sum())
+
+    if condensed_posts < total:
+        record_summary_stats(partial_summaries=1)
+        heading = f"Condensed from the newest {condensed_posts} of {total} posts"
+    else:
+        heading = f"Condensed from all {total} posts"
+
+    return (
+        f"{heading}:\n{condensed}\n\n"
+        "Representative posts:\n" + "\n---\n".join(sample["text"].tolist())
+    )
+
+
+def report_feedback(df, report_type):
+    """The rows of df a report_type summary is written from."""
+    if report_type == "positive":
+        return df[df["sentiment"] == "Positive"]
+
+    if report_type == "negative":
+        return df[df["sentiment"] == "Negative"]
+
+    return df[
+        (df["sentiment"] == "Negative")
+        | ((df["sentiment"] == "Neutral") & (df["urgency"] == "High"))
+    ]
+
+
+def warm_summary_chunks(brand_name, priority=None):
+    """
+    Condenses every chunk of the brand's summary feedback for each report
+    type, so a dashboard summary only has new chunks left to condense.
+    Runs at background priority unless told otherwise. Returns the number of
+    LLM calls made.
+    """
+    if priority is None:
+        priority = PRIORITY_BACKGROUND
+
+    df = get_analyzed_mentions_as_df(brand_name)
+    before = get_summary_stats()
+
+    for report_type in SUMMARY_FOCUS:
+        rows = report_feedback(df, report_type)
+
+        if not rows.empty:
+            condense_feedback(collapse_near_duplicates(rows), report_type, priority=priority)
+
+    after = get_summary_stats()
+
+    return after["map_calls"] + after["reduce_calls"] - before["map_calls"] - before["reduce_calls"]
+
+
+def generate_positive_report_summary(df, stream=False, brand_name=None):
+    """
+    Generates a concise summary of POSITIVE feedback. With stream=True a
+    generator of text chunks is returned instead (for st.write_stream).
+    Passing brand_name serves the stored summary while the brand's analyzed
+    mentions are unchanged.
+    """
+    if brand_name:
+        return with_report_cache(
+            "positive", (brand_name,), stream,
+            lambda stream: generate_positive_report_summary(df, stream=stream),
+        )
+
+    positive_df = report_feedback(df, "positive")
+
+    if positive_df.empty:
+        message = "No positive feedback found."
+        return text_stream(message) if stream else message
+
+    texts = summary_feedback(positive_df, "positive")
+
+    prompt = f"""
+    You are a business analyst.
+    Summarize the following POSITIVE customer feedback in 3 bullet points.
+    Focus on strengths, value, and what users appreciate most.
+
+    Feedback:
+    {texts}
+    """
+
+    if stream:
+        return stream_ai_response(prompt)
+
+    try:
+        return generate_ai_response(prompt)
+
+    except Exception as e:
+        return f"Error generating positive summary: {e}"
+
+
+def generate_negative_report_summary(df, stream=False, brand_name=None):
+    if brand_name:
+        return with_report_cache(
+            "negative", (brand_name,), stream,
+            lambda stream: generate_negative_report_summary(df, stream=stream),
+        )
+
+    negative_df = report_feedback(df, "negative")
+
+    if negative_df.empty:
+        message = "No negative feedback found."
+        return text_stream(message) if stream else message
+
+    texts = summary_feedback(negative_df, "negative")
+
+    prompt = f"""
+    You are a business analyst.
+    Summarize the following NEGATIVE customer feedback in 3 bullet points.
+    Focus on complaints, pain points, and risks.
+
+    Feedback:
+    {texts}
+    """
+
+    if stream:
+        return stream_ai_response(prompt)
+
+    try:
+        return generate_ai_response(prompt)
+
+    except Exception as e:
+        return f"Error generating negative summary: {e}"
+
+
+
+
+
+def generate_report_summary(df, stream=False, brand_name=None):
+    if brand_name:
+        return with_report_cache(
+            "suggestions", (brand_name,), stream,
+            lambda stream: generate_report_summary(df, stream=stream),
+        )
+
+    relevant_df = report_feedback(df, "suggestions")
+    
+
+
+    if relevant_df.empty:
+        message = "No suggestions found."
+        return text_stream(message) if stream else message
+    
+    relevant_df = relevant_df.copy()
+    relevant_df["topic"] = (
+    relevant_df["topic"]
+    .dropna()
+    .str.lower()
+    .str.strip()
+)
+
+    
+
+    topic_counts = (
+        relevant_df["topic"]
+        .dropna()
+        .str.strip()
+        .value_counts()
+    )
+
+    total = topic_counts.sum()
+
+    if total == 0:
+        message = "No significant issues detected."
+        return text_stream(message) if stream else message
+
+
+    top_issues = topic_counts.head(5)
+
+    issues_text = "\n".join(
+        [
+            f"• {topic} ({round(count/total*100,1)}%)"
+            for topic, count in top_issues.items()
+        ]
+    )
+
+    
+
+    texts = summary_feedback(relevant_df, "suggestions")
+
+    prompt = f"""
+You are an enterprise brand intelligence analyst.
+
+Explain the user problems clearly and professionally.
+
+Focus on:
+
+• Root causes  
+• User frustration patterns  
+• Product weaknesses  
+
+Feedback:
+{texts}
+"""
+
+    if stream:
+        return itertools.chain(
+            [f"Most reported issues:\n{issues_text}\n\nAnalysis:\n"],
+            stream_ai_response(prompt),
+        )
+
+    ai_analysis = generate_ai_response(prompt)
+
+   
+
+    final_output = f"""
+Most reported issues:
+{issues_text}
+
+Analysis:
+{ai_analysis}
+"""
+
+    return final_output.strip()
+
+
+
+
+
+# Bump CLASSIFICATION_PROMPT_VERSION whenever the classifier prompt changes so
+# cached labels from the old prompt stop matching.
+CLASSIFICATION_PROMPT_VERSION = 2
+CLASSIFICATION_TEXT_CHARS = 250
+CLASSIFICATION_CACHE_MAX_ENTRIES = 100000
+
+# local_items counts cache misses answered by the lexicon tier, llm_items
+# texts sent to the LLM, retried_items those re-queued after the model
+# skipped them, and fallback_items those that ended as defaults.
+classification_stats = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "local_items": 0,
+    "llm_items": 0,
+    "retried_items": 0,
+    "fallback_items": 0,
+}
+_classification_stats_lock = threading.Lock()
+
+
+def normalize_classification_text(text):
+    return " ".join(text[:CLASSIFICATION_TEXT_CHARS].lower().split())
+
+
+def classification_cache_key(text, model_name=None):
+    """Keys a label by the model that produced it, so models never share answers."""
+    model_name = model_name or get_model_name("classification")
+    raw = f"{model_name}\x00{CLASSIFICATION_PROMPT_VERSION}\x00{normalize_classification_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def record_classification_stats(**counts):
+    with _classification_stats_lock:
+        for name, count in counts.items():
+            classification_stats[name] += count
+
+    for name, count in counts.items():
+        if count:
+            record_metric(f"classification.{name}", count)
+
+
+def get_classification_stats():
+    with _classification_stats_lock:
+        stats = dict(classification_stats)
+
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    stats["fallback_rate"] = stats["fallback_items"] / stats["misses"] if stats["misses"] else 0.0
+    stats["llm_avoided_rate"] = stats["local_items"] / stats["misses"] if stats["misses"] else 0.0
+
+    return stats
+
+
+def get_cached_classifications(keys):
+    """Returns {key: result} for the keys found and marks them recently used."""
+    keys = list(keys)
+    found = {}
+
+    if not keys:
+        return found
+
+    with get_connection() as conn:
+        # Stay well below SQLite's bound-parameter limit.
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+
+            for key, sentiment, topic, urgency in conn.execute(
+                f"SELECT key, sentiment, topic, urgency FROM classification_cache WHERE key IN ({placeholders})",
+                chunk,
+            ):
+                found[key] = {"sentiment": sentiment, "topic": topic, "urgency": urgency}
+
+        if found:
+            now = time.time()
+            conn.executemany(
+                "UPDATE classification_cache SET last_used=? WHERE key=?",
+                [(now, key) for key in found],
+            )
+
+    return found
+
+
+def store_classifications(results):
+    """Stores {key: result} and evicts least recently used entries over the cap."""
+    if not results:
+        return
+
+    now = time.time()
+
+    with get_connection() as conn:
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO classification_cache
+                (key, sentiment, topic, urgency, created_at, last_used)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (key, result.get("sentiment"), result.get("topic"), result.get("urgency"), now, now)
+                for key, result in results.items()
+            ],
+        )
+
+        size = conn.execute("SELECT COUNT(*) FROM classification_cache").fetchone()[0]
+        overflow = size - CLASSIFICATION_CACHE_MAX_ENTRIES
+
+        if overflow > 0:
+            conn.execute(
+                """
+                DELETE FROM classification_cache WHERE key IN (
+                    SELECT key FROM classification_cache ORDER BY last_used LIMIT ?
+                )
+                """,
+                (overflow,),
+            )
+            record_classification_stats(evictions=overflow)
+
+
+SENTIMENT_LABELS = ("Positive", "Negative", "Neutral")
+URGENCY_LABELS = ("High", "Low")
+
+DEFAULT_ANALYSIS = {"sentiment": "Neutral", "topic": "Unknown", "urgency": "Low"}
+
+
+def normalize_classification(item):
+    """Returns a clean {sentiment, topic, urgency} dict, or None if item is unusable."""
+    if not isinstance(item, dict):
+        return None
+
+    sentiment = str(item.get("sentiment", "")).strip().capitalize()
+    urgency = str(item.get("urgency", "")).strip().capitalize()
+    topic = item.get("topic")
+
+    if sentiment not in SENTIMENT_LABELS or urgency not in URGENCY_LABELS:
+        return None
+
+    if not isinstance(topic, str) or not topic.strip():
+        topic = "Unknown"
+
+    return {"sentiment": sentiment, "topic": topic.strip(), "urgency": urgency}
+
+
+def parse_classification_response(response, count):
+    """
+    Maps the model's JSON array back to input positions. Items are matched by
+    their "index" field; an array without indices is only trusted when its
+    length matches. Returns {index: result} with only the usable items.
+    """
+    response = response.strip()
+
+    # Safe markdown removal
+    if response.startswith("```"):
+        response = response.replace("```json", "").replace("```", "").strip()
+
+    items = json.loads(response)
+
+    if isinstance(items, dict):
+        items = [items]
+
+    results = {}
+
+    if all(isinstance(item, dict) and "index" in item for item in items):
+        for item in items:
+            try:
+                index = int(item["index"])
+            except (TypeError, ValueError):
+                continue
+
+            result = normalize_classification(item)
+
+            if 0 <= index < count and result and index not in results:
+                results[index] = result
+
+    elif len(items) == count:
+        for index, item in enumerate(items):
+            result = normalize_classification(item)
+
+            if result:
+                results[index] = result
+
+    return results
+
+
+def classify_texts(texts, priority=None):
+    """
+    Classifies texts in a single API call and returns {index: result} for the
+    items the model answered usably. Raises if the model is unavailable or the
+    response is not JSON. priority defaults to background.
+    """
+    return classify_texts_with_model(texts, priority)[0]
+
+
+def classify_texts_with_model(texts, priority=None):
+    """classify_texts, also returning the model that answered."""
+    if not texts:
+        return {}, None
+    
+    
+    texts_with_indices = "\n\n".join(
+    [f"[{i}] {text[:CLASSIFICATION_TEXT_CHARS]}" for i, text in enumerate(texts)]
+)
+
+    
+
+    prompt = f"""
+You are a strict JSON sentiment classifier.
+
+Classify EACH text independently.
+Do NOT average tone across texts.
+Return EXACTLY {len(texts)} JSON objects.
+If unsure, still return one object per text.
+Do NOT skip any text.
+Set "index" to the number in brackets before the text.
+
+Allowed sentiments:
+- Positive
+- Negative
+- Neutral
+
+Rules:
+- Complaints or problems = Negative
+- Questions about issues = Negative
+- Praise or recommendation = Positive
+- Pure factual discussion = Neutral
+
+Return ONLY valid JSON.
+No explanation.
+No markdown.
+No extra text.
+
+Format:
+[
+  {{
+    "index": 0,
+    "sentiment": "Positive|Negative|Neutral",
+    "topic": "1-3 words",
+    "urgency": "High|Low"
+  }}
+]
+
+Texts:
+{texts_with_indices}
+"""
+
+    response, model = complete_ai_response(prompt, task_type="classification", priority=priority)
+
+    if not response or model is None:
+        raise ValueError("AI unavailable")
+
+    return parse_classification_response(response, len(texts)), model
+
+
+def batch_analyze_texts(texts, fallback=True):
+    """
+    Analyze multiple texts in a single API call using Gemini's structured output.
+    Returns a list of dicts: [{"sentiment": str, "topic": str, "urgency": str}, ...]
+    Items the model skipped get Neutral defaults. With fallback=False errors
+    are raised instead of returning defaults for the whole batch.
+"""
+    if not texts:
+        return []
+
+    try:
+
+            results = classify_texts(texts)
+
+    except Exception as e:
+
+            if not fallback:
+                raise
+
+            notify(logging.ERROR, f"Batch analysis error: {e}")
+
+            results = {}
+
+    return [dict(results.get(i, DEFAULT_ANALYSIS)) for i in range(len(texts))]
+
+
+LLM_MAX_CONCURRENCY = 4
+
+MODEL_CONTEXT_WINDOWS = {
+    "llama-3.1-8b-instant": 131072,
+    "llama-3.3-70b-versatile": 131072,
+}
+
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Long batches make the model more likely to skip or merge items, so batches
+# are capped well below the context window.
+CLASSIFICATION_BATCH_TOKEN_BUDGET = 3000
+CLASSIFICATION_MAX_BATCH_ITEMS = 25
+CLASSIFICATION_PROMPT_TOKENS = 250
+CLASSIFICATION_OUTPUT_TOKENS_PER_ITEM = 30
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Refills at per_minute / 60 units per second and holds at most
+    burst_seconds worth, so a full minute's quota can't go out at once.
+    """
+
+    def __init__(self, per_minute, burst_seconds=60.0):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill_locked(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, tokens):
+        """Seconds until `tokens` are available (0 if they are now)."""
+        tokens = min(tokens, self.capacity)
+
+        with self.lock:
+            self.refill_locked()
+            return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def consume(self, tokens):
+        with self.lock:
+            self.refill_locked()
+            self.tokens -= min(tokens, self.capacity)
+
+    def acquire(self, tokens):
+        while True:
+            wait = self.wait_time(tokens)
+
+            if not wait:
+                self.consume(tokens)
+                return
+
+            time.sleep(wait)
+
+
+def plan_classification_batches(texts, max_items=None, model_name=None):
+    """
+    Splits texts into index batches sized by estimated tokens: short texts are
+    packed into larger batches, long ones into smaller ones. Returns a list of
+    lists of indices into texts.
+    """
+    model_name = model_name or get_model_name("classification")
+    context_window = MODEL_CONTEXT_WINDOWS.get(model_name, DEFAULT_CONTEXT_WINDOW)
+    token_budget = min(CLASSIFICATION_BATCH_TOKEN_BUDGET, context_window // 2)
+    max_items = max_items or CLASSIFICATION_MAX_BATCH_ITEMS
+
+    batches = []
+    current = []
+    current_tokens = CLASSIFICATION_PROMPT_TOKENS
+
+    for index, text in enumerate(texts):
+        item_tokens = estimate_tokens(text[:CLASSIFICATION_TEXT_CHARS]) + CLASSIFICATION_OUTPUT_TOKENS_PER_ITEM
+
+        if current and (len(current) >= max_items or current_tokens + item_tokens > token_budget):
+            batches.append(current)
+            current = []
+            current_tokens = CLASSIFICATION_PROMPT_TOKENS
+
+        current.append(index)
+        current_tokens += item_tokens
+
+    if current:
+        batches.append(current)
+
+    return batches
+
+
+# First-tier classifier: a keyword lexicon scored with pandas/NumPy over the
+# whole pending set. Texts it is confident about skip the LLM entirely.
+# Questions ("is it good for X?") read as praise to the lexicon but are often
+# complaints, so their confidence is scaled down below any usable threshold.
+# Check the threshold with benchmarks/eval_local_classifier.py.
+LOCAL_CLASSIFIER_THRESHOLD = 0.75
+LOCAL_QUESTION_CONFIDENCE = 0.5
+
+POSITIVE_TERMS = [
+    "love", "loving", "great", "awesome", "amazing", "excellent", "fantastic",
+    "impressive", "impressed", "perfect", "best", "helpful", "useful",
+    "recommend", "recommended", "brilliant", "game changer", "works great",
+    "thank you", "thanks", "happy", "glad", "beautiful", "smooth", "fast",
+    "reliable", "incredible", "wonderful", "superb", "nice", "good",
+]
+
+NEGATIVE_TERMS = [
+    "hate", "terrible", "awful", "horrible", "worst", "useless", "broken",
+    "bug", "buggy", "crash", "crashes", "crashing", "error", "errors",
+    "fail", "fails", "failed", "failing", "issue", "issues", "problem",
+    "problems", "slow", "laggy", "disappointed", "disappointing",
+    "frustrating", "frustrated", "annoying", "scam", "refund", "downgrade",
+    "nerfed", "worse", "garbage", "trash", "unusable", "bad", "down",
+    "outage", "not working", "doesn't work", "stopped working",
+]
+
+URGENT_TERMS = [
+    "urgent", "asap", "immediately", "outage", "down", "not working",
+    "stopped working", "can't login", "cannot login", "can't log in",
+    "locked out", "data loss", "lost my", "deleted my", "charged twice",
+    "security", "breach", "leak", "hacked", "refund", "critical",
+]
+
+NEGATORS = ["not", "no", "never", "isn't", "wasn't", "aren't", "don't", "doesn't", "didn't", "hardly"]
+
+TOPIC_TERMS = {
+    "Pricing": ["price", "pricing", "cost", "subscription", "plan", "billing", "charged", "refund", "expensive", "cheap"],
+    "Performance": ["slow", "fast", "speed", "latency", "laggy", "lag", "performance", "timeout"],
+    "Reliability": ["outage", "down", "crash", "crashes", "crashing", "error", "errors", "bug", "buggy", "broken"],
+    "Account": ["login", "log in", "account", "password", "locked out", "banned", "verification"],
+    "Model Quality": ["answer", "answers", "hallucinate", "hallucination", "accuracy", "reasoning", "quality", "nerfed"],
+    "Features": ["feature", "features", "update", "release", "launch", "api", "plugin", "voice", "image"],
+    "Support": ["support", "customer service", "help desk", "ticket", "response"],
+    "Privacy": ["privacy", "data", "security", "breach", "leak", "tracking"],
+}
+
+
+def term_pattern(terms):
+    alternatives = "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    return rf"\b(?:{alternatives})\b"
+
+
+def negated_pattern(terms):
+    negators = "|".join(re.escape(term) for term in NEGATORS)
+    return rf"\b(?:{negators})\s+(?:\w+\s+)?{term_pattern(terms)}"
+
+
+POSITIVE_PATTERN = term_pattern(POSITIVE_TERMS)
+NEGATIVE_PATTERN = term_pattern(NEGATIVE_TERMS)
+URGENT_PATTERN = term_pattern(URGENT_TERMS)
+NEGATED_POSITIVE_PATTERN = negated_pattern(POSITIVE_TERMS)
+NEGATED_NEGATIVE_PATTERN = negated_pattern(NEGATIVE_TERMS)
+TOPIC_PATTERNS = {topic: term_pattern(terms) for topic, terms in TOPIC_TERMS.items()}
+
+
+def local_classify(texts):
+    """
+    Scores texts against the lexicons without any network call. Returns a
+    DataFrame aligned with texts holding sentiment, topic, urgency and a
+    0-1 confidence for the sentiment label.
+    """
+    lowered = pd.Series(list(texts), dtype=object).fillna("").astype(str).str.lower()
+
+    positive = lowered.str.count(POSITIVE_PATTERN).to_numpy(dtype=float)
+    negative = lowered.str.count(NEGATIVE_PATTERN).to_numpy(dtype=float)
+    negated_positive = lowered.str.count(NEGATED_POSITIVE_PATTERN).to_numpy(dtype=float)
+    negated_negative = lowered.str.count(NEGATED_NEGATIVE_PATTERN).to_numpy(dtype=float)
+    urgent = lowered.str.count(URGENT_PATTERN).to_numpy(dtype=float)
+
+    # "not good" counts against the text, "not bad" only cancels the "bad".
+    positive = np.maximum(positive - negated_positive, 0)
+    negative = np.maximum(negative - negated_negative, 0) + negated_positive
+
+    net = positive - negative
+    confidence = np.abs(net) / (positive + negative + 0.5)
+    confidence = np.where(
+        lowered.str.contains("?", regex=False).to_numpy(),
+        confidence * LOCAL_QUESTION_CONFIDENCE,
+        confidence,
+    )
+
+    sentiment = np.where(net > 0, "Positive", np.where(net < 0, "Negative", "Neutral"))
+
+    topic_counts = np.column_stack([
+        lowered.str.count(pattern).to_numpy(dtype=float)
+        for pattern in TOPIC_PATTERNS.values()
+    ])
+    topic_names = np.array(list(TOPIC_PATTERNS))
+    topic = np.where(
+        topic_counts.max(axis=1) > 0,
+        topic_names[topic_counts.argmax(axis=1)],
+        "General",
+    )
+
+    return pd.DataFrame({
+        "sentiment": sentiment,
+        "topic": topic,
+        "urgency": np.where(urgent > 0, "High", "Low"),
+        "confidence": np.round(confidence, 3),
+    })
+
+
+def evaluate_local_classifier(df, thresholds=(0.5, 0.6, 0.75, 0.9)):
+    """
+    Offline check of the local tier against LLM labels. df needs text,
+    sentiment and urgency columns holding the LLM's own answers, not stored
+    mention labels, which include the tier's labels and defaults. For each
+    threshold, reports the share of texts the LLM would be spared and how
+    often the local labels agree with the LLM on those texts.
+    """
+    df = df.dropna(subset=["text", "sentiment"])
+
+    if df.empty:
+        return pd.DataFrame(columns=[
+            "threshold", "llm_calls_avoided", "sentiment_agreement", "urgency_agreement"
+        ])
+
+    local = local_classify(df["text"].tolist())
+    sentiment_match = local["sentiment"].to_numpy() == df["sentiment"].to_numpy()
+    urgency_match = local["urgency"].to_numpy() == df["urgency"].fillna("Low").to_numpy()
+
+    rows = []
+
+    for threshold in thresholds:
+        confident = local["confidence"].to_numpy() >= threshold
+        covered = int(confident.sum())
+
+        rows.append({
+            "threshold": threshold,
+            "llm_calls_avoided": covered / len(df),
+            "sentiment_agreement": sentiment_match[confident].mean() if covered else np.nan,
+            "urgency_agreement": urgency_match[confident].mean() if covered else np.nan,
+        })
+
+    return pd.DataFrame(rows)
+
+
+CLASSIFICATION_MAX_ATTEMPTS = 2
+
+
+def run_classification_batch(batch, priority=None):
+    """
+    Classifies one batch and returns ({index: result}, model). Runs on a
+    worker thread.
+    """
+    return classify_texts_with_model(batch, priority)
+
+
+def analyze_in_batches(
+    texts,
+    batch_size=None,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    progress_callback=None,
+    local_threshold=LOCAL_CLASSIFIER_THRESHOLD,
+    priority=None,
+    fallback=True,
+):
+    """
+    Classifies texts, answering from the classification cache where possible.
+    Cache misses the local lexicon tier labels with at least local_threshold
+    confidence skip the LLM (pass None to disable the tier). The remaining
+    misses (deduplicated) are sent to the LLM, in token-sized
+    batches with up to max_concurrency requests in flight. Requests go out
+    under the shared LLM rate limits at priority, by default as background
+    work behind interactive calls. batch_size, if given, caps items per batch.
+
+    Items the model skips or garbles are re-queued on their own and merged
+    into the next batch; only items that still fail after
+    CLASSIFICATION_MAX_ATTEMPTS fall back to Neutral/Unknown/Low, or come
+    back as None with fallback=False so callers can leave them pending.
+
+    Results come back in input order; progress_callback(done, total) is called
+    on the calling thread as items settle. Only real answers are cached, keyed
+    by the model that gave them; lookups accept an answer from any model that
+    can serve classification.
+    """
+    keys = [normalize_classification_text(text) for text in texts]
+
+    lookup = {
+        classification_cache_key(key, model): key
+        for key in dict.fromkeys(keys)
+        for model in get_classification_models()
+    }
+    found = get_cached_classifications(lookup)
+    cached = {}
+
+    for cache_key, key in lookup.items():
+        if cache_key in found and key not in cached:
+            cached[key] = found[cache_key]
+
+    pending = {}
+
+    for key, text in zip(keys, texts):
+        if key not in cached and key not in pending:
+            pending[key] = text
+
+    local = {}
+
+    if local_threshold is not None and pending:
+        local_df = local_classify(pending.values())
+        confident = local_df["confidence"].to_numpy() >= local_threshold
+
+        for key, row, is_confident in zip(list(pending), local_df.itertuples(), confident):
+            if is_confident:
+                local[key] = {"sentiment": row.sentiment, "topic": row.topic, "urgency": row.urgency}
+                del pending[key]
+
+    record_classification_stats(
+        hits=sum(1 for key in keys if key in cached),
+        misses=len(pending) + len(local),
+        local_items=len(local),
+    )
+
+    pending_keys = list(pending)
+    fresh = {}
+    fresh_models = {}
+    unanswered = {}
+    attempts = dict.fromkeys(pending_keys, 0)
+
+    def plan(batch_keys):
+        return [
+            [batch_keys[index] for index in indices]
+            for indices in plan_classification_batches(
+                [pending[key] for key in batch_keys], max_items=batch_size
+            )
+        ]
+
+    queue = deque(plan(pending_keys))
+    max_workers = max(1, max_concurrency)
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+
+        while queue or in_flight:
+
+            while queue and len(in_flight) < max_workers:
+                batch_keys = queue.popleft()
+
+                for key in batch_keys:
+                    attempts[key] += 1
+
+                record_classification_stats(llm_items=len(batch_keys))
+
+                future = pool.submit(run_classification_batch, [pending[key] for key in batch_keys], priority)
+                in_flight[future] = batch_keys
+
+            completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            retry = []
+            failed = 0
+            settled = 0
+
+            for future in completed:
+                batch_keys = in_flight.pop(future)
+
+                try:
+                    results, model = future.result()
+                except Exception as e:
+                    notify(logging.ERROR, f"Batch analysis error: {e}")
+                    results, model = {}, None
+
+                for index, key in enumerate(batch_keys):
+                    if index in results:
+                        fresh[key] = results[index]
+                        fresh_models[key] = model
+                        settled += 1
+                    elif attempts[key] < CLASSIFICATION_MAX_ATTEMPTS:
+                        retry.append(key)
+                    else:
+                        unanswered[key] = dict(DEFAULT_ANALYSIS) if fallback else None
+                        failed += 1
+                        settled += 1
+
+            if retry:
+                log.info("Re-queueing %d unanswered items", len(retry))
+                record_classification_stats(retried_items=len(retry))
+
+                # Merge the stragglers into the next batch rather than
+                # sending a small request of their own.
+                merged = retry + (queue.popleft() if queue else [])
+                queue.extendleft(reversed(plan(merged)))
+
+            if failed:
+                log.warning(
+                    "%d items still unanswered; %s",
+                    failed, "filling defaults" if fallback else "leaving them pending",
+                )
+
+            if settled and progress_callback:
+                progress_callback(len(fresh) + len(unanswered), len(pending_keys))
+
+    record_classification_stats(fallback_items=len(unanswered))
+
+    store_classifications({
+        classification_cache_key(key, fresh_models[key]): result
+        for key, result in fresh.items()
+    })
+
+    results = [cached.get(key) or local.get(key) or fresh.get(key) or unanswered[key] for key in keys]
+
+    return [dict(result) if result is not None else None for result in results]
+
+
+
+
+
+def analyze_texts(texts, **kwargs):
+    """
+    Returns {"sentiment", "topic", "urgency"} for each text from one shared
+    classification pass (cache, local tier, batched LLM calls), in order.
+    Keyword arguments are passed on to analyze_in_batches.
+    """
+    return analyze_in_batches(list(texts), **kwargs)
+
+
+def analyze_text(text, **kwargs):
+    """
+    Full analysis of one text, or of each text in an iterable, with a single
+    structured call instead of one call per field. Runs at interactive
+    priority unless priority is passed.
+    """
+    kwargs.setdefault("priority", PRIORITY_INTERACTIVE)
+
+    if isinstance(text, str):
+        return analyze_texts([text], **kwargs)[0]
+
+    return analyze_texts(text, **kwargs)
+
+
+def get_sentiment(text):
+    return analyze_text(text)["sentiment"]
+
+
+def get_topic(text):
+    return analyze_text(text)["topic"]
+
+
+def get_urgency(text):
+    return analyze_text(text)["urgency"]
+
+
+# Dashboard counts are kept pre-aggregated: analyzed mentions per (brand,
+# hour or day, sentiment, urgency) and per (brand, day, normalized topic).
+# Every analysis write-back subtracts the rows' old contribution and adds the
+# new one in the same transaction, so charts read O(buckets) rows.
+ROLLUP_GRANULARITIES = ("hour", "day")
+ROLLUP_CHUNK = 500
+
+
+def rollup_bucket(timestamp, granularity):
+    timestamp = str(timestamp or "")
+    return f"{timestamp[:13]}:00" if granularity == "hour" else timestamp[:10]
+
+
+def normalize_topics(topic):
+    """Splits a comma-separated topic label into normalized topic names."""
+    return [part.strip().lower() for part in str(topic or "").split(",") if part.strip()]
+
+
+def add_rollup_rows(deltas, rows, sign):
+    sentiment_deltas, topic_deltas = deltas
+
+    for brand, timestamp, sentiment, topic, urgency in rows:
+        for granularity in ROLLUP_GRANULARITIES:
+            key = (brand, granularity, rollup_bucket(timestamp, granularity), sentiment, urgency or "")
+            sentiment_deltas[key] = sentiment_deltas.get(key, 0) + sign
+
+        day = rollup_bucket(timestamp, "day")
+
+        for name in normalize_topics(topic):
+            key = (brand, day, name)
+            topic_deltas[key] = topic_deltas.get(key, 0) + sign
+
+
+def collect_rollup_rows(conn, deltas, mention_ids, sign):
+    """
+    Adds sign times the current contribution of mention_ids to deltas and
+    returns the analyzed rows read, as (id, brand, timestamp, sentiment,
+    topic, urgency).
+    """
+    mention_ids = list(mention_ids)
+    collected = []
+
+    for start in range(0, len(mention_ids), ROLLUP_CHUNK):
+        chunk = mention_ids[start:start + ROLLUP_CHUNK]
+        rows = conn.execute(
+            f"SELECT id, brand, timestamp, sentiment, topic, urgency FROM mentions "
+            f"WHERE id IN ({','.join('?' * len(chunk))}) AND sentiment IS NOT NULL",
+            chunk,
+        ).fetchall()
+        add_rollup_rows(deltas, [row[1:] for row in rows], sign)
+        collected.extend(rows)
+
+    return collected
+
+
+def apply_rollup_deltas(conn, deltas):
+    sentiment_deltas, topic_deltas = deltas
+
+    conn.executemany(
+        """
+        INSERT INTO sentiment_rollup (brand, granularity, bucket, sentiment, urgency, count)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (brand, granularity, bucket, sentiment, urgency)
+        DO UPDATE SET count = count + excluded.count
+        """,
+        [(*key, delta) for key, delta in sentiment_deltas.items() if delta],
+    )
+    conn.executemany(
+        """
+        INSERT INTO topic_rollup (brand, day, topic, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT (brand, day, topic) DO UPDATE SET count = count + excluded.count
+        """,
+        [(*key, delta) for key, delta in topic_deltas.items() if delta],
+    )
+
+    if any(delta < 0 for delta in sentiment_deltas.values()):
+        conn.execute("DELETE FROM sentiment_rollup WHERE count <= 0")
+
+    if any(delta < 0 for delta in topic_deltas.values()):
+        conn.execute("DELETE FROM topic_rollup WHERE count <= 0")
+
+
+def compute_rollups(conn, brand_name=None):
+    """Aggregates the rollups from the raw mentions table."""
+    sql = "SELECT brand, timestamp, sentiment, topic, urgency FROM mentions WHERE sentiment IS NOT NULL"
+    params = ()
+
+    if brand_name is not None:
+        sql += " AND brand=?"
+        params = (brand_name,)
+
+    deltas = ({}, {})
+    cursor = conn.execute(sql, params)
+
+    while True:
+        rows = cursor.fetchmany(10000)
+
+        if not rows:
+            break
+
+        add_rollup_rows(deltas, rows, 1)
+
+    return deltas
+
+
+def rebuild_rollups_in(conn, brand_name=None):
+    if brand_name is None:
+        conn.execute("DELETE FROM sentiment_rollup")
+        conn.execute("DELETE FROM topic_rollup")
+    else:
+        conn.execute("DELETE FROM sentiment_rollup WHERE brand=?", (brand_name,))
+        conn.execute("DELETE FROM topic_rollup WHERE brand=?", (brand_name,))
+
+    apply_rollup_deltas(conn, compute_rollups(conn, brand_name))
+
+
+def rebuild_rollups(brand_name=None):
+    """Backfills the rollup tables from the raw mentions table."""
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rebuild_rollups_in(conn, brand_name)
+        conn.commit()
+
+
+def check_rollups(brand_name=None):
+    """
+    Compares the rollup tables with a fresh aggregation of the raw table.
+    Returns a list of (table, key, stored, expected) mismatches.
+    """
+    with get_connection() as conn:
+        # One read snapshot for the raw rows and the stored rollups.
+        conn.execute("BEGIN")
+
+        sentiment_expected, topic_expected = compute_rollups(conn, brand_name)
+
+        where, params = ("WHERE brand=?", (brand_name,)) if brand_name is not None else ("", ())
+
+        sentiment_stored = {
+            tuple(row[:-1]): row[-1]
+            for row in conn.execute(
+                f"SELECT brand, granularity, bucket, sentiment, urgency, count FROM sentiment_rollup {where}", params
+            )
+        }
+        topic_stored = {
+            tuple(row[:-1]): row[-1]
+            for row in conn.execute(f"SELECT brand, day, topic, count FROM topic_rollup {where}", params)
+        }
+
+        conn.commit()
+
+    mismatches = []
+
+    for table, stored, expected in (
+        ("sentiment_rollup", sentiment_stored, sentiment_expected),
+        ("topic_rollup", topic_stored, topic_expected),
+    ):
+        for key in sorted(set(stored) | set(expected)):
+            if stored.get(key, 0) != expected.get(key, 0):
+                mismatches.append((table, key, stored.get(key, 0), expected.get(key, 0)))
+
+    return mismatches
+
+
+def get_sentiment_counts(brand_name):
+    """Analyzed mentions per sentiment, from the rollups."""
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT sentiment, SUM(count) FROM sentiment_rollup WHERE brand=? AND granularity='day' "
+            "GROUP BY sentiment ORDER BY SUM(count) DESC",
+            (brand_name,),
+        ).fetchall()
+
+    return pd.Series(dict(rows), name="count", dtype="int64")
+
+
+def get_topic_counts(brand_name, limit=None):
+    """Analyzed mentions per normalized topic, most frequent first, from the rollups."""
+    sql = "SELECT topic, SUM(count) FROM topic_rollup WHERE brand=? GROUP BY topic ORDER BY SUM(count) DESC, topic"
+    params = [brand_name]
+
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+
+    with get_connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    return pd.Series(dict(rows), name="count", dtype="int64")
+
+
+def get_score_counts(brand_name):
+    """Returns (total, positive, negative, neutral, high_urgency) from the rollups."""
+    with get_connection() as conn:
+        row = conn.execute(
+            """
+            SELECT
+                COALESCE(SUM(count), 0),
+                COALESCE(SUM(CASE WHEN sentiment='Positive' THEN count END), 0),
+                COALESCE(SUM(CASE WHEN sentiment='Negative' THEN count END), 0),
+                COALESCE(SUM(CASE WHEN sentiment='Neutral' THEN count END), 0),
+                COALESCE(SUM(CASE WHEN urgency='High' THEN count END), 0)
+            FROM sentiment_rollup WHERE brand=? AND granularity='day'
+            """,
+            (brand_name,),
+        ).fetchone()
+
+    return tuple(row)
+
+
+# Trend queries read the rollups, so their cost depends on the number of
+# buckets in the window, never on the number of mentions. Windows longer
+# than TREND_MAX_BUCKETS buckets are cut to the most recent ones.
+TREND_MAX_BUCKETS = 2000
+TREND_SENTIMENTS = ("Positive", "Negative", "Neutral")
+TREND_FREQUENCIES = {"hour": "h", "day": "D"}
+
+
+def get_sentiment_trend(brand_name, granularity="day", start=None, end=None, rolling_window=7):
+    """
+    Returns one row per bucket between start and end (inclusive of empty
+    buckets) with Positive/Negative/Neutral counts, high_urgency, total and
+    negative_share, plus a <column>_rolling mean over rolling_window buckets.
+    """
+    frequency = TREND_FREQUENCIES[granularity]
+    step = pd.Timedelta(1, frequency)
+
+    last = (pd.Timestamp(end) - pd.Timedelta(1, "us")).floor(frequency) if end is not None else pd.Timestamp.now().floor(frequency)
+    first = last - (TREND_MAX_BUCKETS - 1) * step
+
+    if start is not None:
+        first = max(first, pd.Timestamp(start).floor(frequency))
+
+    with get_connection() as conn:
+        rows = pd.read_sql_query(
+            "SELECT bucket, sentiment, urgency, count FROM sentiment_rollup "
+            "WHERE brand=? AND granularity=? AND bucket >= ? AND bucket <= ?",
+            conn,
+            params=(
+                brand_name,
+                granularity,
+                rollup_bucket(format_bound(first), granularity),
+                rollup_bucket(format_bound(last), granularity),
+            ),
+        )
+
+    index = pd.date_range(first, last, freq=frequency, name="bucket")
+
+    rows["bucket"] = pd.to_datetime(rows["bucket"])
+
+    trend = (
+        rows.pivot_table(index="bucket", columns="sentiment", values="count", aggfunc="sum")
+        .reindex(index=index, columns=list(TREND_SENTIMENTS))
+        .fillna(0)
+        .astype("int64")
+        .rename_axis(columns=None)
+    )
+    trend["high_urgency"] = (
+        rows[rows["urgency"] == "High"].groupby("bucket")["count"].sum()
+        .reindex(index, fill_value=0)
+        .astype("int64")
+    )
+    trend["total"] = trend[list(TREND_SENTIMENTS)].sum(axis=1)
+
+    rolling = trend.rolling(rolling_window, min_periods=1).mean()
+    trend["negative_share"] = (trend["Negative"] / trend["total"].where(trend["total"] > 0)).fillna(0.0)
+
+    for column in rolling.columns:
+        trend[f"{column}_rolling"] = rolling[column]
+
+    trend["negative_share_rolling"] = (
+        rolling["Negative"] / rolling["total"].where(rolling["total"] > 0)
+    ).fillna(0.0)
+
+    return trend
+
+
+def update_mention_analysis(mention_id, sentiment, topic, urgency):
+    with get_connection() as conn:
+        rev = next_analysis_rev(conn)
+        deltas = ({}, {})
+        old_rows = collect_rollup_rows(conn, deltas, [mention_id], -1)
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE mentions
+            SET sentiment=?, topic=?, urgency=?, analysis_rev=?
+            WHERE id=?
+        """,
+            (sentiment, topic, urgency, rev, mention_id),
+        )
+        new_rows = collect_rollup_rows(conn, deltas, [mention_id], 1)
+        apply_rollup_deltas(conn, deltas)
+        conn.commit()
+
+    invalidate_mention_cache()
+    publish_analysis_events(new_rows, old_rows)
+
+
+def update_mentions_analysis_bulk(updates, chunk_size=None, progress_callback=None):
+    """
+    Writes back (mention_id, sentiment, topic, urgency) rows with executemany.
+    Everything is committed in one transaction unless chunk_size is given, in
+    which case each chunk is committed and progress_callback(done, total) is
+    called after it.
+    """
+    rows = [
+        (sentiment, topic, urgency, mention_id)
+        for mention_id, sentiment, topic, urgency in updates
+    ]
+
+    total = len(rows)
+
+    if not total:
+        return 0
+
+    chunk_size = chunk_size or total
+    events_new, events_old = [], []
+
+    with get_connection() as conn:
+        for start in range(0, total, chunk_size):
+            chunk = rows[start:start + chunk_size]
+            mention_ids = [row[-1] for row in chunk]
+            deltas = ({}, {})
+
+            rev = next_analysis_rev(conn)
+            old_rows = collect_rollup_rows(conn, deltas, mention_ids, -1)
+            conn.executemany(
+                "UPDATE mentions SET sentiment=?, topic=?, urgency=?, analysis_rev=? WHERE id=?",
+                [
+                    (sentiment, topic, urgency, rev, mention_id)
+                    for sentiment, topic, urgency, mention_id in chunk
+                ],
+            )
+            new_rows = collect_rollup_rows(conn, deltas, mention_ids, 1)
+            apply_rollup_deltas(conn, deltas)
+            conn.commit()
+
+            events_new.extend(new_rows)
+            events_old.extend(old_rows)
+
+            if progress_callback:
+                progress_callback(min(start + chunk_size, total), total)
+
+    invalidate_mention_cache()
+
+    # Published once for the whole write-back, so the alert engine sees it
+    # in timestamp order whatever order the updates came in.
+    publish_analysis_events(events_new, events_old)
+
+    return total
+
+
+def analyze_pending_mentions(brand_name, limit=None, chunk_size=200, after=None):
+    """
+    Classifies up to limit of the brand's pending canonical mentions, oldest
+    post first (only those after the (timestamp, id) pair after, if given),
+    and writes the results back. Mentions the LLM gave no usable answer for
+    keep a NULL sentiment and stay pending. Returns {"analyzed",
+    "unanswered", "last"}, last being the (timestamp, id) of the last mention
+    looked at, for paging past mentions that keep failing.
+    """
+    pending_df = get_pending_mentions(brand_name, limit=limit, after=after)
+
+    if pending_df.empty:
+        return {"analyzed": 0, "unanswered": 0, "last": after}
+
+    analyses = analyze_in_batches(pending_df["text"].tolist(), fallback=False)
+
+    analyzed = update_mentions_analysis_bulk(
+        (
+            (row.id, analysis["sentiment"], analysis["topic"], analysis["urgency"])
+            for row, analysis in zip(pending_df.itertuples(), analyses)
+            if analysis is not None
+        ),
+        chunk_size=chunk_size,
+    )
+
+    last = pending_df.iloc[-1]
+
+    return {
+        "analyzed": analyzed,
+        "unanswered": len(pending_df) - analyzed,
+        "last": (last["timestamp"], int(last["id"])),
+    }
+
+
+# Sentiment-spike alerts. Every analysis write-back feeds the newly analyzed
+# mentions to the alert engine. Per brand it keeps a rolling window of
+# ALERT_WINDOW_SECONDS split into ALERT_SLOTS slots, with running totals, so
+# each mention costs O(1). Each time a slot closes, the window's negative
+# ratio and high-urgency count update an EWMA baseline (overall and per hour
+# of day). A spike is a window ALERT_Z_THRESHOLD deviations above the
+# baseline as it stood before the window's oldest slot opened, so the spike
+# being scored has not leaked into it. A window that scores as a spike is
+# clamped to the threshold before it updates the baseline, so a long
+# incident is learned slowly instead of hiding itself. Baselines live in
+# memory and warm up again after a restart.
+# Mentions posted more than ALERT_MAX_EVENT_AGE before they are analyzed
+# (a backfill, or a backlog drained after downtime) still feed the windows
+# and baselines but never raise an alert.
+ALERTS_ENABLED = True
+ALERT_WINDOW_SECONDS = 3600
+ALERT_SLOTS = 12
+ALERT_EWMA_ALPHA = 0.05
+ALERT_Z_THRESHOLD = 3.5
+ALERT_MIN_MENTIONS = 20
+ALERT_COOLDOWN_SECONDS = 3600
+ALERT_SEASONS = 24
+ALERT_MAX_EVENT_AGE = 6 * 3600
+
+# A day of closed slots before any alert, and three days of an hour before
+# its seasonal baseline replaces the overall one.
+ALERT_WARMUP_SLOTS = 24 * ALERT_SLOTS
+ALERT_SEASON_WARMUP = 3 * ALERT_SLOTS
+
+# Deviations never go below these, so a very steady baseline does not turn
+# small wobbles into alerts.
+ALERT_MIN_STD = {"negative_ratio": 0.05, "high_urgency": 2.0}
+
+
+class EWMABaseline:
+    """Exponentially weighted mean and variance, overall and per season."""
+
+    def __init__(self, alpha=ALERT_EWMA_ALPHA, seasons=ALERT_SEASONS):
+        self.alpha = alpha
+        self.overall = [0.0, 0.0, 0]
+        self.seasonal = [[0.0, 0.0, 0] for _ in range(seasons)]
+
+    @staticmethod
+    def update_state(state, value, alpha):
+        mean, var, count = state
+
+        if not count:
+            state[:] = [value, 0.0, 1]
+            return
+
+        diff = value - mean
+        incr = alpha * diff
+        state[:] = [mean + incr, (1 - alpha) * (var + diff * incr), count + 1]
+
+    def update(self, value, season):
+        self.update_state(self.overall, value, self.alpha)
+        self.update_state(self.seasonal[season], value, self.alpha)
+
+    def copy(self):
+        baseline = EWMABaseline.__new__(EWMABaseline)
+        baseline.alpha = self.alpha
+        baseline.overall = list(self.overall)
+        baseline.seasonal = [list(state) for state in self.seasonal]
+        return baseline
+
+    def expected(self, season):
+        """Returns (mean, std, samples), preferring the season once it has warmed up."""
+        state = self.seasonal[season]
+
+        if state[2] < ALERT_SEASON_WARMUP:
+            state = self.overall
+
+        return state[0], state[1] ** 0.5, self.overall[2]
+
+
+class BrandWindow:
+    """Rolling slot counters and baselines for one brand."""
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.slot_ids = [None] * slots
+        self.totals = [0] * slots
+        self.negatives = [0] * slots
+        self.highs = [0] * slots
+        self.total = 0
+        self.negative = 0
+        self.high = 0
+        self.current = None
+        self.baselines = {"negative_ratio": EWMABaseline(), "high_urgency": EWMABaseline()}
+        # Baselines as of each of the last `slots` slot closes; the oldest is
+        # the one from before the current window opened.
+        self.history = deque(maxlen=slots)
+        self.last_alert = {}
+
+    def scoring_baselines(self):
+        return self.history[0] if self.history else self.baselines
+
+    def metrics(self):
+        return {
+            "negative_ratio": self.negative / self.total if self.total else 0.0,
+            "high_urgency": float(self.high),
+        }
+
+
+class AlertEngine:
+    """
+    Consumes (brand, timestamp, sentiment, urgency) events in roughly
+    timestamp order and sends an alert dict to every sink's emit() when a
+    brand's window spikes above its baseline. Events more than max_age
+    seconds older than clock() are counted but never alert.
+    """
+
+    def __init__(self, sinks=None, window_seconds=ALERT_WINDOW_SECONDS, slots=ALERT_SLOTS,
+                 max_age=ALERT_MAX_EVENT_AGE, clock=time.time):
+        self.sinks = list(sinks or [])
+        self.slots = slots
+        self.slot_seconds = window_seconds / slots
+        self.max_age = max_age
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.brands = {}
+        self.stats = {"events": 0, "stale_events": 0, "backfill_events": 0, "alerts": 0}
+
+    def process(self, events):
+        alerts = []
+        live_after = self.clock() - self.max_age
+
+        with self.lock:
+            for brand_name, timestamp, sentiment, urgency in events:
+                when = event_time(timestamp)
+                alert = self.add(brand_name, when, sentiment == "Negative", urgency == "High", when >= live_after)
+
+                if alert:
+                    alerts.extend(alert)
+
+        for alert in alerts:
+            for sink in self.sinks:
+                try:
+                    sink.emit(alert)
+                except Exception as e:
+                    notify(logging.ERROR, f"Alert sink {type(sink).__name__} failed: {e}")
+
+        return alerts
+
+    def add(self, brand_name, when, negative, high, live=True):
+        self.stats["events"] += 1
+
+        window = self.brands.get(brand_name)
+
+        if window is None:
+            window = self.brands[brand_name] = BrandWindow(self.slots)
+
+        slot_id = int(when // self.slot_seconds)
+
+        if window.current is None:
+            window.current = slot_id
+
+        if slot_id > window.current:
+            self.advance(window, slot_id)
+
+        elif slot_id <= window.current - self.slots:
+            self.stats["stale_events"] += 1
+            return None
+
+        position = slot_id % self.slots
+
+        if window.slot_ids[position] != slot_id:
+            self.clear_slot(window, position)
+            window.slot_ids[position] = slot_id
+
+        window.totals[position] += 1
+        window.total += 1
+
+        if negative:
+            window.negatives[position] += 1
+            window.negative += 1
+
+        if high:
+            window.highs[position] += 1
+            window.high += 1
+
+        if not live:
+            self.stats["backfill_events"] += 1
+            return None
+
+        return self.check(brand_name, window, when)
+
+    def clear_slot(self, window, position):
+        window.total -= window.totals[position]
+        window.negative -= window.negatives[position]
+        window.high -= window.highs[position]
+        window.totals[position] = window.negatives[position] = window.highs[position] = 0
+
+    def advance(self, window, slot_id):
+        # Close each slot in turn and expire the one falling out of the
+        # window. After a whole window of steps every slot is empty, so a
+        # longer gap costs no more than that.
+        closing = window.current
+        last = min(slot_id, window.current + self.slots)
+
+        while closing < last:
+            self.close_slot(window, closing)
+            closing += 1
+            position = closing % self.slots
+
+            if window.slot_ids[position] is not None:
+                self.clear_slot(window, position)
+                window.slot_ids[position] = None
+
+        window.current = slot_id
+
+    def close_slot(self, window, slot_id):
+        season = self.season(slot_id)
+        reference = window.scoring_baselines()
 
-try:
-    API_KEY = st.secrets["GEMINI_API_KEY"]
-except Exception:
-    API_KEY = os.getenv("GEMINI_API_KEY")
-    
-GROQ_API_KEY = None
+        for metric, value in window.metrics().items():
+            if metric == "negative_ratio" and window.total < ALERT_MIN_MENTIONS:
+                continue
 
-try:
-    GROQ_API_KEY = st.secrets["GROQ_API_KEY"]
-except Exception:
-    GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+            scored = self.score(window, metric, value, reference[metric], season)
 
+            if scored and scored[0] >= ALERT_Z_THRESHOLD:
+                value = scored[1] + ALERT_Z_THRESHOLD * scored[2]
 
+            window.baselines[metric].update(value, season)
 
-# if not API_KEY:
-#     st.error("❌ GEMINI_API_KEY not found in Streamlit secrets")
-#     st.stop()
-if not GROQ_API_KEY and not API_KEY:
-    st.error("❌ No AI API key found. Add GROQ_API_KEY or GEMINI_API_KEY")
-    st.stop()
+        window.history.append({metric: baseline.copy() for metric, baseline in window.baselines.items()})
 
-@st.cache_resource
-def get_gemini_client():
-    return genai.Client(api_key=API_KEY)
+    def season(self, slot_id):
+        return int(slot_id * self.slot_seconds // 3600) % ALERT_SEASONS
 
+    @staticmethod
+    def score(window, metric, value, baseline, season):
+        """Returns (zscore, mean, spread) of value, or None while the baseline warms up."""
+        mean, std, samples = baseline.expected(season)
 
-@st.cache_resource
-def get_groq_client():
-    return Groq(api_key=GROQ_API_KEY)
+        if samples < ALERT_WARMUP_SLOTS:
+            return None
 
+        # The spread adds the sampling noise expected for this window
+        # (binomial for the ratio, Poisson for the count) to the baseline's
+        # own, since a young hour-of-day baseline underestimates both its
+        # mean and its variance.
+        if metric == "negative_ratio":
+            if window.total < ALERT_MIN_MENTIONS:
+                return None
+            noise = (mean * (1 - mean) / window.total) ** 0.5
+        else:
+            noise = mean ** 0.5
 
+        spread = max((std ** 2 + noise ** 2) ** 0.5, ALERT_MIN_STD[metric])
+        return (value - mean) / spread, mean, spread
 
+    def check(self, brand_name, window, when):
+        season = self.season(window.current)
+        reference = window.scoring_baselines()
+        alerts = []
 
+        for metric, value in window.metrics().items():
+            scored = self.score(window, metric, value, reference[metric], season)
 
+            if scored is None or scored[0] < ALERT_Z_THRESHOLD:
+                continue
 
+            zscore, mean = scored[:2]
 
+            if when - window.last_alert.get(metric, float("-inf")) < ALERT_COOLDOWN_SECONDS:
+                continue
 
+            window.last_alert[metric] = when
+            self.stats["alerts"] += 1
 
+            alerts.append({
+                "brand": brand_name,
+                "metric": metric,
+                "value": round(value, 4),
+                "baseline": round(mean, 4),
+                "zscore": round(zscore, 2),
+                "window_mentions": window.total,
+                "window_start": datetime.fromtimestamp((window.current - self.slots + 1) * self.slot_seconds).isoformat(sep=" "),
+                "window_end": datetime.fromtimestamp(when).isoformat(sep=" ", timespec="seconds"),
+            })
 
-def init_db():
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS mentions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                brand TEXT NOT NULL,
-                source TEXT NOT NULL,
-                text TEXT NOT NULL,
-                url TEXT UNIQUE,
-                timestamp DATETIME,
-                sentiment TEXT,
-                topic TEXT,
-                urgency TEXT
-            )
-        """)
+        return alerts
 
 
-if "db_initialized" not in st.session_state:
-    init_db()
-    st.session_state.db_initialized = True
+def event_time(timestamp):
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
 
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
 
+    return datetime.fromisoformat(str(timestamp)).timestamp()
 
 
-def add_mention(brand_name, source, text, url, timestamp):
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM mentions WHERE url=?", (url,))
-        if not cursor.fetchone():
-            cursor.execute(
-                "INSERT INTO mentions (brand, source, text, url, timestamp) VALUES (?, ?, ?, ?, ?)",
-                (brand_name, source, text, url, timestamp),
+def describe_alert(alert):
+    if alert["metric"] == "negative_ratio":
+        return (
+            f"Negative sentiment spike for {alert['brand']}: {alert['value']:.0%} of the last "
+            f"{alert['window_mentions']} mentions (usually {alert['baseline']:.0%})"
+        )
+
+    return (
+        f"High-urgency spike for {alert['brand']}: {alert['value']:.0f} high-urgency mentions "
+        f"in the last hour (usually {alert['baseline']:.1f})"
+    )
+
+
+class LogAlertSink:
+    """Reports alerts through notify(), i.e. the log and any notify hooks."""
+
+    def emit(self, alert):
+        notify(logging.WARNING, describe_alert(alert))
+
+
+class SQLiteAlertSink:
+    """Stores alerts in the alerts table, where the dashboard reads them."""
+
+    def emit(self, alert):
+        with get_connection() as conn:
+            conn.execute(
+                "INSERT INTO alerts (brand, metric, value, baseline, zscore, window_mentions, window_start, window_end, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    alert["brand"], alert["metric"], alert["value"], alert["baseline"], alert["zscore"],
+                    alert["window_mentions"], alert["window_start"], alert["window_end"], time.time(),
+                ),
             )
             conn.commit()
-            return True
-    return False
 
 
-def get_all_mentions_as_df(brand_name):
-    with sqlite3.connect(DB_NAME) as conn:
-        df = pd.read_sql_query(
-            "SELECT * FROM mentions WHERE brand=? ORDER BY timestamp DESC",
-            conn,
-            params=(brand_name,),
-        )
-        if "timestamp" in df.columns:
-            df["timestamp"] = pd.to_datetime(df["timestamp"])
-        return df
+class WebhookAlertSink:
+    """
+    POSTs each alert as JSON (with a human-readable "text") to url. post
+    defaults to requests.post and can be replaced for tests.
+    """
 
+    def __init__(self, url, post=None, timeout=5):
+        if post is None:
+            import requests
 
+            post = requests.post
 
+        self.url = url
+        self.post = post
+        self.timeout = timeout
 
+    def emit(self, alert):
+        response = self.post(self.url, json={**alert, "text": describe_alert(alert)}, timeout=self.timeout)
 
+        if getattr(response, "status_code", 200) >= 400:
+            raise RuntimeError(f"webhook returned {response.status_code}")
 
 
+@cache_resource
+def get_alert_engine():
+    return AlertEngine([LogAlertSink(), SQLiteAlertSink()])
 
-def fetch_reddit_mentions(brand_name, subreddits_list):
 
-    added_count = 0
-    processed_urls = set()
+def configure_alert_sinks(sinks):
+    get_alert_engine().sinks = list(sinks)
 
-    existing_df = get_all_mentions_as_df(brand_name)
-    existing_urls = set(existing_df["url"].tolist())
 
-    session = requests.Session()
+def get_alert_stats():
+    engine = get_alert_engine()
 
-    session.headers.update({
-        "User-Agent": "BrandMonitor/1.0"
-    })
+    with engine.lock:
+        return dict(engine.stats, brands=len(engine.brands))
 
-    for sub_name in subreddits_list:
 
-        sub_name = sub_name.strip()
+def publish_analysis_events(new_rows, old_rows=()):
+    """
+    Feeds mentions analyzed for the first time to the alert engine. Rows are
+    (id, brand, timestamp, sentiment, topic, urgency) as returned by
+    collect_rollup_rows; re-analyzed mentions are left out.
+    """
+    if not ALERTS_ENABLED or not new_rows:
+        return
 
-        if not sub_name:
-            continue
+    seen = {row[0] for row in old_rows}
+    events = [
+        (brand, timestamp, sentiment, urgency)
+        for mention_id, brand, timestamp, sentiment, topic, urgency in sorted(new_rows, key=lambda row: str(row[2]))
+        if mention_id not in seen
+    ]
 
-        data = None
+    try:
+        get_alert_engine().process(events)
+    except Exception as e:
+        notify(logging.ERROR, f"Alert engine failed: {e}")
 
-        
-        try:
 
-            url = "https://api.pullpush.io/reddit/search/submission/"
+def get_recent_alerts(brand_name, since=None, limit=20):
+    sql = "SELECT brand, metric, value, baseline, zscore, window_mentions, window_start, window_end, created_at FROM alerts WHERE brand=?"
+    params = [brand_name]
 
-            params = {
-                "subreddit": sub_name,
-                "q": brand_name,
-                "size": 25,
-                "sort": "desc",
-                "sort_type": "created_utc"
-            }
+    if since is not None:
+        sql += " AND created_at >= ?"
+        params.append(since)
 
-            response = session.get(url, params=params, timeout=15)
+    sql += " ORDER BY created_at DESC LIMIT ?"
+    params.append(int(limit))
 
-            if response.status_code == 200:
+    with get_connection() as conn:
+        return pd.read_sql_query(sql, conn, params=params)
 
-                print("Using PullPush")
 
-                posts = response.json().get("data", [])
+def get_model_name(task_type="general"):
 
-                data = {
-                    "data": {
-                        "children": [{"data": post} for post in posts]
-                    }
-                }
+    if task_type == "premium":
+        return "llama-3.3-70b-versatile"
 
-            elif response.status_code == 429:
+    return "llama-3.1-8b-instant"
 
-                print("PullPush rate limited, switching to fallback")
 
-        except Exception as e:
+GEMINI_MODEL = "gemini-2.5-flash"
 
-            print("PullPush failed:", e)
+# Health is tracked over the last ROUTER_WINDOW calls per provider and model
+# that are at most ROUTER_WINDOW_SECONDS old, so a past brown-out ages out.
+ROUTER_WINDOW = 50
+ROUTER_WINDOW_SECONDS = 60.0
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_ERROR_RATE = 0.5
+CIRCUIT_MIN_SAMPLES = 10
+CIRCUIT_COOLDOWN = 30.0
 
-        
-        if not data:
+# A hedged duplicate goes to the next provider once the first has run past
+# its own p95 latency (never sooner than HEDGE_MIN_DELAY), and only if the
+# rate limiter can admit it at once: hedges never wait for quota or jump
+# the queue.
+HEDGE_ENABLED = True
+HEDGE_MIN_SAMPLES = 10
+HEDGE_MIN_DELAY = 0.5
 
-            try:
+_hedge_pool = ThreadPoolExecutor(max_workers=8)
 
-                url = f"https://www.reddit.com/r/{sub_name}/new.json"
 
-                response = session.get(
-                    url,
-                    params={"limit": 25},
-                    timeout=15
-                )
+class GroqProvider:
+    name = "groq"
 
-                if response.status_code == 200:
+    def available(self):
+        return bool(get_setting("GROQ_API_KEY"))
 
-                    print("Using Reddit JSON fallback")
+    def model_for(self, task_type):
+        return get_model_name(task_type)
 
-                    data = response.json()
+    def complete(self, prompt, model):
+        response = get_groq_client().chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.0
+        )
 
-                else:
+        return response.choices[0].message.content.strip()
 
-                    print("Reddit JSON failed:", response.status_code)
+    def stream(self, prompt, model):
+        response = get_groq_client().chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.0,
+            stream=True
+        )
 
-            except Exception as e:
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
 
-                print("Reddit JSON error:", e)
 
-        
-        if not data:
+class GeminiProvider:
+    name = "gemini"
 
-            try:
+    def available(self):
+        return bool(get_setting("GEMINI_API_KEY"))
 
-                url = f"https://redlib.perennialte.ch/r/{sub_name}/new.json"
+    def model_for(self, task_type):
+        return GEMINI_MODEL
 
-                response = session.get(url, timeout=15)
+    def complete(self, prompt, model):
+        response = get_gemini_client().models.generate_content(
+            model=model,
+            contents=prompt
+        )
 
-                if response.status_code == 200:
+        return response.text.strip()
 
-                    print("Using Redlib fallback")
+    def stream(self, prompt, model):
+        response = get_gemini_client().models.generate_content_stream(
+            model=model,
+            contents=prompt
+        )
 
-                    data = response.json()
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
 
-            except Exception as e:
 
-                print("Redlib failed:", e)
+class StubProvider:
+    """
+    In-process provider for tests and benchmarks. responder is a string or a
+    callable(prompt, model) returning one; it may raise to simulate failures.
+    """
 
-       
-        if not data:
+    def __init__(self, name="stub", responder="", latency=0.0, model="stub-model"):
+        self.name = name
+        self.responder = responder
+        self.latency = latency
+        self.model = model
 
-            st.warning(f"All sources failed for r/{sub_name}")
+    def available(self):
+        return True
 
-            continue
+    def model_for(self, task_type):
+        return self.model
 
-        posts = data.get("data", {}).get("children", [])
+    def complete(self, prompt, model):
+        if self.latency:
+            time.sleep(self.latency)
 
-        for item in posts:
+        if callable(self.responder):
+            return self.responder(prompt, model)
 
-            post = item.get("data", {})
+        return self.responder
 
-            title = post.get("title", "")
-            body = post.get("selftext", "")
+    def stream(self, prompt, model):
+        words = self.complete(prompt, model).split(" ")
 
-            text = f"{title} {body}"
+        for index, word in enumerate(words):
+            yield word if index == len(words) - 1 else word + " "
 
-            if brand_name.lower() not in text.lower():
-                continue
 
-            permalink = post.get("permalink")
+class ProviderHealth:
+    """Rolling latency/error window and circuit breaker for one provider model."""
 
-            if not permalink:
-                continue
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=ROUTER_WINDOW)
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_started = None
 
-            post_url = f"https://reddit.com{permalink}"
+    def record(self, latency, ok):
+        with self.lock:
+            self.samples.append((time.monotonic(), latency, ok))
+            self.probe_started = None
 
-            if post_url in existing_urls or post_url in processed_urls:
-                continue
+            if ok:
+                self.consecutive_failures = 0
+                self.opened_at = None
+                return
 
-            created = post.get("created_utc", time.time())
+            self.consecutive_failures += 1
 
-            try:
-                timestamp = datetime.fromtimestamp(float(created))
-            except:
-                timestamp = datetime.now()
+            if (
+                self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD
+                or (
+                    len(self.recent_locked()) >= CIRCUIT_MIN_SAMPLES
+                    and self.error_rate_locked() >= CIRCUIT_ERROR_RATE
+                )
+            ):
+                # Also re-opens a half-open circuit whose trial call failed.
+                self.opened_at = time.monotonic()
 
+    def recent_locked(self):
+        cutoff = time.monotonic() - ROUTER_WINDOW_SECONDS
 
-            if add_mention(
-                brand_name,
-                "Reddit",
-                text,
-                post_url,
-                timestamp
-            ):
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
 
-                added_count += 1
+        return self.samples
 
-                processed_urls.add(post_url)
+    def error_rate_locked(self):
+        samples = self.recent_locked()
 
-        time.sleep(2)
+        if not samples:
+            return 0.0
 
-    return added_count
+        return sum(1 for _, _, ok in samples if not ok) / len(samples)
 
+    def latency_percentile_locked(self, percentile):
+        latencies = sorted(latency for _, latency, ok in self.recent_locked() if ok)
 
+        if not latencies:
+            return None
 
+        return latencies[min(len(latencies) - 1, int(percentile * len(latencies)))]
 
+    def state(self):
+        with self.lock:
+            return self.state_locked()
 
+    def state_locked(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= CIRCUIT_COOLDOWN:
+            return "half-open"
+        return "open"
 
+    def probing_locked(self):
+        # A trial call that never reported back stops blocking after a cooldown.
+        return self.probe_started is not None and time.monotonic() - self.probe_started < CIRCUIT_COOLDOWN
 
+    def allows_requests(self):
+        with self.lock:
+            state = self.state_locked()
+            return state == "closed" or (state == "half-open" and not self.probing_locked())
 
-def generate_positive_report_summary(df):
-    """Generates a concise summary of POSITIVE feedback."""
-    positive_df = df[df["sentiment"] == "Positive"]
+    def begin_call(self):
+        """
+        Claims a call. Returns False while the circuit is open, or half-open
+        with its single trial call already in flight.
+        """
+        with self.lock:
+            state = self.state_locked()
 
-    if positive_df.empty:
-        return "No positive feedback found."
+            if state == "open":
+                return False
 
-    texts = "\n---\n".join(positive_df["text"].tolist())
-    texts = texts[:2000]  
+            if state == "half-open":
+                if self.probing_locked():
+                    return False
+                self.probe_started = time.monotonic()
 
-    prompt = f"""
-    You are a business analyst.
-    Summarize the following POSITIVE customer feedback in 3 bullet points.
-    Focus on strengths, value, and what users appreciate most.
+            return True
 
-    Feedback:
-    {texts}
+    def rank(self):
+        """
+        Lower is healthier: error rate first, then median latency. A provider
+        with no recent successes ranks as fast so it gets probed again.
+        """
+        with self.lock:
+            p50 = self.latency_percentile_locked(0.5)
+            return (round(self.error_rate_locked(), 1), p50 or 0.0)
+
+    def hedge_delay(self):
+        with self.lock:
+            successes = sum(1 for _, _, ok in self.recent_locked() if ok)
+
+            if successes < HEDGE_MIN_SAMPLES:
+                return None
+
+            return max(HEDGE_MIN_DELAY, self.latency_percentile_locked(0.95))
+
+    def snapshot(self):
+        state = self.state()
+
+        with self.lock:
+            return {
+                "state": state,
+                "samples": len(self.recent_locked()),
+                "error_rate": self.error_rate_locked(),
+                "p50_latency": self.latency_percentile_locked(0.5),
+                "p95_latency": self.latency_percentile_locked(0.95),
+            }
+
+
+class ProviderRouter:
+    """
+    Sends each prompt to the healthiest available provider, skipping those
+    with an open circuit, hedging slow calls and failing over on errors.
     """
 
-    try:
-        return generate_ai_response(prompt)
+    def __init__(self, providers, hedge=HEDGE_ENABLED):
+        self.lock = threading.Lock()
+        self.providers = list(providers)
+        self.hedge = hedge
+        self.health = {}
 
-    except Exception as e:
-        return f"Error generating positive summary: {e}"
+    def set_providers(self, providers, hedge=None):
+        with self.lock:
+            self.providers = list(providers)
+            self.health = {}
 
+            if hedge is not None:
+                self.hedge = hedge
 
-def generate_negative_report_summary(df):
-    negative_df = df[df["sentiment"] == "Negative"]
+    def models_for(self, task_type):
+        with self.lock:
+            providers = list(self.providers)
 
-    if negative_df.empty:
-        return "No negative feedback found."
+        return list(dict.fromkeys(provider.model_for(task_type) for provider in providers))
 
-    texts = "\n---\n".join(negative_df["text"].tolist())
-    texts = texts[:4000]
+    def get_health(self, provider, model):
+        key = (provider.name, model)
 
-    prompt = f"""
-    You are a business analyst.
-    Summarize the following NEGATIVE customer feedback in 3 bullet points.
-    Focus on complaints, pain points, and risks.
+        with self.lock:
+            if key not in self.health:
+                self.health[key] = ProviderHealth()
+            return self.health[key]
 
-    Feedback:
-    {texts}
-    """
+    def candidates(self, task_type):
+        with self.lock:
+            providers = list(self.providers)
 
-    try:
-        return generate_ai_response(prompt)
+        ranked = []
 
-    except Exception as e:
-        return f"Error generating negative summary: {e}"
+        for order, provider in enumerate(providers):
+            if not provider.available():
+                continue
 
+            model = provider.model_for(task_type)
+            health = self.get_health(provider, model)
 
+            if health.allows_requests():
+                ranked.append((health.rank(), order, provider, model, health))
 
+        ranked.sort(key=lambda item: (item[0], item[1]))
 
+        return [(provider, model, health) for _, _, provider, model, health in ranked]
 
-def generate_report_summary(df):
+    def call(self, provider, model, health, prompt):
+        if not health.begin_call():
+            raise RuntimeError("circuit open")
 
-    relevant_df = df[
-    (df["sentiment"] == "Negative") |
-    ((df["sentiment"] == "Neutral") & (df["urgency"] == "High"))
-]
-    
+        start = time.monotonic()
 
+        try:
+            result = provider.complete(prompt, model)
 
-    if relevant_df.empty:
-        return "No suggestions found."
-    
-    relevant_df = relevant_df.copy()
-    relevant_df["topic"] = (
-    relevant_df["topic"]
-    .dropna()
-    .str.lower()
-    .str.strip()
-)
+            if not result:
+                raise ValueError("empty response")
 
-    
+        except Exception:
+            health.record(time.monotonic() - start, False)
+            raise
 
-    topic_counts = (
-        relevant_df["topic"]
-        .dropna()
-        .str.strip()
-        .value_counts()
-    )
+        health.record(time.monotonic() - start, True)
 
-    total = topic_counts.sum()
+        return result, model
 
-    if total == 0:
-        return "No significant issues detected."
+    def complete(self, prompt, task_type="general", admit_hedge=None):
+        """
+        Returns (response, model) from the first provider that answers.
+        admit_hedge() is asked before each hedged duplicate is sent; the
+        hedge is skipped if it returns False.
+        """
+        candidates = self.candidates(task_type)
 
+        if not candidates:
+            raise RuntimeError("no AI provider available")
 
-    top_issues = topic_counts.head(5)
+        errors = []
 
-    issues_text = "\n".join(
-        [
-            f"• {topic} ({round(count/total*100,1)}%)"
-            for topic, count in top_issues.items()
-        ]
-    )
+        while candidates:
+            primary = candidates.pop(0)
+            delay = primary[2].hedge_delay() if self.hedge and candidates else None
 
-    
+            if delay is None:
+                try:
+                    return self.call(*primary, prompt)
+                except Exception as e:
+                    log.warning("%s failed: %s", primary[0].name, e)
+                    errors.append(f"{primary[0].name}: {e}")
+                    continue
 
-    texts = "\n---\n".join(relevant_df["text"].tolist())
-    texts = texts[:4000]
+            futures = {_hedge_pool.submit(self.call, *primary, prompt): primary}
+            done, _ = wait(futures, timeout=delay)
 
-    prompt = f"""
-You are an enterprise brand intelligence analyst.
+            if not done:
+                if admit_hedge is None or admit_hedge():
+                    secondary = candidates.pop(0)
+                    log.info("%s slower than p95, hedging to %s", primary[0].name, secondary[0].name)
+                    futures[_hedge_pool.submit(self.call, *secondary, prompt)] = secondary
+                else:
+                    log.info("%s slower than p95, no quota to hedge", primary[0].name)
 
-Explain the user problems clearly and professionally.
+            for future in as_completed(futures):
+                try:
+                    return future.result()
+                except Exception as e:
+                    provider = futures[future][0]
+                    log.warning("%s failed: %s", provider.name, e)
+                    errors.append(f"{provider.name}: {e}")
 
-Focus on:
+        raise RuntimeError("; ".join(errors))
 
-• Root causes  
-• User frustration patterns  
-• Product weaknesses  
+    def stream(self, prompt, task_type="general"):
+        """
+        Yields chunks from the healthiest provider. Fails over only until the
+        first chunk has been yielded; after that an error is raised as is.
+        """
+        candidates = self.candidates(task_type)
 
-Feedback:
-{texts}
-"""
+        if not candidates:
+            raise RuntimeError("no AI provider available")
 
-    ai_analysis = generate_ai_response(prompt)
+        errors = []
 
-   
+        for provider, model, health in candidates:
+            if not health.begin_call():
+                errors.append(f"{provider.name}: circuit open")
+                continue
 
-    final_output = f"""
-Most reported issues:
-{issues_text}
+            start = time.monotonic()
+            first_token = None
 
-Analysis:
-{ai_analysis}
-"""
+            try:
+                for chunk in provider.stream(prompt, model):
+                    if not chunk:
+                        continue
 
-    return final_output.strip()
+                    if first_token is None:
+                        first_token = time.monotonic() - start
 
+                    yield chunk
 
+                if first_token is None:
+                    raise ValueError("empty response")
 
+            except Exception as e:
+                health.record(time.monotonic() - start, False)
 
+                if first_token is not None:
+                    raise
 
-def batch_analyze_texts(texts):
-    """
-    Analyze multiple texts in a single API call using Gemini's structured output.
-    Returns a list of dicts: [{"sentiment": str, "topic": str, "urgency": str}, ...]
-    
-"""
-    if not texts:
-        return []
-    
-    
-    texts_with_indices = "\n\n".join(
-    [f"[{i}] {text[:250]}" for i, text in enumerate(texts)]
-)
+                log.warning("%s failed: %s", provider.name, e)
+                errors.append(f"{provider.name}: {e}")
+                continue
 
-    
+            total = time.monotonic() - start
+            health.record(total, True)
+            record_stream_metrics(provider.name, model, first_token, total)
 
-    prompt = f"""
-You are a strict JSON sentiment classifier.
+            return
 
-Classify EACH text independently.
-Do NOT average tone across texts.
-Return EXACTLY {len(texts)} JSON objects.
-If unsure, still return one object per text.
-Do NOT skip any text.
+        raise RuntimeError("; ".join(errors))
 
-Allowed sentiments:
-- Positive
-- Negative
-- Neutral
+    def snapshot(self):
+        with self.lock:
+            items = list(self.health.items())
 
-Rules:
-- Complaints or problems = Negative
-- Questions about issues = Negative
-- Praise or recommendation = Positive
-- Pure factual discussion = Neutral
+        return {
+            f"{name}/{model}": health.snapshot()
+            for (name, model), health in items
+        }
 
-Return ONLY valid JSON.
-No explanation.
-No markdown.
-No extra text.
 
-Format:
-[
-  {{
-    "sentiment": "Positive|Negative|Neutral",
-    "topic": "1-3 words",
-    "urgency": "High|Low"
-  }}
-]
+llm_stream_samples = deque(maxlen=500)
+_llm_stream_lock = threading.Lock()
 
-Texts:
-{texts_with_indices}
-"""
 
+def record_stream_metrics(provider_name, model, time_to_first_token, total_latency):
+    with _llm_stream_lock:
+        llm_stream_samples.append({
+            "provider": provider_name,
+            "model": model,
+            "time_to_first_token": time_to_first_token,
+            "total_latency": total_latency,
+        })
 
+    record_metric("llm_stream.time_to_first_token", time_to_first_token, provider=provider_name, model=model)
+    record_metric("llm_stream.total_latency", total_latency, provider=provider_name, model=model)
 
-    
-    
-    try:
 
-            response = generate_ai_response(prompt, task_type="classification")
+def get_llm_stream_stats():
+    """Time-to-first-token and total latency percentiles of recent streams."""
+    with _llm_stream_lock:
+        samples = list(llm_stream_samples)
+
+    stats = {"streams": len(samples)}
 
-            if not response or response.startswith("AI analysis"):
-                raise ValueError("AI unavailable")
-            response = response.strip()
+    for field in ("time_to_first_token", "total_latency"):
+        values = sorted(sample[field] for sample in samples)
 
-            # Safe markdown removal
-            if response.startswith("```"):
-                response = response.replace("```json", "").replace("```", "").strip()
+        for label, percentile in (("p50", 0.5), ("p95", 0.95)):
+            stats[f"{label}_{field}"] = (
+                values[min(len(values) - 1, int(percentile * len(values)))] if values else None
+            )
 
-            results = json.loads(response)
+    return stats
 
-            return results
 
-    except Exception as e:
+@cache_resource
+def get_llm_router():
+    return ProviderRouter([GroqProvider(), GeminiProvider()])
 
-            st.error(f"Batch analysis error: {e}")
 
-            return [
-                {"sentiment": "Neutral", "topic": "Unknown", "urgency": "Low"}
-                for _ in texts
-            ]
+def get_classification_models():
+    """Models the router may send classification prompts to, in provider order."""
+    return get_llm_router().models_for("classification")
 
-def analyze_in_batches(texts, batch_size=10):
-    all_results = []
 
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i+batch_size]
+def configure_llm_providers(providers, hedge=None):
+    """Replaces the providers behind generate_ai_response, e.g. with StubProvider."""
+    get_llm_router().set_providers(providers, hedge=hedge)
 
-        results = batch_analyze_texts(batch)
 
-        # 🔁 Retry once if mismatch
-        if len(results) != len(batch):
-            print("Retrying batch due to mismatch...")
-            results = batch_analyze_texts(batch)
+def get_llm_provider_stats():
+    return get_llm_router().snapshot()
 
-        # 🛡 Final safety fallback
-        if len(results) != len(batch):
-            print("Batch still mismatched. Filling defaults.")
-            results = [
-                {"sentiment": "Neutral", "topic": "Unknown", "urgency": "Low"}
-                for _ in batch
-            ]
 
-        all_results.extend(results)
+# Process-wide quota shared by every generate_ai_response caller. Requests
+# wait in a priority queue and are released at LLM_QUOTA_HEADROOM of the
+# configured limits, with bursts capped at LLM_BURST_SECONDS of quota.
+LLM_QUOTA_HEADROOM = 0.9
+LLM_BURST_SECONDS = 10.0
 
-    return all_results
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
 
+LLM_OUTPUT_TOKEN_ESTIMATES = {
+    "classification": 800,
+    "premium": 600,
+    "general": 400,
+}
 
 
+def estimate_request_tokens(prompt, task_type="general"):
+    return estimate_tokens(prompt) + LLM_OUTPUT_TOKEN_ESTIMATES.get(task_type, 400)
 
 
-def get_sentiment(text):
-    prompt = f"""
-Analyze the sentiment of this text. Reply with EXACTLY one word: Positive, Negative, or Neutral.
+class LLMScheduler:
+    """
+    Admits LLM requests one at a time in (priority, arrival) order once both
+    the requests-per-minute and tokens-per-minute buckets can cover them.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.recent_waits = deque(maxlen=500)
+        self.stats = {
+            "admitted": 0,
+            "admitted_interactive": 0,
+            "admitted_background": 0,
+            "declined": 0,
+            "max_queue_depth": 0,
+            "total_wait": 0.0,
+            "max_wait": 0.0,
+        }
+        self.configure(requests_per_minute, tokens_per_minute)
+
+    def configure(self, requests_per_minute, tokens_per_minute):
+        """Pass None for a limit to disable it."""
+        with self.condition:
+            self.request_bucket = (
+                TokenBucket(requests_per_minute * LLM_QUOTA_HEADROOM, LLM_BURST_SECONDS)
+                if requests_per_minute else None
+            )
+            self.token_bucket = (
+                TokenBucket(tokens_per_minute * LLM_QUOTA_HEADROOM, LLM_BURST_SECONDS)
+                if tokens_per_minute else None
+            )
+            self.condition.notify_all()
 
-Text: {text}
+    def wait_time_locked(self, tokens):
+        wait = 0.0
 
-Sentiment:"""
+        if self.request_bucket:
+            wait = max(wait, self.request_bucket.wait_time(1))
+        if self.token_bucket:
+            wait = max(wait, self.token_bucket.wait_time(tokens))
 
-    try:
-        response = generate_ai_response(prompt).lower()
-
-        if "positive" in response:
-            return "Positive"
-        elif "negative" in response:
-            return "Negative"
-        elif "neutral" in response:
-            return "Neutral"
-        else:
-            
-            return "Neutral"
+        return wait
 
-    except Exception as e:
-        st.error(f"Sentiment analysis error: {e}")
-        return "Neutral"
+    def acquire(self, tokens, priority=PRIORITY_INTERACTIVE):
+        ticket = (priority, next(self.sequence))
+        start = time.monotonic()
 
+        with self.condition:
+            heapq.heappush(self.waiting, ticket)
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], len(self.waiting))
 
-def get_topic(text):
-    prompt = f"Identify the main topic or category of this text in 1-3 words:\n{text}"
-    try:
-        return generate_ai_response(prompt)
+            # A new head may outrank a waiter that was about to go.
+            self.condition.notify_all()
 
-    except:
-        return "General"
+            try:
+                while True:
+                    if self.waiting[0] != ticket:
+                        self.condition.wait()
+                        continue
+
+                    wait = self.wait_time_locked(tokens)
+
+                    if wait <= 0:
+                        break
+
+                    self.condition.wait(timeout=wait)
+
+                if self.request_bucket:
+                    self.request_bucket.consume(1)
+                if self.token_bucket:
+                    self.token_bucket.consume(tokens)
+
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+            waited = time.monotonic() - start
+            self.recent_waits.append(waited)
+            self.stats["admitted"] += 1
+            self.stats["admitted_interactive" if priority == PRIORITY_INTERACTIVE else "admitted_background"] += 1
+            self.stats["total_wait"] += waited
+            self.stats["max_wait"] = max(self.stats["max_wait"], waited)
+
+        return waited
+
+    def try_acquire(self, tokens, priority=PRIORITY_INTERACTIVE):
+        """
+        Admits a request only if nothing is queued and both buckets cover it
+        now; never waits. Used for optional requests such as hedges.
+        """
+        with self.condition:
+            if self.waiting or self.wait_time_locked(tokens) > 0:
+                self.stats["declined"] += 1
+                return False
+
+            if self.request_bucket:
+                self.request_bucket.consume(1)
+            if self.token_bucket:
+                self.token_bucket.consume(tokens)
+
+            self.stats["admitted"] += 1
+            self.stats["admitted_interactive" if priority == PRIORITY_INTERACTIVE else "admitted_background"] += 1
+            self.recent_waits.append(0.0)
+
+        return True
+
+    def snapshot(self):
+        with self.condition:
+            stats = dict(self.stats)
+            stats["queue_depth"] = len(self.waiting)
+            stats["queued_interactive"] = sum(1 for priority, _ in self.waiting if priority == PRIORITY_INTERACTIVE)
+            waits = sorted(self.recent_waits)
+
+        stats["avg_wait"] = stats["total_wait"] / stats["admitted"] if stats["admitted"] else 0.0
+        stats["p95_wait"] = waits[min(len(waits) - 1, int(0.95 * len(waits)))] if waits else 0.0
+
+        return stats
+
+
+@cache_resource
+def get_llm_scheduler():
+    return LLMScheduler(
+        int(get_setting("LLM_REQUESTS_PER_MINUTE")),
+        int(get_setting("LLM_TOKENS_PER_MINUTE")),
+    )
 
 
-def get_urgency(text):
-    prompt = f"Rate the urgency level of this feedback. Reply with only 'High' or 'Low':\n{text}"
-    try:
-        response = generate_ai_response(prompt)
+def configure_llm_rate_limits(requests_per_minute, tokens_per_minute):
+    get_llm_scheduler().configure(requests_per_minute, tokens_per_minute)
 
-        
 
-        if "high" in response.lower():
-            return "High"
-        else:
-            return "Low"
-    except:
-        return "Low"
+def get_llm_queue_stats():
+    return get_llm_scheduler().snapshot()
 
 
-def update_mention_analysis(mention_id, sentiment, topic, urgency):
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            UPDATE mentions
-            SET sentiment=?, topic=?, urgency=?
-            WHERE id=?
-        """,
-            (sentiment, topic, urgency, mention_id),
-        )
-        conn.commit()
-        
-        
-        
-        
-        
-def generate_ai_response(prompt, task_type="general"):
+def generate_ai_response(prompt, task_type="general", priority=None):
+    """
+    Sends prompt to the LLM router once the shared rate limiter admits it.
+    Classification defaults to background priority, everything else
+    (summaries, translation, competitor lookups) to interactive.
+    """
+    return complete_ai_response(prompt, task_type, priority)[0]
 
-    model_name = "llama-3.1-8b-instant"
 
-    
-    if task_type == "premium":
-        model_name = "llama-3.3-70b-versatile"
+def complete_ai_response(prompt, task_type="general", priority=None):
+    """
+    generate_ai_response, returning (response, model) with the model that
+    answered, or model None when every provider failed.
+    """
+    if priority is None:
+        priority = PRIORITY_BACKGROUND if task_type == "classification" else PRIORITY_INTERACTIVE
 
-    
-    if GROQ_API_KEY:
-        try:
-            groq = get_groq_client()
+    scheduler = get_llm_scheduler()
+    tokens = estimate_request_tokens(prompt, task_type)
+    scheduler.acquire(tokens, priority)
 
-            response = groq.chat.completions.create(
-                model=model_name,   # ✅ USE VARIABLE HERE
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.0
-            )
+    try:
+        return get_llm_router().complete(
+            prompt, task_type, admit_hedge=lambda: scheduler.try_acquire(tokens, priority)
+        )
+
+    except Exception as e:
+        notify(logging.ERROR, f"AI providers failed: {e}")
 
-            return response.choices[0].message.content.strip()
+    return "AI analysis temporarily unavailable.", None
 
-        except Exception as groq_error:
-            st.error(f"Groq failed: {groq_error}")
 
-    
-    if API_KEY:
-        try:
-            gemini = get_gemini_client()
+def stream_ai_response(prompt, task_type="general", priority=None):
+    """Streaming counterpart of generate_ai_response; yields text chunks."""
+    if priority is None:
+        priority = PRIORITY_BACKGROUND if task_type == "classification" else PRIORITY_INTERACTIVE
 
-            response = gemini.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=prompt
-            )
+    get_llm_scheduler().acquire(estimate_request_tokens(prompt, task_type), priority)
 
-            return response.text.strip()
+    try:
+        yield from get_llm_router().stream(prompt, task_type)
 
-        except Exception as gemini_error:
-            st.error(f"Gemini failed: {gemini_error}")
+    except Exception as e:
+        notify(logging.ERROR, f"AI providers failed: {e}")
 
-    return "AI analysis temporarily unavailable."
+        yield "AI analysis temporarily unavailable."
 
 
 
@@ -698,15 +4277,39 @@ def calculate_competitive_score(df):
     if df.empty:
         return 0
 
-    total = len(df)
+    sentiment_counts = df["sentiment"].value_counts()
+
+    # Sentiment shares are over analyzed rows, the urgency share over all rows.
+    return competitive_score_from_counts(
+        len(df),
+        sentiment_counts.get("Positive", 0),
+        sentiment_counts.get("Negative", 0),
+        sentiment_counts.get("Neutral", 0),
+        int((df["urgency"] == "High").sum()),
+        sentiment_total=int(df["sentiment"].notna().sum()),
+    )
+
+
+def get_competitive_score(brand_name):
+    """calculate_competitive_score for the brand's analyzed mentions, from the rollups."""
+    return competitive_score_from_counts(*get_score_counts(brand_name))
+
+
+def competitive_score_from_counts(total, positive, negative, neutral, high, sentiment_total=None):
+
+    if not total:
+        return 0
+
+    if sentiment_total is None:
+        sentiment_total = total
 
-    sentiment_counts = df["sentiment"].value_counts(normalize=True)
+    sentiment_total = sentiment_total or 1
 
-    positive = sentiment_counts.get("Positive", 0)
-    negative = sentiment_counts.get("Negative", 0)
-    neutral = sentiment_counts.get("Neutral", 0)
+    positive = positive / sentiment_total
+    negative = negative / sentiment_total
+    neutral = neutral / sentiment_total
 
-    high_urgency = len(df[df["urgency"] == "High"]) / total
+    high_urgency = high / total
 
     
     sentiment_score = (
@@ -728,7 +4331,14 @@ def calculate_competitive_score(df):
 
 
 
-def generate_competition_summary(df_a, df_b, brand_a, brand_b):
+def generate_competition_summary(df_a, df_b, brand_a, brand_b, stream=False, use_cache=True):
+    if use_cache:
+        return with_report_cache(
+            "competition", (brand_a, brand_b), stream,
+            lambda stream: generate_competition_summary(
+                df_a, df_b, brand_a, brand_b, stream=stream, use_cache=False
+            ),
+        )
 
     score_a = calculate_competitive_score(df_a)
     score_b = calculate_competitive_score(df_b)
@@ -788,6 +4398,12 @@ Negative ratio: {round(neg_ratio_a,2)}, High urgency issues: {high_a}
 {brand_b} → Score: {score_b}, Positive ratio: {round(pos_ratio_b,2)}, 
 Negative ratio: {round(neg_ratio_b,2)}, High urgency issues: {high_b}
 
+Representative {brand_a} feedback:
+{representative_feedback_text(df_a)}
+
+Representative {brand_b} feedback:
+{representative_feedback_text(df_b)}
+
 Write a clear competitive insight covering:
 
 1. What {brand_b} is doing better in users' eyes
@@ -807,5 +4423,7 @@ No fluff.
 
 
 
-    return generate_ai_response(prompt)
+    if stream:
+        return stream_ai_response(prompt)
 
+    return generate_ai_response(prompt)
@@ -0,0 +1,238 @@
+"""
+Replay benchmark for the sentiment-spike alert engine.
+
+Generates a synthetic mention stream for one brand: a daily volume cycle,
+a steady negative ratio and high-urgency rate, plus injected incidents (a
+negative-sentiment spike on day 2, before the hour-of-day baselines have
+warmed up, another on day 9 and a high-urgency burst), none starting on an
+hour boundary. The stream is replayed through an AlertEngine in write-back
+sized batches, reporting per-event CPU cost, detection latency for each
+incident and alerts raised outside them; it exits non-zero if an incident
+goes undetected. The replay clock follows the stream, so every mention counts
+as live. Then backfills two subreddits stored one after the other through
+the pending-mention write-back path and reports stale events and alerts,
+both of which should be zero. Finally times analysis write-back with the
+engine on and off.
+
+Run from the repository root:
+    python benchmarks/bench_alerts.py [days]
+"""
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import backend_utils as bu
+
+
+DEFAULT_DAYS = 14
+BRAND = "BenchBrand"
+START = datetime(2024, 1, 1)
+BATCH = 50
+
+BASE_PER_HOUR = 60
+NEGATIVE_RATE = 0.2
+HIGH_RATE = 0.04
+
+# (metric, start hour, duration hours, negative rate, high-urgency rate)
+INCIDENTS = [
+    ("negative_ratio", 24 * 2 + 10.4, 2, 0.6, HIGH_RATE),
+    ("negative_ratio", 24 * 9 + 14.3, 2, 0.6, HIGH_RATE),
+    ("high_urgency", 24 * 11 + 3.6, 1, NEGATIVE_RATE, 0.4),
+]
+
+
+class CollectSink:
+
+    def __init__(self):
+        self.alerts = []
+
+    def emit(self, alert):
+        self.alerts.append(alert)
+
+
+def incident_at(hour):
+    for incident in INCIDENTS:
+        if incident[1] <= hour < incident[1] + incident[2]:
+            return incident
+    return None
+
+
+def make_stream(days, rng):
+    events = []
+
+    for hour in range(days * 24):
+        volume = BASE_PER_HOUR * (1 + 0.6 * math.sin(2 * math.pi * (hour % 24 - 9) / 24))
+
+        for _ in range(int(rng.gauss(volume, math.sqrt(volume)))):
+            offset = rng.uniform(0, 3600)
+            when = START + timedelta(hours=hour, seconds=offset)
+            incident = incident_at(hour + offset / 3600)
+            negative_rate, high_rate = (incident[3], incident[4]) if incident else (NEGATIVE_RATE, HIGH_RATE)
+            sentiment = "Negative" if rng.random() < negative_rate else rng.choice(["Positive", "Neutral"])
+            urgency = "High" if rng.random() < high_rate else "Low"
+            events.append((BRAND, when, sentiment, urgency))
+
+    events.sort(key=lambda event: event[1])
+    return events
+
+
+def replay(events):
+    sink = CollectSink()
+    now = [0.0]
+    engine = bu.AlertEngine([sink], clock=lambda: now[0])
+
+    start = time.process_time()
+    for i in range(0, len(events), BATCH):
+        batch = events[i:i + BATCH]
+        now[0] = batch[-1][1].timestamp()
+        engine.process(batch)
+    cpu = time.process_time() - start
+
+    return sink.alerts, cpu
+
+
+def report_detection(events, alerts):
+    false_alerts = 0
+    matched = set()
+
+    for alert in alerts:
+        raised = datetime.fromisoformat(alert["window_end"])
+        hour = (raised - START).total_seconds() / 3600
+
+        incident = next(
+            (inc for inc in INCIDENTS if inc[0] == alert["metric"] and inc[1] <= hour < inc[1] + inc[2] + 1),
+            None,
+        )
+
+        if incident is None:
+            false_alerts += 1
+            continue
+
+        if incident in matched:
+            continue
+
+        matched.add(incident)
+        began = START + timedelta(hours=incident[1])
+        events_since = sum(1 for event in events if began <= event[1] <= raised)
+        print(
+            f"{incident[0]:>15} incident: detected after {(raised - began).total_seconds() / 60:5.1f} min "
+            f"of stream time ({events_since} mentions), z={alert['zscore']}"
+        )
+
+    missed = [incident for incident in INCIDENTS if incident not in matched]
+
+    for incident in missed:
+        print(f"{incident[0]:>15} incident: NOT detected")
+
+    print(f"alerts outside incidents: {false_alerts}")
+    return missed
+
+
+def fresh_engine(enabled, sinks):
+    bu.DB_NAME = os.path.join(tempfile.mkdtemp(), "alerts.db")
+    bu.init_db()
+    bu.ALERTS_ENABLED = enabled
+    bu.get_alert_engine.clear()
+    bu.configure_alert_sinks(sinks)
+
+
+def report_backfill(events, page=500):
+    # Each subreddit's history is stored in full before the next one, so
+    # mention ids run through time twice.
+    sink = CollectSink()
+    fresh_engine(True, [sink])
+
+    by_sub = sorted(enumerate(events), key=lambda item: (item[0] % 2, item[1][1]))
+
+    with bu.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO mentions (brand, source, text, url, timestamp) VALUES (?, ?, ?, ?, ?)",
+            (
+                (BRAND, "Reddit", f"post {i}", f"https://reddit.com/r/sub{i % 2}/{i}/", event[1])
+                for i, event in by_sub
+            ),
+        )
+
+    outcome = {
+        f"https://reddit.com/r/sub{i % 2}/{i}/": (event[2], event[3])
+        for i, event in by_sub
+    }
+
+    after = None
+
+    while True:
+        pending = bu.get_pending_mentions(BRAND, limit=page, after=after)
+
+        if pending.empty:
+            break
+
+        with bu.get_connection() as conn:
+            urls = dict(conn.execute(
+                f"SELECT id, url FROM mentions WHERE id IN ({','.join('?' * len(pending))})",
+                [int(i) for i in pending["id"]],
+            ).fetchall())
+
+        bu.update_mentions_analysis_bulk(
+            [(row.id, *outcome[urls[row.id]][:1], "x", outcome[urls[row.id]][1]) for row in pending.itertuples()],
+            chunk_size=200,
+        )
+        last = pending.iloc[-1]
+        after = (last["timestamp"], int(last["id"]))
+
+    stats = bu.get_alert_stats()
+    print(
+        f"backfill of 2 subreddits, {len(events)} mentions: {stats['stale_events']} stale, "
+        f"{stats['backfill_events']} backfill events, {len(sink.alerts)} alerts"
+    )
+
+
+def time_write_back(count, enabled):
+    fresh_engine(enabled, [bu.SQLiteAlertSink()])
+
+    with bu.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO mentions (brand, source, text, url, timestamp) VALUES (?, ?, ?, ?, ?)",
+            (
+                (BRAND, "Reddit", f"post {i}", f"https://reddit.com/{i}/", START + timedelta(seconds=30 * i))
+                for i in range(count)
+            ),
+        )
+
+    rng = random.Random(1)
+    updates = [(i + 1, rng.choice(["Positive", "Negative", "Neutral"]), "x", "Low") for i in range(count)]
+
+    start = time.perf_counter()
+    bu.update_mentions_analysis_bulk(updates, chunk_size=200)
+    return time.perf_counter() - start
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DAYS
+    events = make_stream(days, random.Random(0))
+
+    alerts, cpu = replay(events)
+
+    print(f"stream: {len(events)} mentions over {days} days, replayed in batches of {BATCH}")
+    print(f"per-event CPU: {cpu / len(events) * 1e6:.2f} us ({len(events) / cpu:,.0f} events/s)")
+    missed = report_detection(events, alerts)
+    report_backfill(events)
+
+    count = 20000
+    off = time_write_back(count, False)
+    on = time_write_back(count, True)
+    print(f"write-back of {count} mentions: {off:.2f} s without alerts, {on:.2f} s with alerts")
+
+    if missed:
+        print(f"FAIL: {len(missed)} incident(s) not detected")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
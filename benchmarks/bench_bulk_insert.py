@@ -0,0 +1,59 @@
+"""
+Benchmark for the mention insert path.
+
+Inserts the same rows once through per-row add_mention calls and once
+through a single add_mentions batch, each into a fresh database.
+
+Run from the repository root:
+    python benchmarks/bench_bulk_insert.py [row_count]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import backend_utils as bu
+
+
+DEFAULT_ROWS = 10000
+
+
+def make_rows(count):
+    now = datetime.now()
+    return [
+        ("BenchBrand", "Reddit", f"BenchBrand post {i}", f"https://reddit.com/r/bench/{i}/", now)
+        for i in range(count)
+    ]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+    rows = make_rows(count)
+    tmp_dir = tempfile.mkdtemp()
+
+    bu.DB_NAME = os.path.join(tmp_dir, "per_row.db")
+    bu.init_db()
+    start = time.perf_counter()
+    inserted_old = sum(1 for row in rows if bu.add_mention(*row))
+    per_row = time.perf_counter() - start
+
+    bu.DB_NAME = os.path.join(tmp_dir, "bulk.db")
+    bu.init_db()
+    start = time.perf_counter()
+    inserted_new = bu.add_mentions(rows)
+    bulk = time.perf_counter() - start
+
+    assert inserted_old == inserted_new == count
+
+    print(f"rows:       {count}")
+    print(f"add_mention:  {per_row:8.3f} s  ({count / per_row:10.0f} rows/s)")
+    print(f"add_mentions: {bulk:8.3f} s  ({count / bulk:10.0f} rows/s)")
+    print(f"speedup:      {per_row / bulk:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
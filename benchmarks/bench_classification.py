@@ -0,0 +1,76 @@
+"""
+Benchmark for the classification scheduler.
+
+Replaces complete_ai_response with a mock LLM whose latency grows with the
+number of items in the prompt, then classifies the same unique texts with
+sequential fixed batches of 10 and with the concurrent adaptive scheduler.
+
+Run from the repository root:
+    python benchmarks/bench_classification.py [text_count]
+"""
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import backend_utils as bu
+
+
+DEFAULT_TEXTS = 500
+BASE_LATENCY = 0.4
+PER_ITEM_LATENCY = 0.02
+
+ITEM_PATTERN = re.compile(r"^\[(\d+)\] ", re.M)
+
+
+def mock_complete_ai_response(prompt, task_type="general", priority=None):
+    items = ITEM_PATTERN.findall(prompt)
+    time.sleep(BASE_LATENCY + PER_ITEM_LATENCY * len(items))
+    return json.dumps([
+        {"sentiment": "Neutral", "topic": "benchmark", "urgency": "Low"}
+        for _ in items
+    ]), "mock-model"
+
+
+def make_texts(count, seed):
+    rng = random.Random(seed)
+    words = ["brand", "app", "login", "update", "crash", "great", "slow", "price", "support", "feature"]
+    return [
+        f"{seed}-{i} " + " ".join(rng.choice(words) for _ in range(rng.randint(5, 60)))
+        for i in range(count)
+    ]
+
+
+def timed(texts, **kwargs):
+    bu.DB_NAME = os.path.join(tempfile.mkdtemp(), "classify.db")
+    bu.init_db()
+
+    start = time.perf_counter()
+    results = bu.analyze_in_batches(texts, **kwargs)
+    elapsed = time.perf_counter() - start
+
+    assert len(results) == len(texts)
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_TEXTS
+    bu.complete_ai_response = mock_complete_ai_response
+
+    sequential = timed(make_texts(count, "seq"), batch_size=10, max_concurrency=1, local_threshold=None)
+    concurrent = timed(make_texts(count, "conc"), local_threshold=None)
+
+    print(f"texts:      {count}")
+    print(f"sequential: {sequential:7.2f} s  ({count / sequential:7.1f} texts/s)")
+    print(f"concurrent: {concurrent:7.2f} s  ({count / concurrent:7.1f} texts/s)")
+    print(f"speedup:    {sequential / concurrent:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Benchmark for concurrent dashboard reads and ingestion writes.
+
+Runs N reader threads (brand history queries) and M writer threads (small
+mention batches) against the same database for a fixed duration, first with
+a fresh rollback-journal connection per operation (the previous behaviour)
+and then through the pooled WAL connections from get_connection.
+
+Run from the repository root:
+    python benchmarks/bench_db_concurrency.py [readers] [writers] [seconds]
+"""
+import itertools
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import backend_utils as bu
+
+
+SEED_ROWS = 20000
+BATCH_SIZE = 10
+BRANDS = ["Alpha", "Beta", "Gamma", "Delta"]
+
+_url_counter = itertools.count()
+
+
+def make_rows(count):
+    now = datetime.now()
+    return [
+        (BRANDS[i % len(BRANDS)], "Reddit", f"post {i}", f"https://reddit.com/{next(_url_counter)}/", now)
+        for i in range(count)
+    ]
+
+
+def legacy_read(brand):
+    with sqlite3.connect(bu.DB_NAME) as conn:
+        conn.execute(
+            "SELECT * FROM mentions WHERE brand=? ORDER BY timestamp DESC", (brand,)
+        ).fetchall()
+
+
+def legacy_write(rows):
+    with sqlite3.connect(bu.DB_NAME) as conn:
+        for row in rows:
+            conn.execute(
+                "INSERT OR IGNORE INTO mentions (brand, source, text, url, timestamp) VALUES (?, ?, ?, ?, ?)",
+                row,
+            )
+            conn.commit()
+
+
+def pooled_read(brand):
+    with bu.get_connection() as conn:
+        conn.execute(
+            "SELECT * FROM mentions WHERE brand=? ORDER BY timestamp DESC", (brand,)
+        ).fetchall()
+
+
+def pooled_write(rows):
+    bu.add_mentions(rows)
+
+
+def run(read_op, write_op, readers, writers, seconds):
+    stop = threading.Event()
+    counts = {"reads": 0, "writes": 0, "locked": 0}
+    lock = threading.Lock()
+
+    def reader(index):
+        while not stop.is_set():
+            try:
+                read_op(BRANDS[index % len(BRANDS)])
+                key = "reads"
+            except sqlite3.OperationalError:
+                key = "locked"
+            with lock:
+                counts[key] += 1
+
+    def writer():
+        while not stop.is_set():
+            try:
+                write_op(make_rows(BATCH_SIZE))
+                key = "writes"
+            except sqlite3.OperationalError:
+                key = "locked"
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+
+    for thread in threads:
+        thread.start()
+
+    time.sleep(seconds)
+    stop.set()
+
+    for thread in threads:
+        thread.join()
+
+    return {key: value / seconds for key, value in counts.items()}
+
+
+def seed(path, wal):
+    bu.DB_NAME = path
+
+    if wal:
+        bu.init_db()
+        bu.add_mentions(make_rows(SEED_ROWS))
+        return
+
+    with sqlite3.connect(path) as conn:
+        conn.execute("""
+            CREATE TABLE mentions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                brand TEXT NOT NULL,
+                source TEXT NOT NULL,
+                text TEXT NOT NULL,
+                url TEXT UNIQUE,
+                timestamp DATETIME,
+                sentiment TEXT,
+                topic TEXT,
+                urgency TEXT
+            )
+        """)
+        conn.executemany(
+            "INSERT INTO mentions (brand, source, text, url, timestamp) VALUES (?, ?, ?, ?, ?)",
+            make_rows(SEED_ROWS),
+        )
+
+
+def main():
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+    tmp_dir = tempfile.mkdtemp()
+
+    print(f"readers={readers} writers={writers} duration={seconds}s seed={SEED_ROWS} rows")
+    print(f"{'mode':<10} {'reads/s':>10} {'write batches/s':>16} {'locked/s':>10}")
+
+    seed(os.path.join(tmp_dir, "legacy.db"), wal=False)
+    before = run(legacy_read, legacy_write, readers, writers, seconds)
+    print(f"{'before':<10} {before['reads']:>10.1f} {before['writes']:>16.1f} {before['locked']:>10.1f}")
+
+    seed(os.path.join(tmp_dir, "pooled.db"), wal=True)
+    after = run(pooled_read, pooled_write, readers, writers, seconds)
+    print(f"{'after':<10} {after['reads']:>10.1f} {after['writes']:>16.1f} {after['locked']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark for concurrent subreddit ingestion.
+
+Serves fake PullPush responses from a local HTTP server with a fixed delay
+and times fetch_reddit_mentions for a growing number of subreddits, once
+sequentially (max_workers=1) and once with the concurrent engine, then
+times a refresh, which only asks for posts after the stored cursors.
+
+The mock host gets the production api.pullpush.io entry of HOST_LIMITS, so
+request spacing is what it is in production. With a 0.5 s spacing and a
+0.5 s response, that spacing bounds wall time, which stays linear in the
+number of subreddits. Pass a min_interval in seconds to see how the engine
+scales without it. The limit in effect is printed with the results.
+
+Run from the repository root:
+    python benchmarks/bench_ingestion.py [min_interval]
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import backend_utils as bu
+
+
+RESPONSE_DELAY = 0.5
+POSTS_PER_SUBREDDIT = 3
+SUBREDDIT_COUNTS = [1, 4, 8, 16, 32]
+CREATED_BASE = time.time() - 3600
+
+
+class MockRedditHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        sub_name = query.get("subreddit", ["unknown"])[0]
+        brand = query.get("q", ["brand"])[0]
+        after = float(query.get("after", ["0"])[0])
+        size = int(query.get("size", ["25"])[0])
+
+        time.sleep(RESPONSE_DELAY)
+
+        posts = [
+            {
+                "title": f"{brand} post {i} in {sub_name}",
+                "selftext": "benchmark body",
+                "permalink": f"/r/{sub_name}/comments/{i}/",
+                "created_utc": CREATED_BASE - i * 60,
+            }
+            for i in range(POSTS_PER_SUBREDDIT)
+        ]
+        posts = sorted(
+            (post for post in posts if post["created_utc"] > after),
+            key=lambda post: post["created_utc"],
+        )[:size]
+        self.server.posts_served += len(posts)
+
+        body = json.dumps({"data": posts}).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_once(brand, subreddits, max_workers):
+    start = time.perf_counter()
+    added = bu.fetch_reddit_mentions(brand, subreddits, max_workers=max_workers)
+    return time.perf_counter() - start, added
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockRedditHandler)
+    server.posts_served = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    host = f"127.0.0.1:{server.server_port}"
+    bu.PULLPUSH_URL = f"http://{host}/reddit/search/submission/"
+    limits = dict(bu.HOST_LIMITS["api.pullpush.io"])
+    label = "production api.pullpush.io limit"
+
+    if len(sys.argv) > 1:
+        limits["min_interval"] = float(sys.argv[1])
+        label = "overridden, not the production limit"
+
+    bu.HOST_LIMITS[host] = limits
+    print(f"host limit: concurrency {limits['concurrency']}, min_interval {limits['min_interval']} s ({label})")
+    print(f"mock response delay: {RESPONSE_DELAY} s")
+
+    tmp_dir = tempfile.mkdtemp()
+
+    print(f"{'subreddits':>10} {'sequential s':>13} {'concurrent s':>13} {'speedup':>8} {'refresh posts':>14}")
+
+    for count in SUBREDDIT_COUNTS:
+        subreddits = [f"sub{i}" for i in range(count)]
+        timings = []
+
+        for mode, workers in (("seq", 1), ("conc", bu.FETCH_MAX_WORKERS)):
+            bu.DB_NAME = os.path.join(tmp_dir, f"bench_{count}_{mode}.db")
+            bu.init_db()
+            bu.reset_host_limiters()
+
+            elapsed, added = run_once(f"Brand{count}", subreddits, workers)
+            assert added == count * POSTS_PER_SUBREDDIT, added
+            timings.append(elapsed)
+
+        server.posts_served = 0
+        _, added = run_once(f"Brand{count}", subreddits, bu.FETCH_MAX_WORKERS)
+        assert added == 0, added
+
+        print(
+            f"{count:>10} {timings[0]:>13.2f} {timings[1]:>13.2f} "
+            f"{timings[0] / timings[1]:>7.1f}x {server.posts_served:>14}"
+        )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
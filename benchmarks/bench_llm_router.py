@@ -0,0 +1,76 @@
+"""
+Benchmark for the LLM provider router during a provider brown-out.
+
+The primary stub provider answers slowly and fails most calls; the secondary
+is healthy. Compares the old fixed order (always try the primary first, fall
+back after it fails) with the router, which opens the primary's circuit and
+routes to the healthy provider.
+
+Run from the repository root:
+    python benchmarks/bench_llm_router.py [calls]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import backend_utils as bu
+
+
+DEFAULT_CALLS = 50
+BROWNOUT_LATENCY = 0.5
+BROWNOUT_FAILURE_RATE = 0.8
+HEALTHY_LATENCY = 0.1
+
+
+def make_providers(seed):
+    rng = random.Random(seed)
+
+    def brownout(prompt, model):
+        if rng.random() < BROWNOUT_FAILURE_RATE:
+            raise RuntimeError("503 Service Unavailable")
+        return "primary"
+
+    return [
+        bu.StubProvider("primary", brownout, latency=BROWNOUT_LATENCY),
+        bu.StubProvider("secondary", "secondary", latency=HEALTHY_LATENCY),
+    ]
+
+
+def fixed_order(providers, prompt):
+    for provider in providers:
+        try:
+            return provider.complete(prompt, provider.model)
+        except Exception:
+            continue
+    return None
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CALLS
+
+    providers = make_providers(seed=1)
+    start = time.perf_counter()
+    for _ in range(calls):
+        fixed_order(providers, "ping")
+    fixed = time.perf_counter() - start
+
+    bu.configure_llm_rate_limits(None, None)
+    bu.configure_llm_providers(make_providers(seed=1), hedge=True)
+    start = time.perf_counter()
+    for _ in range(calls):
+        bu.generate_ai_response("ping")
+    routed = time.perf_counter() - start
+
+    print(f"calls:        {calls}")
+    print(f"fixed order:  {fixed:6.2f} s  ({fixed / calls * 1000:6.0f} ms/call)")
+    print(f"router:       {routed:6.2f} s  ({routed / calls * 1000:6.0f} ms/call)")
+    for key, stats in bu.get_llm_provider_stats().items():
+        print(f"  {key}: {stats['state']}, error rate {stats['error_rate']:.2f}, samples {stats['samples']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark for map-reduce summarization.
+
+Uses a stub LLM provider whose latency grows with prompt size and measures,
+for growing corpora, the latency, LLM calls and estimated prompt tokens of:
+a cold dashboard summary (capped at SUMMARY_INTERACTIVE_MAP_CALLS map calls,
+with the share of posts it covered), the worker's background warm-up of
+every chunk, and a dashboard summary after 5% new mentions arrive on top of
+the warmed cache.
+
+Run from the repository root:
+    python benchmarks/bench_map_reduce_summary.py
+"""
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import pandas as pd
+
+import backend_utils as bu
+
+
+CORPUS_SIZES = [50, 500, 2000, 5000]
+BASE_LATENCY = 0.2
+LATENCY_PER_1K_TOKENS = 0.3
+
+
+def stub_llm(prompt, model):
+    time.sleep(BASE_LATENCY + LATENCY_PER_1K_TOKENS * bu.estimate_tokens(prompt) / 1000)
+    return "- users report recurring issues\n- some praise speed\n- pricing concerns"
+
+
+def make_corpus(count, rng, start_id=1):
+    words = ["login", "crash", "slow", "price", "support", "update", "broken", "refund", "api", "error"]
+    return pd.DataFrame({
+        "id": range(start_id, start_id + count),
+        "text": [" ".join(rng.choice(words) for _ in range(rng.randint(20, 80))) for _ in range(count)],
+        "sentiment": "Negative",
+        "topic": "issues",
+        "urgency": "Low",
+    })
+
+
+def measure(run, final_calls=1):
+    before = bu.get_summary_stats()
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    after = bu.get_summary_stats()
+
+    calls = (
+        after["map_calls"] - before["map_calls"]
+        + after["reduce_calls"] - before["reduce_calls"]
+        + final_calls
+    )
+    tokens = after["prompt_tokens"] - before["prompt_tokens"]
+    partial = after["partial_summaries"] > before["partial_summaries"]
+
+    return elapsed, calls, tokens, partial
+
+
+def coverage(df):
+    """Share of distinct posts whose map chunk is in the chunk cache."""
+    collapsed = bu.collapse_near_duplicates(df)
+    chunks, sizes = bu.chunk_texts(collapsed["text"].tolist(), counts=True)
+
+    if len(chunks) <= 1:
+        return 1.0
+
+    keys = [
+        hashlib.sha256(bu.summary_chunk_prompt(chunk, "negative", 0).encode("utf-8")).hexdigest()
+        for chunk in chunks
+    ]
+
+    with bu.get_connection() as conn:
+        cached = {key for key, in conn.execute("SELECT key FROM summary_chunk_cache")}
+
+    return sum(size for key, size in zip(keys, sizes) if key in cached) / sum(sizes)
+
+
+def warm_up(df):
+    # What worker.py's summarize job does, minus loading the brand's mentions.
+    bu.condense_feedback(bu.collapse_near_duplicates(df), "negative", priority=bu.PRIORITY_BACKGROUND)
+
+
+def main():
+    rng = random.Random(7)
+    bu.configure_llm_providers([bu.StubProvider("stub", stub_llm)], hedge=False)
+    bu.configure_llm_rate_limits(None, None)
+
+    print(f"map calls per dashboard summary capped at {bu.SUMMARY_INTERACTIVE_MAP_CALLS}")
+    print(
+        f"{'mentions':>8} {'chars':>9} | {'cold s':>7} {'calls':>6} {'tokens':>8} {'covered':>8} | "
+        f"{'worker s':>8} {'calls':>6} {'tokens':>8} | {'warm s':>7} {'calls':>6} {'tokens':>8} {'covered':>8}"
+    )
+
+    for size in CORPUS_SIZES:
+        bu.DB_NAME = os.path.join(tempfile.mkdtemp(), "summary.db")
+        bu.init_db()
+
+        df = make_corpus(size, rng)
+        cold = measure(lambda: bu.generate_negative_report_summary(df))
+        cold_covered = coverage(df)
+
+        grown = pd.concat([df, make_corpus(max(1, size // 20), rng, start_id=size + 1)], ignore_index=True)
+        worker = measure(lambda: warm_up(df), final_calls=0)
+        warm = measure(lambda: bu.generate_negative_report_summary(grown))
+        warm_covered = coverage(grown)
+
+        chars = int(df["text"].str.len().sum())
+        print(
+            f"{size:>8} {chars:>9} | {cold[0]:>7.2f} {cold[1]:>6} {cold[2]:>8} {cold_covered:>8.0%} | "
+            f"{worker[0]:>8.2f} {worker[1]:>6} {worker[2]:>8} | "
+            f"{warm[0]:>7.2f} {warm[1]:>6} {warm[2]:>8} {warm_covered:>8.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark for the dashboard rollup tables.
+
+Builds a database of analyzed mentions for one brand and times the
+dashboard's sentiment, topic and score computations from the raw frame
+(value_counts, topic explode, calculate_competitive_score) against the
+rollup queries, plus the write-back cost of keeping the rollups current.
+
+Run from the repository root:
+    python benchmarks/bench_rollups.py [mention_count]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import backend_utils as bu
+
+
+DEFAULT_MENTIONS = 200000
+BRAND = "BenchBrand"
+TOPICS = ["login", "pricing", "support", "api, errors", "speed", "mobile app, crashes"]
+
+
+def seed(count, rng):
+    start = datetime(2024, 1, 1)
+
+    with bu.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO mentions (brand, source, text, url, timestamp) VALUES (?, ?, ?, ?, ?)",
+            (
+                (BRAND, "Reddit", f"post {i}", f"https://reddit.com/{i}/", start + timedelta(minutes=3 * i))
+                for i in range(count)
+            ),
+        )
+
+    return [
+        (i + 1, rng.choice(["Positive", "Negative", "Neutral"]), rng.choice(TOPICS), rng.choice(["High", "Medium", "Low"]))
+        for i in range(count)
+    ]
+
+
+def from_raw():
+    df = bu.get_all_mentions_as_df(BRAND)
+    analyzed = df.dropna(subset=["sentiment"])
+    analyzed["sentiment"].value_counts()
+    analyzed["topic"].str.split(",").explode().str.strip().value_counts()
+    return bu.calculate_competitive_score(analyzed)
+
+
+def from_rollups():
+    bu.get_sentiment_counts(BRAND)
+    bu.get_topic_counts(BRAND)
+    return bu.get_competitive_score(BRAND)
+
+
+def timed(func, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MENTIONS
+    rng = random.Random(0)
+
+    bu.DB_NAME = os.path.join(tempfile.mkdtemp(), "rollups.db")
+    bu.init_db()
+    updates = seed(count, rng)
+
+    start = time.perf_counter()
+    bu.update_mentions_analysis_bulk(updates, chunk_size=5000)
+    write_back = time.perf_counter() - start
+
+    # The raw path re-reads the table on every rerun when nothing is cached.
+    def raw_uncached():
+        bu.invalidate_mention_cache()
+        bu.get_mention_cache(bu.DB_NAME).entries.clear()
+        return from_raw()
+
+    raw, raw_score = timed(raw_uncached, repeat=2)
+    cached, _ = timed(from_raw)
+    rollup, rollup_score = timed(from_rollups)
+
+    assert raw_score == rollup_score, (raw_score, rollup_score)
+    assert not bu.check_rollups(BRAND)
+
+    print(f"mentions:                {count}")
+    print(f"write-back with rollups: {write_back:8.3f} s  ({count / write_back:8.0f} rows/s)")
+    print(f"raw, uncached frame:     {raw * 1000:8.1f} ms")
+    print(f"raw, cached frame:       {cached * 1000:8.1f} ms")
+    print(f"rollups:                 {rollup * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
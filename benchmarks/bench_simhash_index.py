@@ -0,0 +1,115 @@
+"""
+Benchmark for near-duplicate lookups against the persistent SimHash index.
+
+Fills a fresh database with stored_count canonical mentions of one brand
+(random 64-bit hashes, written straight to mentions and simhash_index),
+then times find_near_duplicate for hashes that are a few bits away from a
+stored one (hits) and for unrelated hashes (misses), and the full
+add_mentions path on top of the filled index.
+
+Run from the repository root:
+    python benchmarks/bench_simhash_index.py [stored_count] [lookups]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import backend_utils as bu
+
+
+DEFAULT_STORED = 1000000
+DEFAULT_LOOKUPS = 2000
+BRAND = "BenchBrand"
+CHUNK = 50000
+
+
+def fill_index(count, rng):
+    hashes = rng.integers(0, 2 ** 63, size=count, dtype=np.int64).astype(np.uint64) * np.uint64(2)
+    hashes += rng.integers(0, 2, size=count, dtype=np.int64).astype(np.uint64)
+    now = datetime.now()
+
+    with bu.get_connection() as conn:
+        for start in range(0, count, CHUNK):
+            chunk = [int(value) for value in hashes[start:start + CHUNK]]
+
+            conn.executemany(
+                "INSERT INTO mentions (id, brand, source, text, url, timestamp, simhash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (start + i + 1, BRAND, "Reddit", f"post {start + i}", f"https://reddit.com/r/bench/{start + i}/", now, bu.to_signed64(value))
+                    for i, value in enumerate(chunk)
+                ],
+            )
+            conn.executemany(
+                "INSERT INTO simhash_index (brand, band_key, mention_id, simhash) VALUES (?, ?, ?, ?)",
+                [
+                    (BRAND, key, start + i + 1, bu.to_signed64(value))
+                    for i, value in enumerate(chunk)
+                    for key in bu.simhash_band_keys(value)
+                ],
+            )
+            conn.commit()
+
+    return hashes
+
+
+def flip_bits(value, bits, rng):
+    for bit in rng.sample(range(bu.SIMHASH_BITS), bits):
+        value ^= 1 << bit
+    return value
+
+
+def time_lookups(values):
+    with bu.get_connection() as conn:
+        start = time.perf_counter()
+        found = [bu.find_near_duplicate(conn, BRAND, value) for value in values]
+        elapsed = time.perf_counter() - start
+
+    return found, elapsed
+
+
+def main():
+    stored = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_STORED
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_LOOKUPS
+    rng = random.Random(0)
+
+    bu.DB_NAME = os.path.join(tempfile.mkdtemp(), "simhash.db")
+    bu.init_db()
+
+    start = time.perf_counter()
+    hashes = fill_index(stored, np.random.default_rng(0))
+    print(f"stored mentions:  {stored}  (filled in {time.perf_counter() - start:.1f} s)")
+
+    targets = [rng.randrange(stored) for _ in range(lookups)]
+    near = [flip_bits(int(hashes[i]), bu.SIMHASH_MAX_DISTANCE, rng) for i in targets]
+    far = [rng.getrandbits(64) for _ in range(lookups)]
+
+    found, hit_time = time_lookups(near)
+    correct = sum(1 for mention_id, i in zip(found, targets) if mention_id == i + 1)
+
+    missed, miss_time = time_lookups(far)
+    false_hits = sum(1 for mention_id in missed if mention_id is not None)
+
+    rows = [
+        (BRAND, "Reddit", f"{BRAND} post about feature {i} and pricing tier {i * 7}", f"https://reddit.com/r/bench/new/{i}/", datetime.now())
+        for i in range(lookups)
+    ]
+    start = time.perf_counter()
+    inserted = bu.add_mentions(rows)
+    insert_time = time.perf_counter() - start
+
+    print(f"near lookups:     {lookups}  {hit_time / lookups * 1e6:8.1f} us/lookup  ({correct} found)")
+    print(f"far lookups:      {lookups}  {miss_time / lookups * 1e6:8.1f} us/lookup  ({false_hits} false matches)")
+    print(f"add_mentions:     {inserted}  {insert_time / lookups * 1e6:8.1f} us/row (hash, lookup, insert, index)")
+    print(f"dedup stats:      {bu.get_dedup_stats()}")
+
+
+if __name__ == "__main__":
+    main()
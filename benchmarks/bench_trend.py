@@ -0,0 +1,95 @@
+"""
+Latency check for the sentiment trend API and the raw-data range query.
+
+Seeds one brand with mention_count analyzed mentions (one a minute), builds
+the rollups, then times get_sentiment_trend for the dashboard's windows and
+get_mentions_in_range for the raw-data tab. Exits non-zero if any of them
+is slower than LATENCY_BUDGET_MS.
+
+Run from the repository root:
+    python benchmarks/bench_trend.py [mention_count]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import backend_utils as bu
+
+
+DEFAULT_MENTIONS = 1000000
+LATENCY_BUDGET_MS = 250
+BRAND = "BenchBrand"
+START = datetime(2024, 1, 1)
+
+
+def seed(count, rng):
+    with bu.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO mentions (brand, source, text, url, timestamp, sentiment, topic, urgency) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    BRAND, "Reddit", f"post {i}", f"https://reddit.com/{i}/", START + timedelta(minutes=i),
+                    rng.choice(["Positive", "Negative", "Neutral"]),
+                    rng.choice(["login", "pricing", "support, api"]),
+                    rng.choice(["High", "Medium", "Low"]),
+                )
+                for i in range(count)
+            ),
+        )
+
+    bu.rebuild_rollups(BRAND)
+
+    return START + timedelta(minutes=count)
+
+
+def timed(func, repeat=5):
+    func()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MENTIONS
+
+    bu.DB_NAME = os.path.join(tempfile.mkdtemp(), "trend.db")
+    bu.init_db()
+
+    started = time.perf_counter()
+    end = seed(count, random.Random(0))
+    print(f"mentions: {count} over {(end - START).days} days (seeded in {time.perf_counter() - started:.1f} s)")
+
+    cases = {
+        "trend, day, full history": lambda: bu.get_sentiment_trend(BRAND, "day", START, end),
+        "trend, day, last 30 days": lambda: bu.get_sentiment_trend(BRAND, "day", end - timedelta(days=30), end),
+        "trend, hour, last 7 days": lambda: bu.get_sentiment_trend(BRAND, "hour", end - timedelta(days=7), end),
+        "trend, hour, full history": lambda: bu.get_sentiment_trend(BRAND, "hour", START, end),
+        "raw data, last 7 days": lambda: bu.get_mentions_in_range(BRAND, end - timedelta(days=7), end, limit=5000),
+    }
+
+    over_budget = []
+
+    for name, func in cases.items():
+        elapsed, result = timed(func)
+        print(f"{name:28} {elapsed:8.1f} ms  ({len(result)} rows)")
+
+        if elapsed > LATENCY_BUDGET_MS:
+            over_budget.append(name)
+
+    if over_budget:
+        print(f"FAIL: over the {LATENCY_BUDGET_MS} ms budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+    print(f"OK: all queries under {LATENCY_BUDGET_MS} ms")
+
+
+if __name__ == "__main__":
+    main()
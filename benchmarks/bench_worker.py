@@ -0,0 +1,135 @@
+"""
+Benchmark for the background worker pipeline.
+
+Serves fake PullPush responses from a local HTTP server and answers
+classification prompts with a stub LLM provider, then runs one cycle over
+several brands twice: fetch-everything-then-classify, as the dashboard
+buttons do, and worker.run_cycle, where classification of one brand
+overlaps the remaining fetches. Also prints the jobs the worker recorded.
+
+Run from the repository root:
+    python benchmarks/bench_worker.py
+"""
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import backend_utils as bu
+import worker
+
+
+BRANDS = ["Acme", "Globex", "Initech", "Umbrella"]
+SUBREDDITS = ["sub0", "sub1", "sub2", "sub3"]
+POSTS_PER_SUBREDDIT = 40
+RESPONSE_DELAY = 0.5
+LLM_BASE_LATENCY = 0.3
+LLM_PER_ITEM_LATENCY = 0.01
+
+ITEM_PATTERN = re.compile(r"^\[(\d+)\] ", re.M)
+WORDS = [f"word{i}" for i in range(2000)]
+
+
+class MockPullPushHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        sub_name = query.get("subreddit", ["unknown"])[0]
+        brand = query.get("q", ["brand"])[0]
+        after = float(query.get("after", ["0"])[0])
+        rng = random.Random(f"{brand}-{sub_name}")
+
+        time.sleep(RESPONSE_DELAY)
+
+        posts = [
+            {
+                "title": f"{brand} " + " ".join(rng.choice(WORDS) for _ in range(12)),
+                "selftext": " ".join(rng.choice(WORDS) for _ in range(30)),
+                "permalink": f"/r/{sub_name}/comments/{brand}{i}/",
+                "created_utc": self.server.created_base - i * 60,
+            }
+            for i in range(POSTS_PER_SUBREDDIT)
+        ]
+        posts = [post for post in posts if post["created_utc"] > after]
+
+        body = json.dumps({"data": posts}).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def stub_llm(prompt, model):
+    items = ITEM_PATTERN.findall(prompt)
+    time.sleep(LLM_BASE_LATENCY + LLM_PER_ITEM_LATENCY * len(items))
+    return json.dumps([
+        {"index": int(i), "sentiment": "Neutral", "topic": "benchmark", "urgency": "Low"}
+        for i in items
+    ])
+
+
+def sequential_cycle(targets):
+    added = sum(bu.fetch_reddit_mentions(brand, subs) for brand, subs in targets.items())
+    analyzed = sum(bu.analyze_pending_mentions(brand)["analyzed"] for brand in targets)
+    return {"added": added, "analyzed": analyzed, "failed": 0}
+
+
+def timed(mode, cycle, targets, tmp_dir):
+    bu.DB_NAME = os.path.join(tmp_dir, f"{mode}.db")
+    bu.init_db()
+    bu.reset_host_limiters()
+
+    start = time.perf_counter()
+    stats = cycle(targets)
+    return time.perf_counter() - start, stats
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockPullPushHandler)
+    server.created_base = time.time() - 3600
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    host = f"127.0.0.1:{server.server_port}"
+    bu.PULLPUSH_URL = f"http://{host}/reddit/search/submission/"
+    bu.HOST_LIMITS[host] = {"concurrency": 4, "min_interval": 0.05}
+
+    bu.configure_llm_providers([bu.StubProvider("stub", stub_llm)], hedge=False)
+    bu.configure_llm_rate_limits(None, None)
+
+    targets = {brand: SUBREDDITS for brand in BRANDS}
+    tmp_dir = tempfile.mkdtemp()
+
+    sequential, seq_stats = timed("sequential", sequential_cycle, targets, tmp_dir)
+    pipelined, pipe_stats = timed("pipelined", worker.run_cycle, targets, tmp_dir)
+
+    assert seq_stats["added"] == pipe_stats["added"], (seq_stats, pipe_stats)
+    assert pipe_stats["analyzed"] == pipe_stats["added"] - sum(bu.count_duplicates(brand) for brand in BRANDS), pipe_stats
+    assert sum(bu.count_pending(brand) for brand in BRANDS) == 0
+
+    jobs = bu.get_recent_jobs(limit=100)
+
+    print(f"brands x subreddits: {len(BRANDS)} x {len(SUBREDDITS)}, {pipe_stats['added']} mentions")
+    print(f"fetch then classify: {sequential:6.2f} s  {seq_stats}")
+    print(f"worker pipeline:     {pipelined:6.2f} s  {pipe_stats}")
+    print(f"speedup:             {sequential / pipelined:6.1f}x")
+    print(f"jobs recorded:       {jobs.groupby(['kind', 'status']).size().to_dict()}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
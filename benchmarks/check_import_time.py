@@ -0,0 +1,75 @@
+"""
+Import-time budget check for backend_utils.
+
+Imports backend_utils in a fresh interpreter under `python -X importtime`,
+several times, and exits non-zero if the fastest run exceeds the budget or
+if the import pulled in streamlit, requests or an LLM provider SDK, which
+must only load on first use. Nearly all of the budget is pandas and NumPy.
+
+Run from the repository root:
+    python benchmarks/check_import_time.py [budget_ms]
+"""
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BUDGET_MS = 500
+RUNS = 3
+FORBIDDEN = ("streamlit", "requests", "groq", "google.genai")
+
+
+def measure():
+    """Returns (cumulative microseconds, imported module names) for one import."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend_utils"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    total = None
+    modules = set()
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        modules.add(name)
+
+        if name == "backend_utils":
+            total = int(cumulative)
+
+    return total, modules
+
+
+def main():
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+    runs = [measure() for _ in range(RUNS)]
+
+    best_ms = min(total for total, _ in runs) / 1000
+    leaked = sorted(
+        name for name in runs[0][1]
+        if any(name == module or name.startswith(module + ".") for module in FORBIDDEN)
+    )
+
+    print(f"import backend_utils: {best_ms:.0f} ms (best of {RUNS}, budget {budget_ms:.0f} ms)")
+
+    if leaked:
+        print(f"FAIL: imported at module load: {', '.join(leaked)}")
+        sys.exit(1)
+
+    if best_ms > budget_ms:
+        print("FAIL: import-time budget exceeded")
+        sys.exit(1)
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Query-plan regression check for the dashboard's hot queries.
+
+Builds a migrated database with mentions spread over several brands, runs
+EXPLAIN QUERY PLAN for every entry in backend_utils.HOT_QUERIES and exits
+non-zero if any of them falls back to a full scan or a temporary sort.
+
+Run from the repository root:
+    python benchmarks/check_query_plans.py
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import backend_utils as bu
+
+
+SEED_ROWS = 50000
+BRANDS = ["Alpha", "Beta", "Gamma", "Delta", "Epsilon"]
+
+
+def main():
+    bu.DB_NAME = os.path.join(tempfile.mkdtemp(), "plans.db")
+    bu.init_db()
+
+    start = datetime(2024, 1, 1)
+    bu.add_mentions(
+        (BRANDS[i % len(BRANDS)], "Reddit", f"post {i}", f"https://reddit.com/{i}/", start + timedelta(minutes=i))
+        for i in range(SEED_ROWS)
+    )
+
+    with bu.get_connection() as conn:
+        conn.execute("UPDATE mentions SET sentiment='Neutral' WHERE id % 10 != 0")
+        conn.execute("ANALYZE")
+
+    for name, (sql, params) in bu.HOT_QUERIES.items():
+        print(f"{name}:")
+        for step in bu.explain_query_plan(sql, params):
+            print(f"    {step}")
+
+    problems = bu.check_query_plans()
+
+    if problems:
+        print(f"FAIL: full scan or temp sort in {', '.join(sorted(problems))}")
+        sys.exit(1)
+
+    print("OK: all hot queries are index-backed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Offline evaluation of the local lexicon classifier.
+
+Pairs stored mention texts with the LLM's answers for them from the
+classification cache and reports, per confidence threshold, the fraction of
+LLM calls the local tier would avoid and how often its labels agree with the
+LLM's. The labels on the mentions table are not used: they also hold the
+local tier's own labels and fallback defaults.
+
+Run from the repository root:
+    python benchmarks/eval_local_classifier.py [brand] [db_path]
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import pandas as pd
+
+import backend_utils as bu
+
+
+THRESHOLDS = (0.4, 0.5, 0.6, 0.75, 0.85, 0.9)
+
+
+def load_labelled(brand=None, models=None):
+    """
+    Returns text, sentiment and urgency for every stored mention text the
+    LLM answered, looked up in classification_cache under each model that
+    can serve classification. Reads the cache without touching last_used.
+    """
+    models = models or bu.get_classification_models()
+    sql = "SELECT DISTINCT text FROM mentions"
+    params = []
+
+    if brand:
+        sql += " WHERE brand=?"
+        params.append(brand)
+
+    rows = []
+
+    with bu.get_connection() as conn:
+        texts = [row[0] for row in conn.execute(sql, params)]
+
+        # Stay well below SQLite's bound-parameter limit.
+        step = max(1, 500 // len(models))
+
+        for start in range(0, len(texts), step):
+            chunk = texts[start:start + step]
+            keys = {bu.classification_cache_key(text, model): text for text in chunk for model in models}
+            placeholders = ", ".join("?" for _ in keys)
+            labels = {}
+
+            for key, sentiment, urgency in conn.execute(
+                f"SELECT key, sentiment, urgency FROM classification_cache WHERE key IN ({placeholders})",
+                list(keys),
+            ):
+                labels.setdefault(keys[key], (sentiment, urgency))
+
+            rows.extend((text, *labels[text]) for text in chunk if text in labels)
+
+    return pd.DataFrame(rows, columns=["text", "sentiment", "urgency"])
+
+
+def main():
+    brand = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] else None
+
+    if len(sys.argv) > 2:
+        bu.DB_NAME = sys.argv[2]
+
+    bu.init_db()
+    df = load_labelled(brand)
+
+    print(f"LLM-labelled mention texts: {len(df)}" + (f" for {brand}" if brand else ""))
+
+    if df.empty:
+        return
+
+    report = bu.evaluate_local_classifier(df, THRESHOLDS)
+    print(report.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    print(f"current threshold: {bu.LOCAL_CLASSIFIER_THRESHOLD}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Maintenance commands for the dashboard rollup tables.
+
+Usage:
+    python rollups.py backfill [--brand NAME] [--db PATH]
+    python rollups.py check [--brand NAME] [--db PATH]
+
+backfill rebuilds the rollups from the raw mentions table; check compares
+them with a fresh aggregation and exits non-zero on any mismatch.
+"""
+import argparse
+import time
+
+import backend_utils as bu
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill or check the sentiment and topic rollups.")
+    parser.add_argument("command", choices=["backfill", "check"])
+    parser.add_argument("--brand", help="only this brand (default: all)")
+    parser.add_argument("--db", help="SQLite database path (default: the dashboard's)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.db:
+        bu.DB_NAME = args.db
+
+    bu.init_db()
+
+    if args.command == "backfill":
+        started = time.monotonic()
+        bu.rebuild_rollups(args.brand)
+        print(f"Rollups rebuilt in {time.monotonic() - started:.1f}s")
+        return 0
+
+    mismatches = bu.check_rollups(args.brand)
+
+    for table, key, stored, expected in mismatches[:20]:
+        print(f"{table} {key}: stored {stored}, expected {expected}")
+
+    if mismatches:
+        print(f"FAIL: {len(mismatches)} rollup rows differ from the mentions table")
+        return 1
+
+    print("OK: rollups match the mentions table")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,41 @@
+"""
+Streamlit glue for backend_utils: passes st.secrets in as settings, shows
+backend warnings and errors in the page, and stops the app when no LLM key
+is configured. backend_utils itself never imports streamlit.
+"""
+import logging
+
+import streamlit as st
+
+import backend_utils as bu
+
+
+def show_notification(level, message):
+    if level >= logging.ERROR:
+        st.error(message)
+    elif level >= logging.WARNING:
+        st.warning(message)
+
+
+def read_secrets():
+    try:
+        return {key: st.secrets[key] for key in bu.CONFIG_DEFAULTS if key in st.secrets}
+    except Exception:
+        return {}
+
+
+@st.cache_resource
+def install():
+    bu.configure(**read_secrets())
+    bu.add_notify_hook(show_notification)
+    return True
+
+
+def setup():
+    install()
+
+    if not bu.has_llm_credentials():
+        st.error("❌ No AI API key found. Add GROQ_API_KEY or GEMINI_API_KEY")
+        st.stop()
+
+    bu.init_db()
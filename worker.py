@@ -0,0 +1,291 @@
+"""
+Background ingestion and analysis worker.
+
+Polls the configured brands and subreddits on a schedule, independently of
+any dashboard session. Each cycle is a small producer/consumer pipeline:
+subreddits are fetched concurrently, each result is stored (and
+near-duplicates linked) as it arrives, and brands with new pending mentions
+are handed to a classifier thread that analyzes and writes them back while
+the remaining fetches are still running. Brands with new analyses then have
+their summary chunks condensed at background priority, so dashboard
+summaries only condense what is new. Every fetch and classify step is
+recorded in the worker_jobs table, which the dashboard reads. Mentions the
+LLM gives no usable answer for (e.g. during a provider outage) stay pending
+and the classify job is recorded as partial or failed.
+
+Usage:
+    python worker.py --brand OpenAI --subreddits "OpenAI, ChatGPT" --interval 900
+    python worker.py --config worker.json --once
+
+Workers sharing a database on one host need distinct --worker-id values.
+
+worker.json:
+    {"interval": 900, "brands": {"OpenAI": ["OpenAI", "ChatGPT"]}}
+"""
+import argparse
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import backend_utils as bu
+
+
+log = logging.getLogger("brand_monitor.worker")
+
+
+DEFAULT_INTERVAL = 900
+DEFAULT_SUBREDDITS = "OpenAI, ChatGPT, artificial, singularity"
+
+# Pending mentions are analyzed and written back this many at a time, so a
+# large backlog is committed (and visible on the dashboard) as it goes.
+CLASSIFY_CHUNK = 500
+
+
+def fetch_job(brand_name, sub_name, worker_id=None):
+    job_id = bu.start_job("fetch", brand_name, sub_name, worker_id)
+
+    try:
+        return job_id, bu.fetch_subreddit_data(brand_name, sub_name), None
+    except Exception as e:
+        return job_id, None, str(e)
+
+
+class Classifier(threading.Thread):
+    """Consumes brand names and analyzes their pending mentions."""
+
+    def __init__(self, chunk_size=CLASSIFY_CHUNK, worker_id=None):
+        super().__init__(daemon=True)
+        self.chunk_size = chunk_size
+        self.worker_id = worker_id
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.queued = set()
+        self.analyzed = 0
+        self.changed = set()
+
+    def submit(self, brand_name):
+        with self.lock:
+            if brand_name in self.queued:
+                return
+            self.queued.add(brand_name)
+
+        self.queue.put(brand_name)
+
+    def close(self):
+        self.queue.put(None)
+
+    def run(self):
+        while True:
+            brand_name = self.queue.get()
+
+            if brand_name is None:
+                return
+
+            with self.lock:
+                self.queued.discard(brand_name)
+
+            self.analyze(brand_name)
+
+    def analyze(self, brand_name):
+        if not bu.count_pending(brand_name):
+            return
+
+        job_id = bu.start_job("classify", brand_name, worker=self.worker_id)
+        analyzed = 0
+        unanswered = 0
+        after = None
+
+        try:
+            while True:
+                done = bu.analyze_pending_mentions(brand_name, limit=self.chunk_size, after=after)
+                analyzed += done["analyzed"]
+                unanswered += done["unanswered"]
+                after = done["last"]
+
+                # A chunk without a single answer means the providers are
+                # down; the rest of the backlog waits for the next cycle.
+                if not done["analyzed"] or done["analyzed"] + done["unanswered"] < self.chunk_size:
+                    break
+
+        except Exception as e:
+            log.exception("Classification failed for %s", brand_name)
+            bu.finish_job(job_id, bu.JOB_FAILED, {"analyzed": analyzed, "unanswered": unanswered}, str(e))
+
+        else:
+            result = {"analyzed": analyzed, "unanswered": unanswered}
+
+            if not unanswered:
+                bu.finish_job(job_id, bu.JOB_DONE, result)
+            else:
+                log.warning("No usable AI answer for %d %s mentions; left pending", unanswered, brand_name)
+                bu.finish_job(
+                    job_id,
+                    bu.JOB_PARTIAL if analyzed else bu.JOB_FAILED,
+                    result,
+                    f"no usable AI answer for {unanswered} mentions; left pending",
+                )
+
+        self.analyzed += analyzed
+
+        if analyzed:
+            self.changed.add(brand_name)
+
+
+def summarize_job(brand_name, worker_id=None):
+    """Condenses the brand's new summary chunks so dashboard summaries stay cheap."""
+    job_id = bu.start_job("summarize", brand_name, worker=worker_id)
+
+    try:
+        calls = bu.warm_summary_chunks(brand_name)
+    except Exception as e:
+        log.exception("Summary warm-up failed for %s", brand_name)
+        bu.finish_job(job_id, bu.JOB_FAILED, error=str(e))
+        return
+
+    bu.finish_job(job_id, bu.JOB_DONE, {"llm_calls": calls})
+
+
+def run_cycle(targets, max_workers=bu.FETCH_MAX_WORKERS, chunk_size=CLASSIFY_CHUNK, worker_id=None):
+    """
+    Runs one fetch/dedup/classify/write-back/summarize pass over targets, a
+    dict of brand -> subreddit list. Jobs are recorded under worker_id.
+    Returns {"added", "analyzed", "failed"}.
+    """
+    classifier = Classifier(chunk_size, worker_id)
+    classifier.start()
+
+    # Backlog left by earlier cycles is drained while this cycle fetches.
+    for brand_name in targets:
+        classifier.submit(brand_name)
+
+    jobs = [
+        (brand_name, sub_name)
+        for brand_name, subreddits in targets.items()
+        for sub_name in bu.unique_subreddits(subreddits)
+    ]
+
+    added = 0
+    failed = 0
+    processed_urls = {brand_name: set() for brand_name in targets}
+
+    if jobs:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as pool:
+            futures = {pool.submit(fetch_job, *job, worker_id): job for job in jobs}
+
+            for future in as_completed(futures):
+                brand_name, sub_name = futures[future]
+                job_id, data, error = future.result()
+
+                if not data:
+                    failed += 1
+                    log.warning("All sources failed for %s in r/%s: %s", brand_name, sub_name, error)
+                    bu.finish_job(job_id, bu.JOB_FAILED, error=error or "all sources failed")
+                    continue
+
+                try:
+                    count = bu.store_subreddit_posts(brand_name, sub_name, data, processed_urls[brand_name])
+                except Exception as e:
+                    failed += 1
+                    log.exception("Storing r/%s for %s failed", sub_name, brand_name)
+                    bu.finish_job(job_id, bu.JOB_FAILED, error=str(e))
+                    continue
+
+                bu.finish_job(job_id, bu.JOB_DONE, {"source": data["source"], "added": count})
+                added += count
+
+                if count:
+                    classifier.submit(brand_name)
+
+    classifier.close()
+    classifier.join()
+
+    # After classification, so a large first warm-up never holds up the
+    # write-back of other brands.
+    for brand_name in sorted(classifier.changed):
+        summarize_job(brand_name, worker_id)
+
+    return {"added": added, "analyzed": classifier.analyzed, "failed": failed}
+
+
+def load_targets(args):
+    targets = {}
+    interval = args.interval
+
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+
+        targets.update(config.get("brands", {}))
+        interval = interval or config.get("interval")
+
+    subreddits = [s.strip() for s in args.subreddits.split(",") if s.strip()]
+
+    for brand_name in args.brand or []:
+        targets[brand_name] = subreddits
+
+    return targets, interval or DEFAULT_INTERVAL
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch and analyze brand mentions in the background.")
+    parser.add_argument("--brand", action="append", help="brand to monitor; repeat for several")
+    parser.add_argument("--subreddits", default=DEFAULT_SUBREDDITS, help="comma-separated subreddits for --brand")
+    parser.add_argument("--config", help="JSON file with brands and subreddits")
+    parser.add_argument("--interval", type=float, help=f"seconds between cycles (default {DEFAULT_INTERVAL})")
+    parser.add_argument("--once", action="store_true", help="run a single cycle and exit")
+    parser.add_argument("--db", help="SQLite database path (default: the dashboard's)")
+    parser.add_argument("--max-workers", type=int, default=bu.FETCH_MAX_WORKERS)
+    parser.add_argument("--worker-id", default=socket.gethostname(), help="name jobs are recorded under (default: host name)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    targets, interval = load_targets(args)
+
+    if not targets:
+        print("Nothing to monitor: pass --brand or --config")
+        return 2
+
+    if not bu.has_llm_credentials():
+        print("No AI API key found. Set GROQ_API_KEY or GEMINI_API_KEY")
+        return 2
+
+    if args.db:
+        bu.DB_NAME = args.db
+
+    bu.init_db()
+
+    recovered = bu.recover_interrupted_jobs(args.worker_id)
+
+    if recovered:
+        log.info("Marked %d jobs from a previous run as interrupted", recovered)
+
+    try:
+        while True:
+            started = time.monotonic()
+            stats = run_cycle(targets, max_workers=args.max_workers, worker_id=args.worker_id)
+            elapsed = time.monotonic() - started
+
+            log.info(
+                "Cycle done in %.1fs: %d added, %d analyzed, %d fetches failed",
+                elapsed, stats["added"], stats["analyzed"], stats["failed"],
+            )
+
+            if args.once:
+                return 0
+
+            time.sleep(max(0.0, interval - elapsed))
+
+    except KeyboardInterrupt:
+        log.info("Worker stopped")
+        return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())